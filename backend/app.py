@@ -1,21 +1,28 @@
 import os
-from flask import Flask
-from flask_cors import CORS
 from dotenv import load_dotenv
-from models import db
 
-# .env eviroment variables loading
+# .env eviroment variables loading, first: the services read their settings when imported
 load_dotenv()
 
-def create_app():
+from flask import Flask
+from flask_cors import CORS
+from models import db
+from migrations import run_migrations
+from services import events, jobs, sessions, storage
+
+def create_app(config=None):
     app = Flask(__name__)
     
     # config
     base_dir = os.path.abspath(os.path.dirname(__file__))
     db_path = os.path.join(base_dir, 'dca.db').replace('\\', '/')
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', f'sqlite:///{db_path}')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', sessions.DEV_SECRET_KEY)
+    # overrides, e.g. an in-memory db for the scripts in testing/
+    app.config.update(config or {})
+    # pool sizes + read replica (DATABASE_REPLICA_URL), see services/storage.py
+    storage.configure(app)
     
     # cors
     CORS(app, resources={
@@ -32,6 +39,10 @@ def create_app():
     })
     
     db.init_app(app)
+    storage.init_app(app)
+    jobs.init_app(app)
+    events.init_app(app)
+    sessions.init_app(app)
     
     # blueprints
     from routes.auth_routes import auth_bp
@@ -41,6 +52,8 @@ def create_app():
     from routes.dashboard_routes import dashboard_bp
     from routes.action_routes import actions_bp
     from routes.n8n_routes import n8n_bp
+    from routes.search_routes import search_bp
+    from routes.event_routes import events_bp
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(cases_bp, url_prefix='/api/cases')
@@ -48,6 +61,8 @@ def create_app():
     app.register_blueprint(customers_bp, url_prefix='/api/customers')
     app.register_blueprint(dashboard_bp, url_prefix='/api') # /api/stats, /api/performance etc
     app.register_blueprint(n8n_bp, url_prefix='/api/n8n')
+    app.register_blueprint(search_bp, url_prefix='/api/search')
+    app.register_blueprint(events_bp, url_prefix='/api/events') # SSE push of case / job changes
     app.register_blueprint(actions_bp, url_prefix='/api/actions') # TODO - refactor later
     
     @app.route('/health')
@@ -56,10 +71,23 @@ def create_app():
 
     return app
 
-if __name__ == '__main__':
-    app = create_app()
+def prepare(app):
+    """schema, migrations and interrupted jobs, once per server start before any request is served"""
     with app.app_context():
         db.create_all()
-        
+        run_migrations()
+    jobs.reset_interrupted(app)
+
+
+if __name__ == '__main__':
+    # development server (debugger + reloader), production runs: gunicorn -c gunicorn.conf.py wsgi:app
+    app = create_app()
+
+    # the reloader runs this module in a watcher and a serving process, only the one serving prepares and works
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        prepare(app)
+        # picks up imports that were still running when the server stopped
+        jobs.get_runner(app).start()
+
     # 0.0.0.0:5000 for docker compatibility
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,63 @@
+"""
+gunicorn settings for production serving, see wsgi.py. Every value can be
+overridden from the environment.
+
+Workers are processes with a thread pool each (gthread): a request holds a
+thread, an SSE stream (/api/events, /api/actions/progress) holds one for as
+long as it is open, so WEB_THREADS bounds the concurrent streams per worker.
+"""
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+# .env first, so its values win over the defaults picked below
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
+bind = os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', 5000)}")
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 16))
+
+# an event published on one worker has to reach the streams held by the others,
+# a login on one worker has to be known to all of them
+os.environ.setdefault('EVENT_BUS_BACKEND', 'database' if workers > 1 else 'memory')
+os.environ.setdefault('SESSION_BACKEND', 'database' if workers > 1 else 'memory')
+
+# gthread workers heartbeat on their own, a long SSE stream doesn't count against timeout
+timeout = int(os.getenv('WEB_TIMEOUT', 60))
+# on SIGTERM / restart: in-flight requests and running imports get this long to finish,
+# progress streams are cut after it (the import goes on, the frontend says so)
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5))
+
+accesslog = os.getenv('WEB_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def on_starting(server):
+    """master, before any worker exists: schema, migrations and interrupted jobs, once"""
+    from app import create_app, prepare
+    from models import db
+
+    app = create_app()
+    prepare(app)
+    # the master never serves, don't hand its connections down to the forked workers
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def post_worker_init(worker):
+    """every worker runs imports queued through it, plus the jobs waiting since the restart"""
+    from services import jobs
+    from wsgi import app
+
+    jobs.get_runner(app).start()
+
+
+def worker_exit(server, worker):
+    """lets the worker's running imports reach a checkpoint before the process goes away"""
+    from services import jobs
+    from wsgi import app
+
+    jobs.get_runner(app).stop(timeout=max(graceful_timeout - 5, 1))
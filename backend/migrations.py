@@ -0,0 +1,182 @@
+"""
+Schema migrations for databases that already exist.
+
+db.create_all() only creates missing tables, it never touches one that is
+already there, so anything added to an existing table (indexes, columns) also
+gets a migration here. Migrations run in order, each one once, and are
+recorded in the schema_migration table. Every step is idempotent, so a fresh
+database (where create_all already built everything) just records them.
+
+    cd backend && python -m migrations
+"""
+import zlib
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from models import db, Agency, AgencyPerformance, Case, CaseStat, EmailArchive, EventLog, Notification, RecoveryBucket, TimelineEvent, \
+    UserSession
+from services import analytics, recovery, search, stats, timeline
+from services.ingest import email_hash
+
+
+def _now():
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def create_indexes(connection, *models):
+    """
+    creates the indexes declared on the models' tables that don't exist yet,
+    leaving out those over columns a later migration adds (it creates them)
+    """
+    for model in models:
+        existing = {c['name'] for c in inspect(connection).get_columns(model.__tablename__)}
+        for index in model.__table__.indexes:
+            if any(column.name not in existing for column in index.columns):
+                continue
+            # IF NOT EXISTS rather than checkfirst, reflection skips expression indexes
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def add_column_if_missing(connection, table, column, ddl):
+    """ALTER TABLE ADD COLUMN unless the column is already there, ddl is its type + constraints"""
+    if column not in {c['name'] for c in inspect(connection).get_columns(table)}:
+        connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+
+
+def hot_filter_indexes(connection):
+    # (assigned_agency_id, status), status, customer_account_number, (created_at, id) on case,
+    # (case_id, timestamp) on timeline_event, case_id on notification, email on agency
+    create_indexes(connection, Case, TimelineEvent, Notification, Agency)
+
+
+def search_index(connection):
+    # FTS5 tables + triggers over cases, customers and email timeline events, sqlite only
+    if connection.dialect.name == 'sqlite':
+        search.create(connection)
+
+
+def case_stats(connection):
+    # triggers keeping case_stat (dashboard totals) in step with the case table, sqlite only
+    CaseStat.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name == 'sqlite':
+        stats.create(connection)
+
+
+def recovery_buckets(connection):
+    # triggers pre-aggregating payment events into day / month buckets, sqlite only
+    RecoveryBucket.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name == 'sqlite':
+        recovery.create(connection)
+
+
+def agency_performance(connection):
+    # triggers flagging per-agency analytics stale when their cases change, sqlite only
+    AgencyPerformance.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name == 'sqlite':
+        analytics.create(connection)
+
+
+def timeline_pages(connection):
+    # id joins the timeline index so cursor pages need no sort for equal timestamps
+    connection.execute(text('DROP INDEX IF EXISTS ix_timeline_case_time'))
+    create_indexes(connection, TimelineEvent)
+    # triggers keeping case.last_contact at the newest timeline event, sqlite only
+    if connection.dialect.name == 'sqlite':
+        timeline.create(connection)
+
+
+def email_archive(connection):
+    # compressed cold storage for old email bodies, the email_fts update trigger learns to skip archiving
+    EmailArchive.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DROP TRIGGER IF EXISTS email_fts_au'))
+        search.create(connection)
+
+
+def email_content_hash(connection):
+    # content hash + unique index making email interception idempotent
+    add_column_if_missing(connection, 'timeline_event', 'content_hash', 'VARCHAR(64)')
+    rows = connection.execute(text(
+        "SELECT e.id, e.case_id, e.timestamp, e.from_, e.meta_email_subject, e.meta_email_content, a.body "
+        "FROM timeline_event e LEFT JOIN email_archive a ON a.event_id = e.id "
+        "WHERE e.event_type = 'email' AND e.content_hash IS NULL ORDER BY e.rowid"
+    )).all()
+    # duplicates stored before the index existed stay on the timeline, only the oldest copy gets the hash
+    hashes = {}
+    for row in rows:
+        body = row.meta_email_content if row.body is None else zlib.decompress(row.body).decode('utf-8')
+        hashes.setdefault(email_hash(row.case_id, row.timestamp, row.from_, row.meta_email_subject, body), row.id)
+    if hashes:
+        connection.execute(text('UPDATE timeline_event SET content_hash = :hash WHERE id = :id'),
+                           [{'hash': content_hash, 'id': event_id} for content_hash, event_id in hashes.items()])
+    create_indexes(connection, TimelineEvent)
+
+
+def event_log(connection):
+    # table the 'database' event bus backend passes events between processes through
+    EventLog.__table__.create(connection, checkfirst=True)
+
+
+def user_session(connection):
+    # login sessions shared by every server process, SESSION_BACKEND=database
+    UserSession.__table__.create(connection, checkfirst=True)
+
+
+def recovery_iso_keys(connection):
+    # recovery triggers only bucket payments whose timestamp starts with an ISO date, sqlite only
+    if connection.dialect.name == 'sqlite':
+        recovery.recreate(connection)
+
+
+def job_allocated_rows(connection):
+    # allocation checkpoint of local-mode imports, 0 re-allocates whatever an interrupted job left pending
+    add_column_if_missing(connection, 'job', 'allocated_rows', 'INTEGER DEFAULT 0')
+
+
+# (id, function) in the order they are applied, never reorder or rename applied ones
+MIGRATIONS = [
+    ('0001_hot_filter_indexes', hot_filter_indexes),
+    ('0002_search_index', search_index),
+    ('0003_case_stats', case_stats),
+    ('0004_recovery_buckets', recovery_buckets),
+    ('0005_agency_performance', agency_performance),
+    ('0006_timeline_pages', timeline_pages),
+    ('0007_email_archive', email_archive),
+    ('0008_email_content_hash', email_content_hash),
+    ('0009_event_log', event_log),
+    ('0010_user_session', user_session),
+    ('0011_recovery_iso_keys', recovery_iso_keys),
+    ('0012_job_allocated_rows', job_allocated_rows),
+]
+
+
+def run_migrations(engine=None):
+    """applies every pending migration, returns the ids that ran"""
+    engine = engine or db.engine
+    applied = []
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migration (id VARCHAR(100) PRIMARY KEY, applied_at VARCHAR(30))'
+        ))
+        done = {row[0] for row in connection.execute(text('SELECT id FROM schema_migration'))}
+
+    for migration_id, migrate in MIGRATIONS:
+        if migration_id in done:
+            continue
+        # one transaction per migration, a failure leaves the earlier ones recorded
+        with engine.begin() as connection:
+            migrate(connection)
+            connection.execute(text('INSERT INTO schema_migration (id, applied_at) VALUES (:id, :at)'),
+                               {'id': migration_id, 'at': _now()})
+        applied.append(migration_id)
+    return applied
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        ran = run_migrations()
+    print(f"Applied {len(ran)} migration(s): {', '.join(ran)}" if ran else 'Schema is up to date')
@@ -1,7 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
+import zlib
+from services.storage import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     id = db.Column(db.String(50), primary_key=True)
@@ -33,6 +36,10 @@ class Agency(db.Model):
     
     cases = db.relationship('Case', backref='agency', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_agency_email', 'email'), # agency login
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -63,13 +70,13 @@ class Customer(db.Model):
 
     def to_dict(self):
         return {
-            'id': self.id,
+            'id': self.account_number,
             'accountNumber': self.account_number,
             'customerName': self.customer_name,
             'accountType': self.account_type,
             'customerTier': self.customer_tier,
             'historicalHealth': self.historical_health,
-            'invoiceNumber': self.invoice_number,
+            'invoiceNumber': None, # invoices live on the cases
             'dueDate': self.due_date,
             'amountDue': self.amount_due,
             'serviceType': self.service_type,
@@ -90,10 +97,17 @@ class Case(db.Model):
     assigned_agency_reason = db.Column(db.String(400), nullable=True, default=None)
     status = db.Column(db.String(20), default='pending')
     due_date = db.Column(db.String(20))
-    last_contact = db.Column(db.String(20))
+    last_contact = db.Column(db.String(30)) # newest timeline event, kept by triggers (services/timeline.py)
     created_at = db.Column(db.String(30))
     auto_assign_after_hours = db.Column(db.Integer, nullable=True)
     timeline_events = db.relationship('TimelineEvent', backref='case', lazy=True, cascade="all, delete-orphan")
+
+    # keep in step with migrations.py, existing databases get these from there
+    __table_args__ = (
+        db.Index('ix_case_agency_status', 'assigned_agency_id', 'status'), # agency case lists, status filters per agency
+        db.Index('ix_case_status', 'status'), # dashboard counts, pending allocation
+        db.Index('ix_case_customer', 'customer_account_number'), # customer case lists
+    )
     
     def to_dict(self):
         return {
@@ -116,6 +130,10 @@ class Case(db.Model):
             'customerId': self.customer_account_number
         }
 
+# newest-first keyset order of the case list (routes/case_routes.py CASE_SORT_KEYS)
+CASE_CREATED_AT_KEY = db.func.coalesce(Case.created_at, db.literal_column("''"))
+db.Index('ix_case_created_id', CASE_CREATED_AT_KEY, Case.id)
+
 class TimelineEvent(db.Model):
     id = db.Column(db.String(50), primary_key=True)
     case_id = db.Column(db.String(50), db.ForeignKey('case.id'), nullable=False)
@@ -124,20 +142,34 @@ class TimelineEvent(db.Model):
     to_ = db.Column(db.String(20)) # fedex, dca, customer
     event_type = db.Column(db.String(50)) # email, status_change, payment, call, legal_notice
     title = db.Column(db.String(100))
-    description = db.Column(db.Text)
+    # bodies are only read when accessed or with undefer_group('body'), timeline summaries never load them
+    description = db.deferred(db.Column(db.Text), group='body')
     
     # metadata
     meta_amount = db.Column(db.Float, nullable=True)
     meta_email_subject = db.Column(db.String(200), nullable=True)
-    meta_email_content = db.Column(db.String(2000), nullable=True)
+    meta_email_content = db.deferred(db.Column(db.String(2000), nullable=True), group='body')
     meta_previous_status = db.Column(db.String(50), nullable=True)
     meta_new_status = db.Column(db.String(50), nullable=True)
+    # identity of an intercepted email (services/ingest.py email_hash), a replayed email hits the unique index
+    content_hash = db.Column(db.String(64), nullable=True)
+
+    # start of the body computed in SQL, only set by summary queries (services/timeline.py)
+    preview = db.query_expression()
+
+    # compressed body once the email was moved to cold storage (services/email_archive.py)
+    archive = db.relationship('EmailArchive', uselist=False, lazy='select', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_timeline_case_time', 'case_id', 'timestamp', 'id'), # a case's timeline in (timestamp, id) order
+        db.Index('ux_timeline_content_hash', 'content_hash', unique=True), # NULL for everything but emails
+    )
 
     def to_dict(self):
         metadata = {}
         if self.meta_amount: metadata['amount'] = self.meta_amount
         if self.meta_email_subject: metadata['emailSubject'] = self.meta_email_subject
-        if self.meta_email_content: metadata['emailContent'] = self.meta_email_content
+        if self.email_content: metadata['emailContent'] = self.email_content
         if self.meta_previous_status: metadata['previousStatus'] = self.meta_previous_status
         if self.meta_new_status: metadata['newStatus'] = self.meta_new_status
 
@@ -152,6 +184,45 @@ class TimelineEvent(db.Model):
             'metadata': metadata if metadata else None
         }
 
+    @property
+    def email_content(self):
+        """email body, inline or from the archive"""
+        if self.meta_email_content is not None:
+            return self.meta_email_content
+        return self.archive.text if self.archive else None
+
+    def to_summary(self):
+        """to_dict() without the bodies, emailContent / description are replaced by a short preview"""
+        metadata = {}
+        if self.meta_amount: metadata['amount'] = self.meta_amount
+        if self.meta_email_subject: metadata['emailSubject'] = self.meta_email_subject
+        if self.meta_previous_status: metadata['previousStatus'] = self.meta_previous_status
+        if self.meta_new_status: metadata['newStatus'] = self.meta_new_status
+
+        return {
+            'id': self.id,
+            'timestamp': self.timestamp,
+            'from': self.from_,
+            'to': self.to_,
+            'eventType': self.event_type,
+            'title': self.title,
+            'preview': self.preview,
+            'metadata': metadata if metadata else None
+        }
+
+class EmailArchive(db.Model):
+    """compressed body of an old email timeline event, moved out of timeline_event by services/email_archive.py"""
+    event_id = db.Column(db.String(50), db.ForeignKey('timeline_event.id'), primary_key=True)
+    codec = db.Column(db.String(10), nullable=False, default='zlib')
+    body = db.Column(db.LargeBinary, nullable=False)
+    preview = db.Column(db.String(200)) # uncompressed start of the body, for timeline summaries
+    original_size = db.Column(db.Integer)
+    archived_at = db.Column(db.String(30))
+
+    @property
+    def text(self):
+        return zlib.decompress(self.body).decode('utf-8')
+
 class AuditLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -179,6 +250,10 @@ class Notification(db.Model):
     case_id = db.Column(db.String(50), db.ForeignKey('case.id'), nullable=True)
     priority = db.Column(db.String(10), nullable=True) # high, medium, low
 
+    __table_args__ = (
+        db.Index('ix_notification_case', 'case_id'),
+    )
+
     def to_dict(self):
         result = {
             'id': self.id,
@@ -194,3 +269,130 @@ class Notification(db.Model):
         if self.case_id:
             result['caseId'] = self.case_id
         return result
+
+class DispatchChunk(db.Model):
+    """one slice of an upload posted to the n8n webhook, tracked so it can be retried"""
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(50), nullable=False, index=True)
+    filepath = db.Column(db.String(300), nullable=False)
+    chunk_index = db.Column(db.Integer, nullable=False)
+    row_start = db.Column(db.Integer, nullable=False)  # 0-based data row offset in the csv
+    row_count = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='pending') # pending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.String(400), nullable=True)
+    updated_at = db.Column(db.String(30))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'batchId': self.batch_id,
+            'chunkIndex': self.chunk_index,
+            'rowStart': self.row_start,
+            'rowCount': self.row_count,
+            'status': self.status,
+            'attempts': self.attempts,
+            'lastError': self.last_error,
+            'updatedAt': self.updated_at
+        }
+
+class Job(db.Model):
+    """background work (csv imports for now), progress is read from here instead of the request"""
+    id = db.Column(db.String(50), primary_key=True)
+    kind = db.Column(db.String(30), nullable=False) # upload
+    status = db.Column(db.String(20), default='received') # received, processing, assigning, done, error
+    filepath = db.Column(db.String(300), nullable=True)
+    file_hash = db.Column(db.String(64), nullable=True, index=True) # sha256 of the upload, re-uploads resume this job
+    total_rows = db.Column(db.Integer, default=0)
+    processed_rows = db.Column(db.Integer, default=0) # checkpoint: rows committed, committed together with them
+    allocated_rows = db.Column(db.Integer, default=0) # checkpoint: rows whose cases went through allocation (local mode)
+    cases_created = db.Column(db.Integer, default=0)
+    cases_assigned = db.Column(db.Integer, default=0)
+    rows_per_second = db.Column(db.Float, nullable=True)
+    batch_id = db.Column(db.String(50), nullable=True) # n8n dispatch batch, if any
+    message = db.Column(db.String(300), nullable=True)
+    errors = db.Column(db.Text, nullable=True) # json list of row errors
+    created_at = db.Column(db.String(30))
+    updated_at = db.Column(db.String(30))
+    finished_at = db.Column(db.String(30), nullable=True)
+
+    def to_dict(self):
+        # same keys the upload SSE stream always used, so the frontend progress bar reads it as-is
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'currentAssigned': self.cases_assigned,
+            'processedRows': self.processed_rows,
+            'fileHash': self.file_hash,
+            'totalRows': self.total_rows,
+            'rowsPerSecond': self.rows_per_second,
+            'cases_created': self.cases_created,
+            'batchId': self.batch_id,
+            'message': self.message,
+            'errors': json.loads(self.errors) if self.errors else [],
+            'createdAt': self.created_at,
+            'updatedAt': self.updated_at,
+            'finishedAt': self.finished_at
+        }
+
+class CaseStat(db.Model):
+    """case count and amounts per (status, agency), kept current by triggers (services/stats.py)"""
+    status = db.Column(db.String(20), primary_key=True) # '' for cases without one
+    agency_id = db.Column(db.String(50), primary_key=True) # '' for unassigned cases
+    cases = db.Column(db.Integer, nullable=False, default=0)
+    invoice_amount = db.Column(db.Float, nullable=False, default=0)
+    recovered_amount = db.Column(db.Float, nullable=False, default=0)
+
+class RecoveryBucket(db.Model):
+    """payments received per day / month, kept current by triggers (services/recovery.py)"""
+    granularity = db.Column(db.String(10), primary_key=True) # day, month
+    bucket = db.Column(db.String(10), primary_key=True) # YYYY-MM-DD, YYYY-MM
+    amount = db.Column(db.Float, nullable=False, default=0)
+    payments = db.Column(db.Integer, nullable=False, default=0)
+
+class AgencyPerformance(db.Model):
+    """per-agency analytics derived from case outcomes (services/analytics.py), a cache recomputed when stale"""
+    agency_id = db.Column(db.String(50), db.ForeignKey('agency.id'), primary_key=True)
+    stale = db.Column(db.Boolean, nullable=False, default=True) # set by triggers when the agency's cases change
+    computed_at = db.Column(db.String(30))
+    cases = db.Column(db.Integer, default=0)
+    active_cases = db.Column(db.Integer, default=0)
+    closed_cases = db.Column(db.Integer, default=0) # resolved, legal, dismissed
+    resolved_cases = db.Column(db.Integer, default=0)
+    invoice_amount = db.Column(db.Float, default=0)
+    recovered_amount = db.Column(db.Float, default=0)
+    closed_invoice_amount = db.Column(db.Float, default=0)
+    closed_recovered_amount = db.Column(db.Float, default=0)
+    avg_resolution_days = db.Column(db.Float, nullable=True)
+    aging_mix = db.Column(db.Text, nullable=True) # json {bucket: active cases}
+
+    def to_dict(self):
+        return {
+            'agencyId': self.agency_id,
+            'cases': self.cases,
+            'activeCases': self.active_cases,
+            'closedCases': self.closed_cases,
+            'resolvedCases': self.resolved_cases,
+            'recoveryRate': self.recovered_amount / self.invoice_amount if self.invoice_amount else 0,
+            'closedRecoveryRate': (self.closed_recovered_amount / self.closed_invoice_amount
+                                   if self.closed_invoice_amount else None),
+            'avgResolutionDays': self.avg_resolution_days,
+            'agingMix': json.loads(self.aging_mix) if self.aging_mix else {},
+            'computedAt': self.computed_at
+        }
+
+class EventLog(db.Model):
+    """published change events, read by every server process when EVENT_BUS_BACKEND=database (services/events.py)"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    type = db.Column(db.String(30), nullable=False)
+    agency_id = db.Column(db.String(50), nullable=True)
+    case_id = db.Column(db.String(50), nullable=True)
+    payload = db.Column(db.Text, nullable=False) # json of the whole event
+    created_at = db.Column(db.String(30), index=True)
+
+class UserSession(db.Model):
+    """a login session when SESSION_BACKEND=database (services/sessions.py)"""
+    token = db.Column(db.String(100), primary_key=True)
+    user = db.Column(db.Text, nullable=False) # json of the user data /me returns
+    expires_at = db.Column(db.Float, nullable=False, index=True) # unix time
@@ -1,14 +1,18 @@
 from flask import Blueprint, request, jsonify
 from models import db, Agency, Case
+from sqlalchemy.orm import joinedload
+from services.storage import read_only
 
 agencies_bp = Blueprint('agencies', __name__)
 
 @agencies_bp.route('', methods=['GET'])
+@read_only
 def get_agencies():
     agencies = Agency.query.all()
     return jsonify([a.to_dict() for a in agencies])
 
 @agencies_bp.route('/<agency_id>', methods=['GET'])
+@read_only
 def get_agency(agency_id):
     agency = Agency.query.get(agency_id)
     if not agency:
@@ -16,10 +20,11 @@ def get_agency(agency_id):
     return jsonify(agency.to_dict())
 
 @agencies_bp.route('/<agency_id>/cases', methods=['GET'])
+@read_only
 def get_agency_cases(agency_id):
     agency = Agency.query.get(agency_id)
     if not agency:
         return jsonify({'error': 'Agency not found'}), 404
     
-    cases = Case.query.filter_by(assigned_agency_id=agency_id).all()
+    cases = Case.query.options(joinedload(Case.agency)).filter_by(assigned_agency_id=agency_id).all()
     return jsonify([c.to_dict() for c in cases])
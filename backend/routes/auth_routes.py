@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify
 from models import db, User, Agency
-import uuid
+from services.sessions import create_session, end_session, session_user
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -13,9 +13,6 @@ FEDEX_ADMIN = {
     'role': 'fedex'
 }
 
-# temporary in-memory session store for demo purposes
-active_sessions = {}
-
 @auth_bp.route('/login', methods=['POST'])
 def login():
     data = request.json
@@ -28,14 +25,12 @@ def login():
     
     # if fedex admin
     if email == FEDEX_ADMIN['email'] and password == FEDEX_ADMIN['password']:
-        token = f"session-{uuid.uuid4()}"
-        
-        active_sessions[token] = {
+        token = create_session({
             'id': FEDEX_ADMIN['id'],
             'email': FEDEX_ADMIN['email'],
             'name': FEDEX_ADMIN['name'],
             'role': FEDEX_ADMIN['role']
-        }
+        })
         
         return jsonify({
             'token': token,
@@ -59,18 +54,15 @@ def login():
     if password != expected_password:
         return jsonify({'error': 'Invalid credentials'}), 401
     
-    # token generation
-    token = f"session-{uuid.uuid4()}"
-    
-    # store session
-    active_sessions[token] = {
+    # session + its token (services/sessions.py, expires after SESSION_TTL)
+    token = create_session({
         'id': agency.id,
         'email': email,
         'name': agency.name,
         'role': 'agency',
         'agencyId': agency.id,
         'agencyName': agency.name
-    }
+    })
     
     return jsonify({
         'token': token,
@@ -84,29 +76,44 @@ def login():
         }
     })
 
+def request_token():
+    """
+    the request's session token, from the Bearer header only: a token in the
+    query string would end up in access logs (EventSource uses a ticket instead)
+    """
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header.replace('Bearer ', '')
+    return None
+
 @auth_bp.route('/me', methods=['GET'])
 def get_current_user():
     """returns the current logged in user data based on token"""
-    auth_header = request.headers.get('Authorization')
-    
-    if not auth_header or not auth_header.startswith('Bearer '):
+    token = request_token()
+    if not token:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    token = auth_header.replace('Bearer ', '')
-    user_data = active_sessions.get(token)
+    user_data = session_user(token)
     if not user_data:
         return jsonify({'error': 'Invalid or expired token'}), 401
     
     return jsonify({'user': user_data})
 
+@auth_bp.route('/refresh', methods=['POST'])
+def refresh_token():
+    """trades a live token for a new one with a full SESSION_TTL, the old one stops working"""
+    token = request_token()
+    user_data = session_user(token)
+    if not user_data:
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    
+    new_token = create_session(user_data)
+    end_session(token)
+    return jsonify({'token': new_token, 'user': user_data})
+
 @auth_bp.route('/logout', methods=['POST'])
 def logout():
-    """logs out the current user by deleting the session token"""
-    auth_header = request.headers.get('Authorization')
-    
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.replace('Bearer ', '')
-        if token in active_sessions:
-            del active_sessions[token]
+    """logs out the current user by ending the session of the token"""
+    end_session(request_token())
     
     return jsonify({'message': 'Logged out successfully'})
@@ -1,15 +1,26 @@
 from flask import Blueprint, request, jsonify
-from models import db, Case, TimelineEvent, Agency, Customer
+from models import db, Case, TimelineEvent, Agency, Customer, CASE_CREATED_AT_KEY
 from datetime import datetime
+from sqlalchemy.orm import joinedload
 import uuid
+from services.pagination import keyset_page, count_total, page_size
+from services import events, search, timeline
+from services.allocation import allocate_pending, adjust_agency_load, CapacityConflict, INACTIVE_STATUSES
+from services.storage import read_only
 
 cases_bp = Blueprint('cases', __name__)
 
+# stable newest-first order, id breaks ties (created_at is a string and can repeat or be missing)
+CASE_SORT_KEYS = (CASE_CREATED_AT_KEY, Case.id)
+
 @cases_bp.route('', methods=['GET'])
+@read_only
 def get_cases():
     # pagination and filters
     page = request.args.get('page', 1, type=int)
-    limit = request.args.get('limit', 10, type=int)
+    limit = page_size(request.args.get('limit', type=int), 10)
+    cursor = request.args.get('cursor')  # present (even empty) = keyset pagination
+    total_mode = request.args.get('total')  # cursor mode only: exact, approx
     search_query = request.args.get('search', '')
     status_filter = request.args.get('status')
     agency_id = request.args.get('agency_id', None)  # Filter by agency
@@ -22,13 +33,38 @@ def get_cases():
     if status_filter and status_filter != 'all':
         query = query.filter_by(status=status_filter)
         
-    if search_query:
+    hits = None
+    if search_query and search.available(db.session):
+        # full-text match on customer name, account number and case id
+        hits = search.match_cases(search_query)
+        if hits is not None:
+            query = query.join(hits, hits.c.case_id == Case.id)
+        else:
+            # nothing searchable in it (e.g. ?search=--), it matches no case
+            query = query.filter(db.false())
+    elif search_query:
         query = query.filter(Case.customer_name.ilike(f'%{search_query}%'))
 
-    # Sort by created_at desc
-    # query = query.order_by(Case.created_at.desc()) NOTE - could be string format, need to check later
+    # agency is joined in, to_dict() reads agency.name for every row
+    rows = query.options(joinedload(Case.agency))
+
+    if cursor is not None:
+        try:
+            items, next_cursor = keyset_page(rows, CASE_SORT_KEYS, cursor, limit,
+                                             lambda c: [c.created_at or '', c.id])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        total, lower_bound = count_total(query, total_mode)
+        return jsonify({
+            'cases': [c.to_dict() for c in items],
+            'next_cursor': next_cursor,
+            'total': total,
+            'total_is_lower_bound': lower_bound
+        })
 
-    pagination = query.paginate(page=page, per_page=limit, error_out=False)
+    # search results come best match first
+    order = ([hits.c.rank] if hits is not None else []) + [key.desc() for key in CASE_SORT_KEYS]
+    pagination = rows.order_by(*order).paginate(page=page, per_page=limit, error_out=False)
     
     return jsonify({
         'cases': [c.to_dict() for c in pagination.items],
@@ -37,19 +73,44 @@ def get_cases():
         'current_page': page
     })
 
+@cases_bp.route('/allocate', methods=['POST'])
+def allocate_cases():
+    """
+    Allocates pending, unassigned cases in-process using the prompts.md policy.
+
+    The whole batch is solved in one pass with live capacity accounting, and the
+    case updates + agency load changes are committed together.
+
+    Close calls are left pending (and returned) so they can still go through the
+    LLM flow, unless deferCloseCalls is false.
+    """
+    data = request.get_json(silent=True) or {}
+    case_ids = data.get('caseIds') or None
+    defer_close_calls = data.get('deferCloseCalls', True)
+
+    decisions = allocate_pending(db.session, case_ids, defer_close_calls)
+    events.publish_assignments(decisions, skip_close_calls=defer_close_calls)
+
+    deferred = [d['caseId'] for d in decisions if d['closeCall'] and defer_close_calls]
+    unassigned = [d['caseId'] for d in decisions if d['agencyId'] is None]
+
+    return jsonify({
+        'assigned': len(decisions) - len(deferred) - len(unassigned),
+        'deferred': deferred,
+        'unassigned': unassigned,
+        'decisions': decisions
+    })
+
 @cases_bp.route('/<case_id>', methods=['GET'])
+@read_only
 def get_case(case_id):
     case = Case.query.get(case_id)
     if not case:
         return jsonify({'error': 'Case not found'}), 404
     
-    latest_event = TimelineEvent.query.filter_by(case_id=case_id)\
-        .order_by(TimelineEvent.timestamp.desc())\
-        .first()
-    
-    # case object + latest contact time
+    # case object + latest contact time (kept on the case as events are added)
     case_data = case.to_dict()
-    case_data['lastContact'] = latest_event.timestamp if latest_event else None
+    case_data['lastContact'] = timeline.last_contact(db.session, case)
     
     return jsonify(case_data)
 
@@ -65,7 +126,8 @@ def create_case():
     new_case = Case(
         id=f"CS-{datetime.now().year}-{uuid.uuid4().hex[:6].upper()}",
         customer_name=data['customerName'],
-        amount=data['amount'],
+        invoice_amount=data['amount'],
+        recovered_amount=0.0,
         aging_days=0,
         recovery_probability=0.5, # Default
         status='pending',
@@ -74,6 +136,7 @@ def create_case():
     
     db.session.add(new_case)
     db.session.commit()
+    events.publish('case.created', {'caseIds': [new_case.id], 'case': new_case.to_dict()}, case_id=new_case.id)
     
     return jsonify(new_case.to_dict()), 201
 
@@ -84,26 +147,82 @@ def update_case(case_id):
         return jsonify({'error': 'Case not found'}), 404
         
     data = request.json
+    was_active = case.status not in INACTIVE_STATUSES
+    old_amount = case.invoice_amount or 0
     
-    if 'status' in data:
+    if 'status' in data and data['status'] != case.status:
+        # status changes go on the timeline, agency analytics time resolutions from them
+        db.session.add(TimelineEvent(
+            id=f"evt-{uuid.uuid4().hex[:8]}",
+            case_id=case_id,
+            timestamp=datetime.utcnow().isoformat() + 'Z',
+            from_='fedex',
+            to_='dca',
+            event_type='status_change',
+            title='Status Updated',
+            description=f"Status changed from {case.status} to {data['status']}",
+            meta_previous_status=case.status,
+            meta_new_status=data['status']
+        ))
         case.status = data['status']
     if 'amount' in data:
         case.invoice_amount = data['amount']
 
+    # keep the agency's live load in step with the case
+    is_active = case.status not in INACTIVE_STATUSES
+    adjust_agency_load(
+        db.session, case.assigned_agency_id,
+        int(is_active) - int(was_active),
+        ((case.invoice_amount or 0) if is_active else 0) - (old_amount if was_active else 0)
+    )
+
     db.session.commit()
     return jsonify(case.to_dict())
 
 @cases_bp.route('/<case_id>/timeline', methods=['GET'])
+@read_only
 def get_case_timeline(case_id):
     case = Case.query.get(case_id)
     if not case:
         return jsonify({'error': 'Case not found'}), 404
         
-    events = TimelineEvent.query.filter_by(case_id=case_id).all()
-    # sorting by timestamp ascending
-    events.sort(key=lambda x: x.timestamp if x.timestamp else "")
-    
-    return jsonify([e.to_dict() for e in events])
+    limit = request.args.get('limit', type=int)
+    before = request.args.get('before')
+    since = request.args.get('since')
+    # ?view=summary leaves out the bodies, GET /<case_id>/timeline/<event_id> has them
+    if request.args.get('view') == 'summary':
+        query = timeline.summary(TimelineEvent.query.filter_by(case_id=case_id))
+        serialize = TimelineEvent.to_summary
+    else:
+        query = timeline.full(TimelineEvent.query.filter_by(case_id=case_id))
+        serialize = TimelineEvent.to_dict
+
+    if limit is None and before is None and since is None:
+        # whole timeline, timestamp ascending, straight off the (case_id, timestamp) index
+        events = query.order_by(*timeline.SORT_KEYS).all()
+        return jsonify([serialize(e) for e in events])
+
+    # range-bounded page: ?limit= newest events, ?before= older history, ?since= new events
+    limit = page_size(limit, timeline.DEFAULT_PAGE_SIZE, timeline.MAX_PAGE_SIZE)
+    try:
+        events, before_cursor, since_cursor = timeline.page(query, limit, before, since)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'events': [serialize(e) for e in events],
+        'before': before_cursor,
+        'since': since_cursor
+    })
+
+@cases_bp.route('/<case_id>/timeline/<event_id>', methods=['GET'])
+@read_only
+def get_timeline_event(case_id, event_id):
+    """one timeline event with its full body"""
+    event = timeline.full(TimelineEvent.query.filter_by(case_id=case_id, id=event_id)).first()
+    if not event:
+        return jsonify({'error': 'Timeline event not found'}), 404
+    return jsonify(event.to_dict())
 
 @cases_bp.route('/<case_id>/assign', methods=['PUT'])
 def assign_case(case_id):
@@ -117,7 +236,22 @@ def assign_case(case_id):
     agency = Agency.query.get(agency_id)
     if not agency:
         return jsonify({'error': 'Agency not found'}), 404
-        
+
+    if case.assigned_agency_id == agency_id:
+        return jsonify(case.to_dict())
+
+    # move the case's load from the previous agency (if any) to the new one, the
+    # increment only goes through while the new agency still has room
+    amount = case.invoice_amount or 0
+    try:
+        adjust_agency_load(db.session, agency_id, 1, amount, enforce_capacity=True)
+    except CapacityConflict:
+        db.session.rollback()
+        return jsonify({'error': f'{agency.name} is at capacity'}), 409
+    if case.status not in INACTIVE_STATUSES:
+        adjust_agency_load(db.session, case.assigned_agency_id, -1, -amount)
+
+    previous_status, previous_agency_id = case.status, case.assigned_agency_id
     case.assigned_agency_id = agency_id
     case.status = 'assigned'
     
@@ -125,16 +259,19 @@ def assign_case(case_id):
         id=f"evt-{uuid.uuid4().hex[:8]}",
         case_id=case_id,
         timestamp=datetime.utcnow().isoformat() + 'Z',
-        actor='fedex', # Assuming current user
+        from_='fedex', # Assuming current user
+        to_='dca',
         event_type='status_change',
         title='Assigned to DCA',
         description=f'Case assigned to {agency.name}',
-        meta_previous_status=case.status,
+        meta_previous_status=previous_status,
         meta_new_status='assigned'
     )
     db.session.add(event)
     
     db.session.commit()
+    events.publish('case.assigned', {'caseIds': [case_id], 'case': case.to_dict(),
+                                     'previousAgencyId': previous_agency_id}, agency_id=agency_id, case_id=case_id)
     return jsonify(case.to_dict())
 
 @cases_bp.route('/<case_id>/email', methods=['POST'])
@@ -148,7 +285,8 @@ def send_email(case_id):
         id=f"evt-{uuid.uuid4().hex[:8]}",
         case_id=case_id,
         timestamp=datetime.utcnow().isoformat() + 'Z',
-        actor='fedex', # or 'dca' based on auth
+        from_='fedex', # or 'dca' based on auth
+        to_='customer',
         event_type='email',
         title=data.get('subject', 'Email Sent'),
         description=data.get('body', 'Email sent to customer'),
@@ -156,6 +294,7 @@ def send_email(case_id):
     )
     db.session.add(event)
     db.session.commit()
+    events.publish_timeline(event)
     
     return jsonify({'message': 'Email sent', 'event': event.to_dict()})
 
@@ -170,13 +309,15 @@ def log_call(case_id):
         id=f"evt-{uuid.uuid4().hex[:8]}",
         case_id=case_id,
         timestamp=datetime.utcnow().isoformat() + 'Z',
-        actor='fedex',
+        from_='fedex',
+        to_='customer',
         event_type='call',
         title='Call Logged',
         description=data.get('notes', 'Call made to customer')
     )
     db.session.add(event)
     db.session.commit()
+    events.publish_timeline(event)
     
     return jsonify({'message': 'Call logged', 'event': event.to_dict()})
 
@@ -203,12 +344,17 @@ def add_timeline_event(case_id):
         return jsonify({'error': f'Invalid event type. Must be one of: {valid_event_types}'}), 400
     
     timestamp = data.get('timestamp', datetime.utcnow().isoformat() + 'Z')
+    try:
+        timestamp = timeline.normalise_timestamp(timestamp)
+    except ValueError:
+        return jsonify({'error': 'Invalid timestamp. Must be ISO 8601, e.g. 2026-09-12T10:00:00Z'}), 400
     
     event = TimelineEvent(
         id=f"evt-{uuid.uuid4().hex[:8]}",
         case_id=case_id,
         timestamp=timestamp,
-        actor=data['actor'],
+        from_=data['actor'],
+        to_=data.get('to'),
         event_type=data['eventType'],
         title=data['title'],
         description=data.get('description', '')
@@ -227,7 +373,12 @@ def add_timeline_event(case_id):
         if 'newStatus' in metadata:
             event.meta_new_status = metadata['newStatus']
     
+    # a payment is a recovery on the case, the dashboard totals and recovery series follow it
+    if event.event_type == 'payment' and event.meta_amount:
+        case.recovered_amount = (case.recovered_amount or 0) + event.meta_amount
+
     db.session.add(event)
     db.session.commit()
+    events.publish_timeline(event)
     
     return jsonify({'message': 'Timeline event added successfully', 'event': event.to_dict()}), 201
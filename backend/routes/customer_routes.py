@@ -1,12 +1,19 @@
 from flask import Blueprint, request, jsonify, g
 from models import db, Customer, Case
+from sqlalchemy.orm import joinedload
+from services.pagination import keyset_page, count_total, page_size
+from services import search as fts
+from services.storage import read_only
 
 customers_bp = Blueprint('customers', __name__)
 
 @customers_bp.route('', methods=['GET'])
+@read_only
 def get_customers():
     page = request.args.get('page', 1, type=int)
-    limit = request.args.get('limit', 10, type=int)
+    limit = page_size(request.args.get('limit', type=int), 10)
+    cursor = request.args.get('cursor')  # present (even empty) = keyset pagination
+    total_mode = request.args.get('total')  # cursor mode only: exact, approx
     search = request.args.get('search', '')
     agency_id = request.args.get('agency_id', None)  # Filter by agency
     
@@ -14,11 +21,17 @@ def get_customers():
     
     if agency_id:
         # Get customers who have cases assigned to this agency
-        query = query.join(Case, customer.customer_account_number == Case.customer_account_number).filter(
+        query = query.join(Case, Customer.account_number == Case.customer_account_number).filter(
             Case.assigned_agency_id == agency_id
         ).distinct()
 
-    if search:
+    hits = None
+    if search and fts.available(db.session):
+        # full-text match on name, email and account number
+        hits = fts.match_customers(search)
+        if hits is not None:
+            query = query.join(hits, hits.c.account_number == Customer.account_number)
+    elif search:
         query = query.filter(
             db.or_(
                 Customer.customer_name.ilike(f'%{search}%'),
@@ -26,8 +39,25 @@ def get_customers():
                 Customer.account_number.ilike(f'%{search}%')
             )
         )
+
+    if cursor is not None:
+        # account_number is the primary key, the order is stable and index backed
+        try:
+            items, next_cursor = keyset_page(query, (Customer.account_number,), cursor, limit,
+                                             lambda c: [c.account_number], descending=False)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        total, lower_bound = count_total(query, total_mode)
+        return jsonify({
+            'customers': [c.to_dict() for c in items],
+            'next_cursor': next_cursor,
+            'total': total,
+            'total_is_lower_bound': lower_bound
+        })
         
-    pagination = query.paginate(page=page, per_page=limit, error_out=False)
+    # search results come best match first
+    order = ([hits.c.rank] if hits is not None else []) + [Customer.account_number]
+    pagination = query.order_by(*order).paginate(page=page, per_page=limit, error_out=False)
 
     return jsonify({
         'customers': [c.to_dict() for c in pagination.items],
@@ -37,6 +67,7 @@ def get_customers():
     })
 
 @customers_bp.route('/<customer_account_number>', methods=['GET'])
+@read_only
 def get_customer(customer_account_number):
     customer = Customer.query.get(customer_account_number)
     if not customer:
@@ -44,6 +75,7 @@ def get_customer(customer_account_number):
     return jsonify(customer.to_dict())
 
 @customers_bp.route('/<customer_account_number>/cases', methods=['GET'])
+@read_only
 def get_customer_cases(customer_account_number):
     customer = Customer.query.get(customer_account_number)
     if not customer:
@@ -51,5 +83,5 @@ def get_customer_cases(customer_account_number):
         
     # TODO - need to update to match the current model
     
-    cases = Case.query.filter_by(customer_account_number=customer_account_number).all()
+    cases = Case.query.options(joinedload(Case.agency)).filter_by(customer_account_number=customer_account_number).all()
     return jsonify([c.to_dict() for c in cases])
@@ -1,18 +1,26 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from models import db, Case, Agency, Customer
 from sqlalchemy import func
+from datetime import datetime, timedelta
+from services import analytics, stats, recovery
+from services.allocation import utilization
+from services.storage import read_only
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
 @dashboard_bp.route('/dashboard/stats', methods=['GET'])
+@read_only
 def get_dashboard_stats():
-    # stats
-    total_cases = Case.query.count()
-    active_cases = Case.query.filter(Case.status.notin_(['resolved', 'dismissed'])).count()
-    resolved_cases = Case.query.filter_by(status='resolved').count()
-    
-    total_debt = db.session.query(func.sum(Case.invoice_amount)).scalar() or 0
-    recovered_amount = db.session.query(func.sum(Case.recovered_amount)).scalar() or 0
+    # a few pre-aggregated rows per status instead of scanning every case
+    totals = stats.totals_by_status(db.session, request.args.get('agency_id'))
+
+    total_cases = sum(cases for cases, _, _ in totals.values())
+    active_cases = sum(cases for status, (cases, _, _) in totals.items()
+                       if status is not None and status not in stats.CLOSED_STATUSES)
+    resolved_cases = totals.get('resolved', (0, 0, 0))[0]
+
+    total_debt = round(sum(amount for _, amount, _ in totals.values()), stats.AMOUNT_DIGITS)
+    recovered_amount = round(sum(recovered for _, _, recovered in totals.values()), stats.AMOUNT_DIGITS)
     
     return jsonify({
         'totalCases': total_cases,
@@ -23,17 +31,45 @@ def get_dashboard_stats():
         'recoveryRate': (recovered_amount / total_debt * 100) if total_debt > 0 else 0
     })
 
+def parse_day(value, end=False):
+    """YYYY-MM-DD, or YYYY-MM for the first (end=False) / last day of that month"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        day = datetime.strptime(value, '%Y-%m').date()
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1) if end else day
+
 @dashboard_bp.route('/stats/recovery', methods=['GET'])
+@read_only
 def get_recovery_stats():
-    # mock data
-    # TODO - implement with the db
-    return jsonify([
-        {'month': 'Jan', 'recovered': 120000},
-        {'month': 'Feb', 'recovered': 135000},
-        {'month': 'Mar', 'recovered': 150000}
-    ])
+    """
+    Amount recovered through payments per bucket, oldest first.
+
+    ?granularity= day, week, month (default) or year, ?from= / ?to= YYYY-MM-DD
+    or YYYY-MM. Defaults to the last 6 months.
+    """
+    granularity = request.args.get('granularity', 'month')
+    start, end = recovery.default_range(granularity)
+    try:
+        if request.args.get('from'):
+            start = parse_day(request.args['from'])
+        if request.args.get('to'):
+            end = parse_day(request.args['to'], end=True)
+        return jsonify(recovery.series(db.session, start, end, granularity))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 @dashboard_bp.route('/performance/agencies', methods=['GET'])
+@read_only
 def get_agency_performance():
+    """agencies with their outcome analytics, as of the last refresh (allocation or the job runner's sweep)"""
+    rollups = analytics.rollups(db.session)
     agencies = Agency.query.all()
-    return jsonify([a.to_dict() for a in agencies])
+
+    result = []
+    for agency in agencies:
+        data = agency.to_dict()
+        data['analytics'] = rollups[agency.id].to_dict() if agency.id in rollups else None
+        data['utilization'] = utilization(agency)
+        result.append(data)
+    return jsonify(result)
@@ -0,0 +1,82 @@
+from flask import Blueprint, current_app, json, jsonify, request, Response
+from services.events import EVENT_TYPES, get_bus
+from services.sessions import TICKET_TTL, create_ticket, redeem_ticket, session_user
+from routes.auth_routes import request_token
+
+events_bp = Blueprint('events', __name__)
+
+# comment line sent on an idle stream so proxies and the browser keep the connection
+HEARTBEAT_SECONDS = 15
+
+# how long the browser waits before reconnecting a dropped stream
+RETRY_MS = 3000
+
+# purpose of the tickets that open a stream, they are good for nothing else
+TICKET_PURPOSE = 'events'
+
+@events_bp.route('/ticket', methods=['POST'])
+def stream_ticket():
+    """
+    Single-use ticket for opening one stream. EventSource can't send headers, so
+    the stream is opened with ?ticket= rather than the session token, which would
+    land in the access log and stay usable for the rest of the session.
+    """
+    user = session_user(request_token())
+    if not user:
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    return jsonify({'ticket': create_ticket(user, TICKET_PURPOSE), 'expiresIn': TICKET_TTL})
+
+@events_bp.route('', methods=['GET'])
+def stream_events():
+    """
+    SSE stream of change events (services/events.py), replaces polling the list endpoints.
+
+    Authenticated with a Bearer session token or, from a browser's EventSource,
+    ?ticket= from POST /api/events/ticket (used up by opening the stream, a
+    reconnect needs a new one). Agency users only get events of their own agency, FedEx
+    users get everything or one agency's with ?agency_id=. ?types=case.assigned,timeline.added
+    and ?case_id= narrow the stream further. Events missed while disconnected
+    aren't replayed, clients refresh what they show when the stream (re)opens.
+    """
+    ticket = request.args.get('ticket')
+    user = redeem_ticket(ticket, TICKET_PURPOSE) if ticket else session_user(request_token())
+    if not user:
+        return jsonify({'error': 'Invalid or expired ticket' if ticket else 'Invalid or expired token'}), 401
+
+    agency_id = user.get('agencyId') if user['role'] == 'agency' else request.args.get('agency_id')
+    types = set(filter(None, request.args.get('types', '').split(',')))
+    unknown = types - set(EVENT_TYPES)
+    if unknown:
+        return jsonify({'error': f"Unknown event types: {', '.join(sorted(unknown))}. Must be among: {list(EVENT_TYPES)}"}), 400
+    case_id = request.args.get('case_id')
+
+    def accept(event):
+        return (agency_id is None or event['agencyId'] == agency_id) \
+            and (not types or event['type'] in types) \
+            and (case_id is None or event['caseId'] == case_id)
+
+    # subscribed before the response starts, nothing published after this request is missed
+    subscription = get_bus(current_app).subscribe(accept)
+
+    def generate_events():
+        # no app context is held, the stream stays open for as long as the client listens
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while True:
+                event = subscription.get(timeout=HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            subscription.close()
+
+    return Response(
+        generate_events(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Connection': 'keep-alive'
+        }
+    )
@@ -1,6 +1,10 @@
-from flask import Blueprint, json, jsonify, request, Response, stream_with_context
+from flask import Blueprint, current_app, json, jsonify, request, Response, stream_with_context
 import requests
-from models import db, Case, Customer, TimelineEvent
+from models import db, Agency, Case, Customer, DispatchChunk, TimelineEvent
+from services.allocation import ALLOCATION_RETRIES, CapacityConflict, solve, adjust_agency_load
+from services import events
+from services.dispatch import get_dispatcher
+from services.ingest import import_allocations
 import os
 import csv
 import uuid
@@ -70,33 +74,102 @@ def n8n_add_case():
     # created_at = db.Column(db.String(30))
     # auto_assign_after_hours = db.Column(db.Integer, nullable=True)
     case = Case.query.filter_by(id=data.get('invoice_id')).first()
-    if case:
+    if case and (case.assigned_agency_id or case.status != 'pending'):
         return jsonify({'status': 'error', 'message': f'Case #{data.get("invoice_id")} already exists'}), 200
-    case = Case(
-        id=data.get('invoice_id'),
-        customer_name=data.get('customer_name'),
-        customer_account_number=data.get('account_number'),
-        invoice_amount=float(data.get('amount_due')),
-        recovered_amount=0.0,
-        aging_days=None,
-        recovery_probability=None,
-        assigned_agency_id=data.get('assigned_dca'),
-        assigned_agency_reason=data.get('reasoning'),
-        status='assigned',
-        account_number=data.get('account_number'),
-        due_date=data.get('due_date'),
-        last_contact=None,
-        created_at=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-        auto_assign_after_hours=None
-    )
-    db.session.add(case)
+    created = case is None
+    if created:
+        # cases imported through /api/actions/upload already exist as pending, those just get assigned
+        case = Case(
+            id=data.get('invoice_id'),
+            customer_name=data.get('customer_name'),
+            customer_account_number=data.get('account_number'),
+            invoice_amount=float(data.get('amount_due')),
+            recovered_amount=0.0,
+            aging_days=None,
+            recovery_probability=None,
+            status='pending',
+            account_number=data.get('account_number'),
+            due_date=data.get('due_date'),
+            last_contact=None,
+            created_at=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            auto_assign_after_hours=None
+        )
+        db.session.add(case)
+
+    # the LLM only sees a snapshot of agency load, never place past capacity: the increment
+    # only goes through while the agency has room, otherwise the solver picks on fresh load
+    agency_id, reason = data.get('assigned_dca'), data.get('reasoning')
+    for attempt in range(ALLOCATION_RETRIES):
+        if not agency_id:
+            break
+        try:
+            adjust_agency_load(db.session, agency_id, 1, case.invoice_amount or 0, enforce_capacity=True)
+            break
+        except CapacityConflict:
+            decision = solve([case], Agency.query.populate_existing().all())[0]
+            agency_id, reason = decision['agencyId'], decision['reason']
+    else:
+        agency_id = None  # agency load kept changing, the case stays pending
+
+    if agency_id:
+        case.assigned_agency_id = agency_id
+        case.assigned_agency_reason = reason
+        case.status = 'assigned'
     db.session.commit()
+    if created:
+        events.publish_created([case.id])
+    events.publish_assignments([{'caseId': case.id, 'agencyId': agency_id}])
     
+    if not agency_id:
+        return jsonify({'status': 'success', 'message': f'Case #{case.id} saved as pending, every agency is at capacity'}), 200
     return jsonify({'status': 'success', 'message': f'Case #{case.id} created successfully'}), 200
 
+@n8n_bp.route('/add-cases', methods=['POST'])
+def n8n_add_cases():
+    """Bulk variant of /add-case, takes a list of allocation results (or {"cases": [...]})"""
+    data = request.get_json(silent=True)
+    items = data.get('cases') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({'status': 'error', 'message': 'Expected a list of cases'}), 400
+
+    try:
+        results = import_allocations(db.session, items)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    events.publish_created(r['caseId'] for r in results if r['result'] == 'created')
+    events.publish_assignments(results)
+
+    counts = {}
+    for result in results:
+        counts[result['result']] = counts.get(result['result'], 0) + 1
+    return jsonify({'status': 'success', 'counts': counts, 'results': results}), 200
+
 @n8n_bp.route('/process-done', methods=['GET'])
 def n8n_process_done():
-    """This will just update the status of the progress bar to finished and add a notification"""
-    # In a real implementation, you might want to update some status in the database
-    # or notify users via websockets or other means.
+    """n8n finished a batch, clients listening on /api/events get n8n.done to finish their progress bar"""
+    events.publish('n8n.done', dict(request.args))
     return jsonify({'status': 'success', 'message': 'n8n processing completed'}), 200
+
+@n8n_bp.route('/dispatch/<batch_id>', methods=['GET'])
+def n8n_dispatch_status(batch_id):
+    """Per-chunk delivery status of an upload sent to n8n"""
+    chunks = DispatchChunk.query.filter_by(batch_id=batch_id).order_by(DispatchChunk.chunk_index).all()
+    if not chunks:
+        return jsonify({'error': 'Batch not found'}), 404
+
+    counts = {}
+    for chunk in chunks:
+        counts[chunk.status] = counts.get(chunk.status, 0) + 1
+    return jsonify({'batchId': batch_id, 'counts': counts, 'chunks': [c.to_dict() for c in chunks]})
+
+@n8n_bp.route('/dispatch/<batch_id>/resume', methods=['POST'])
+def n8n_dispatch_resume(batch_id):
+    """Re-sends the chunks of a batch that failed or were left behind by a dead worker, not ones still in flight"""
+    if not DispatchChunk.query.filter_by(batch_id=batch_id).first():
+        return jsonify({'error': 'Batch not found'}), 404
+    n8n_url = os.getenv('N8N_WEBHOOK_URL')
+    if not n8n_url:
+        return jsonify({'error': 'N8N_WEBHOOK_URL not configured'}), 400
+
+    resumed = get_dispatcher().resume(current_app._get_current_object(), batch_id, n8n_url)
+    return jsonify({'status': 'success', 'batchId': batch_id, 'resumedChunks': resumed}), 200
@@ -0,0 +1,56 @@
+from flask import Blueprint, request, jsonify
+from models import db, Case, Customer, EmailArchive, TimelineEvent
+from sqlalchemy.orm import joinedload
+from services import search, timeline
+from services.storage import read_only
+
+search_bp = Blueprint('search', __name__)
+
+MAX_RESULTS = 50
+
+@search_bp.route('', methods=['GET'])
+@read_only
+def search_all():
+    """
+    Ranked search across cases, customers and email timeline content.
+
+    ?q= free text, every word matched as a prefix. ?limit= results per group.
+    Without FTS5 (non-sqlite databases) it falls back to substring matches.
+    """
+    term = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), MAX_RESULTS))
+    if not term:
+        return jsonify({'error': 'q is required'}), 400
+
+    if search.available(db.session):
+        case_hits = search.match_cases(term)
+        customer_hits = search.match_customers(term)
+        if case_hits is None:
+            return jsonify({'cases': [], 'customers': [], 'emails': []})
+        cases = Case.query.options(joinedload(Case.agency))\
+            .join(case_hits, case_hits.c.case_id == Case.id)\
+            .order_by(case_hits.c.rank).limit(limit).all()
+        customers = Customer.query\
+            .join(customer_hits, customer_hits.c.account_number == Customer.account_number)\
+            .order_by(customer_hits.c.rank).limit(limit).all()
+        emails = search.search_emails(db.session, term, limit)
+    else:
+        like = f'%{term}%'
+        cases = Case.query.options(joinedload(Case.agency)).filter(db.or_(
+            Case.customer_name.ilike(like), Case.customer_account_number.ilike(like), Case.id.ilike(like)
+        )).limit(limit).all()
+        customers = Customer.query.filter(db.or_(
+            Customer.customer_name.ilike(like), Customer.customer_email.ilike(like), Customer.account_number.ilike(like)
+        )).limit(limit).all()
+        events = timeline.full(TimelineEvent.query).filter(db.or_(
+            TimelineEvent.meta_email_subject.ilike(like), TimelineEvent.meta_email_content.ilike(like),
+            TimelineEvent.archive.has(EmailArchive.preview.ilike(like))
+        )).limit(limit).all()
+        emails = [{'eventId': e.id, 'caseId': e.case_id, 'subject': e.meta_email_subject,
+                   'snippet': (e.email_content or '')[:200]} for e in events]
+
+    return jsonify({
+        'cases': [c.to_dict() for c in cases],
+        'customers': [c.to_dict() for c in customers],
+        'emails': emails
+    })
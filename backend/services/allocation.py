@@ -0,0 +1,294 @@
+import heapq
+from datetime import datetime
+from sqlalchemy import func, update
+from models import Agency, Case
+
+# thresholds from the allocation policy in prompts.md
+HIGH_VALUE_AMOUNT = 50000
+HIGH_RISK_AGING_DAYS = 120
+HIGH_RISK_PROBABILITY = 0.60
+EXCELLENT_PERFORMANCE = 0.85
+PREFERRED_UTILIZATION = (0.50, 0.80)
+OVERLOADED_UTILIZATION = 0.90
+
+# merit gap under which two agencies are considered too close to call, one point of
+# performance_score (stored to two decimals); load is left out, the engine balances that itself
+CLOSE_CALL_MARGIN = 0.01
+
+# agency summaries mentioning these count as legal / difficult collections experience
+DIFFICULT_KEYWORDS = ('legal', 'litigation', 'difficult', 'distressed', 'high-risk')
+
+PROFILES = ('high_value', 'high_risk', 'standard')
+
+# how often a batch is re-solved when another writer took its capacity
+ALLOCATION_RETRIES = 5
+
+# cases in these states no longer take up agency capacity
+INACTIVE_STATUSES = ('resolved', 'legal', 'dismissed')
+
+
+def aging_days(case):
+    """aging_days of the case, derived from its due date when it wasn't stored"""
+    if case.aging_days is not None:
+        return case.aging_days
+    for fmt in ('%Y-%m-%d', '%d-%m-%Y'):
+        try:
+            due = datetime.strptime(case.due_date or '', fmt)
+            return max((datetime.utcnow() - due).days, 0)
+        except ValueError:
+            continue
+    return 0
+
+
+def case_profile(case):
+    """buckets a case into one of PROFILES (priority order of the policy)"""
+    if (case.invoice_amount or 0) > HIGH_VALUE_AMOUNT:
+        return 'high_value'
+    probability = case.recovery_probability
+    if aging_days(case) > HIGH_RISK_AGING_DAYS or (probability is not None and probability < HIGH_RISK_PROBABILITY):
+        return 'high_risk'
+    return 'standard'
+
+
+def utilization(agency, current=None):
+    current = (agency.current_capacity or 0) if current is None else current
+    return current / agency.capacity if agency.capacity else 1.0
+
+
+def merit(agency, profile):
+    """the load independent part of score(): what the agency's record is worth for the profile"""
+    performance = agency.performance_score or 0
+    if profile == 'high_value':
+        # only picked when no excellent agency has room
+        return performance if performance > EXCELLENT_PERFORMANCE else performance - 1.0
+    if profile == 'high_risk':
+        summary = (agency.summary or '').lower()
+        return performance + (0.1 if any(keyword in summary for keyword in DIFFICULT_KEYWORDS) else 0)
+    # standard cases weigh headroom (in score()) as much as performance
+    return 0.5 * performance
+
+
+def score(agency, profile, current=None):
+    """
+    Scores one agency for one case profile, None when the agency can't take cases.
+
+    Every term only depends on the agency and the profile of the case, which is
+    what lets allocate() score all (case x agency) pairs with one pass per profile.
+    """
+    current = (agency.current_capacity or 0) if current is None else current
+    if not agency.capacity or current >= agency.capacity:
+        return None
+
+    performance = agency.performance_score or 0
+    used = current / agency.capacity
+    low, high = PREFERRED_UTILIZATION
+
+    # workload balancing, no penalty inside the preferred band
+    if used < low:
+        balance = -(low - used) * 0.2
+    elif used > high:
+        balance = -(used - high) * 1.0
+    else:
+        balance = 0.0
+    if used > OVERLOADED_UTILIZATION and performance > EXCELLENT_PERFORMANCE:
+        balance -= 0.2
+
+    headroom = 0.5 * (1 - used) if profile == 'standard' else 0.0
+    return merit(agency, profile) + headroom + balance
+
+
+def rank_agencies(agencies, profile, counts=None):
+    """[(score, agency)] best first, leaving out agencies at capacity"""
+    counts = counts or {}
+    ranked = []
+    for agency in agencies:
+        value = score(agency, profile, counts.get(agency.id))
+        if value is not None:
+            ranked.append((value, agency))
+    ranked.sort(key=lambda pair: pair[0], reverse=True)
+    return ranked
+
+
+def close_call(profile, best, runner_up):
+    """whether the policy can't tell best from the runner-up agency on their record"""
+    # rounded, float noise must not turn a gap of exactly CLOSE_CALL_MARGIN into a close call
+    return runner_up is not None and round(abs(merit(best, profile) - merit(runner_up, profile)), 6) < CLOSE_CALL_MARGIN
+
+
+def reason(agency, profile, current=None):
+    """assignment reasoning in the same shape the LLM was asked to produce"""
+    current = (agency.current_capacity or 0) if current is None else current
+    text = (f"Agency has {(agency.performance_score or 0):.0%} performance score with "
+            f"{current}/{agency.capacity} capacity utilization ({utilization(agency, current):.0%}).")
+    if profile == 'high_value':
+        text += " High-value case routed to an agency with excellent performance."
+    elif profile == 'high_risk':
+        text += " High-risk case (long aging or low recovery probability) routed for difficult collections."
+    else:
+        text += " Best balance of performance and available capacity for a standard case."
+    return text
+
+
+def allocate(cases, agencies):
+    """
+    Picks an agency for every case against the current agency snapshot.
+
+    Returns a list of dicts with caseId, agencyId, score, profile, reason and
+    closeCall. closeCall cases (runner-up's merit within CLOSE_CALL_MARGIN) are
+    the only ones worth sending to the LLM. agencyId is None when no agency has room.
+    """
+    rankings = {profile: rank_agencies(agencies, profile) for profile in PROFILES}
+
+    decisions = []
+    for case in cases:
+        profile = case_profile(case)
+        ranked = rankings[profile]
+        if not ranked:
+            decisions.append({'caseId': case.id, 'agencyId': None, 'score': None,
+                              'profile': profile, 'reason': None, 'closeCall': False})
+            continue
+        best_score, best = ranked[0]
+        decisions.append({
+            'caseId': case.id,
+            'agencyId': best.id,
+            'score': round(best_score, 4),
+            'profile': profile,
+            'reason': reason(best, profile),
+            'closeCall': close_call(profile, best, ranked[1][1] if len(ranked) > 1 else None),
+            'amount': case.invoice_amount or 0
+        })
+    return decisions
+
+
+def solve(cases, agencies, load=None):
+    """
+    Capacity-aware batch assignment of a whole upload in one pass.
+
+    Greedy by priority: high-value cases first, then high-risk, then standard,
+    larger invoices first within a profile. Remaining capacity is decremented as
+    cases are placed, so the batch can never overfill an agency. Returns the
+    same decision dicts as allocate(), in placement order. Each case is judged
+    a close call on its own, against the runner-up that still has room on the
+    load at the time it is placed. load overrides the agencies' current_capacity
+    (agency id -> active cases) when given.
+    """
+    order = {profile: i for i, profile in enumerate(PROFILES)}
+    queue = sorted(((case_profile(case), case) for case in cases),
+                   key=lambda pair: (order[pair[0]], -(pair[1].invoice_amount or 0)))
+
+    by_id = {agency.id: agency for agency in agencies}
+    counts = {agency.id: agency.current_capacity or 0 for agency in agencies}
+    counts.update(load or {})
+    # only the chosen agency's scores change after a placement
+    scores = {profile: {a.id: score(a, profile, counts[a.id]) for a in agencies} for profile in PROFILES}
+
+    decisions = []
+    for profile, case in queue:
+        # best and runner-up among the agencies that still have room, on the load so far
+        top = heapq.nlargest(2, ((value, agency_id) for agency_id, value in scores[profile].items()
+                                 if value is not None))
+        if not top:
+            decisions.append({'caseId': case.id, 'agencyId': None, 'score': None,
+                              'profile': profile, 'reason': None, 'closeCall': False})
+            continue
+        best_score, agency_id = top[0]
+        agency = by_id[agency_id]
+        decisions.append({
+            'caseId': case.id,
+            'agencyId': agency_id,
+            'score': round(best_score, 4),
+            'profile': profile,
+            'reason': reason(agency, profile, counts[agency_id]),
+            'closeCall': close_call(profile, agency, by_id[top[1][1]] if len(top) > 1 else None),
+            'amount': case.invoice_amount or 0
+        })
+        # a deferred close call keeps its place too, the rest of the batch is balanced around it
+        counts[agency_id] += 1
+        for other in PROFILES:
+            scores[other][agency_id] = score(agency, other, counts[agency_id])
+    return decisions
+
+
+class CapacityConflict(Exception):
+    """another writer took the capacity a batch was solved against, re-solve and retry"""
+
+
+def adjust_agency_load(session, agency_id, cases_delta, amount_delta, enforce_capacity=False):
+    """
+    Moves an agency's current_capacity / active_outstanding_amount in SQL.
+
+    The increment runs as a single UPDATE so concurrent requests can't lose
+    each other's writes. With enforce_capacity the UPDATE only matches while
+    the agency stays within capacity, and CapacityConflict is raised when it
+    doesn't. Callers commit.
+    """
+    if not agency_id or (not cases_delta and not amount_delta):
+        return
+    statement = (
+        update(Agency)
+        .where(Agency.id == agency_id)
+        .values(
+            current_capacity=func.coalesce(Agency.current_capacity, 0) + cases_delta,
+            active_outstanding_amount=func.coalesce(Agency.active_outstanding_amount, 0) + amount_delta
+        )
+    )
+    if enforce_capacity and cases_delta > 0:
+        statement = statement.where(func.coalesce(Agency.current_capacity, 0) + cases_delta <= Agency.capacity)
+    if session.execute(statement).rowcount == 0 and enforce_capacity:
+        raise CapacityConflict(agency_id)
+
+
+def apply_decisions(session, decisions, skip_close_calls=False):
+    """
+    Writes solver decisions and the matching agency load in one transaction.
+
+    Returns the decisions that were applied. Raises CapacityConflict when a
+    concurrent writer filled an agency first. Callers commit.
+    """
+    applied = [d for d in decisions
+               if d['agencyId'] is not None and not (skip_close_calls and d['closeCall'])]
+    if not applied:
+        return []
+
+    session.execute(update(Case), [{
+        'id': d['caseId'],
+        'assigned_agency_id': d['agencyId'],
+        'assigned_agency_reason': d['reason'],
+        'status': 'assigned'
+    } for d in applied])
+
+    load = {}
+    for d in applied:
+        cases_delta, amount_delta = load.get(d['agencyId'], (0, 0))
+        load[d['agencyId']] = (cases_delta + 1, amount_delta + d.get('amount', 0))
+    for agency_id, (cases_delta, amount_delta) in load.items():
+        adjust_agency_load(session, agency_id, cases_delta, amount_delta, enforce_capacity=True)
+    return applied
+
+
+def allocate_pending(session, case_ids=None, defer_close_calls=True):
+    """
+    Solves and applies every pending, unassigned case (optionally only case_ids).
+
+    Agencies are ranked on their outcome-based performance (services/analytics.py).
+    Returns the solver decisions. Close calls stay pending when
+    defer_close_calls is set. Commits, and re-solves against fresh agency load
+    when a concurrent allocation took the capacity first.
+    """
+    query = session.query(Case).filter(Case.assigned_agency_id.is_(None), Case.status == 'pending')
+    if case_ids is not None:
+        if not case_ids:
+            return []
+        query = query.filter(Case.id.in_(case_ids))
+    # imported here, analytics builds on this module
+    from services.analytics import refresh_performance
+    refresh_performance(session)  # only agencies whose cases changed are recomputed
+    for attempt in range(ALLOCATION_RETRIES):
+        decisions = solve(query.all(), session.query(Agency).all())
+        try:
+            apply_decisions(session, decisions, skip_close_calls=defer_close_calls)
+            session.commit()
+            return decisions
+        except CapacityConflict:
+            session.rollback()
+    raise CapacityConflict('agency load kept changing, gave up allocating')
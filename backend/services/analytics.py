@@ -0,0 +1,147 @@
+"""
+Per-agency performance derived from what actually happened to their cases.
+
+Rollups live in agency_performance (models.AgencyPerformance) and are only
+recomputed for agencies whose cases changed since (SQLite triggers set the
+stale flag) or whose rollup is older than ANALYTICS_MAX_AGE, aging moves
+with the calendar. Recomputing one agency reads its case_stat rows and its
+own cases through the agency index, never the whole case table.
+
+Once an agency has MIN_SCORED_CASES closed cases its performance_score is
+replaced by the share of the closed invoice amount it actually recovered, so
+allocation ranks agencies on outcomes instead of the seeded value.
+
+Rollups are refreshed before every allocation and periodically by the job
+runner (services/jobs.py), readers only ever read them.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func, text
+from sqlalchemy.exc import IntegrityError
+from models import Agency, AgencyPerformance, Case, TimelineEvent
+from services import stats
+from services.allocation import INACTIVE_STATUSES, aging_days
+
+ANALYTICS_MAX_AGE = int(os.getenv('ANALYTICS_MAX_AGE', 3600))  # seconds
+
+# closed cases an agency needs before its performance_score follows its outcomes
+MIN_SCORED_CASES = 20
+
+# (label, last aging day in the bucket), the last bucket is open ended
+AGING_BUCKETS = (('0-30', 30), ('31-60', 60), ('61-90', 90), ('91-120', 120), ('120+', None))
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_mark = "UPDATE agency_performance SET stale = 1 WHERE stale = 0 AND agency_id"
+
+
+def create_statements():
+    """triggers flagging an agency's rollup stale whenever its cases change"""
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS agency_performance_case_ai AFTER INSERT ON "case" '
+        f'WHEN new.assigned_agency_id IS NOT NULL BEGIN {_mark} = new.assigned_agency_id; END',
+        f'CREATE TRIGGER IF NOT EXISTS agency_performance_case_ad AFTER DELETE ON "case" '
+        f'WHEN old.assigned_agency_id IS NOT NULL BEGIN {_mark} = old.assigned_agency_id; END',
+        f'CREATE TRIGGER IF NOT EXISTS agency_performance_case_au AFTER UPDATE OF status, assigned_agency_id, '
+        f'invoice_amount, recovered_amount, aging_days, due_date ON "case" '
+        f'BEGIN {_mark} IN (old.assigned_agency_id, new.assigned_agency_id); END',
+        # resolution times come from status_change events
+        f"CREATE TRIGGER IF NOT EXISTS agency_performance_event_ai AFTER INSERT ON timeline_event "
+        f"WHEN new.event_type = 'status_change' "
+        f'BEGIN {_mark} = (SELECT assigned_agency_id FROM "case" WHERE id = new.case_id); END',
+    ]
+
+
+def create(connection):
+    for statement in create_statements():
+        connection.execute(text(statement))
+
+
+def parse_time(value):
+    """datetime of a stored timestamp (ISO with or without Z, or TIME_FORMAT), None when unreadable"""
+    try:
+        return datetime.fromisoformat((value or '').replace('Z', ''))
+    except ValueError:
+        return None
+
+
+def aging_bucket(days):
+    for label, last_day in AGING_BUCKETS:
+        if last_day is None or days <= last_day:
+            return label
+
+
+def compute(session, agency, performance):
+    """fills performance with the agency's current rollup"""
+    totals = stats.totals_by_status(session, agency.id)
+    closed = [totals[s] for s in INACTIVE_STATUSES if s in totals]
+    performance.cases = sum(cases for cases, _, _ in totals.values())
+    performance.closed_cases = sum(cases for cases, _, _ in closed)
+    performance.active_cases = performance.cases - performance.closed_cases - totals.get(None, (0, 0, 0))[0]
+    performance.resolved_cases = totals.get('resolved', (0, 0, 0))[0]
+    performance.invoice_amount = sum(amount for _, amount, _ in totals.values())
+    performance.recovered_amount = sum(recovered for _, _, recovered in totals.values())
+    performance.closed_invoice_amount = sum(amount for _, amount, _ in closed)
+    performance.closed_recovered_amount = sum(recovered for _, _, recovered in closed)
+
+    mix = {label: 0 for label, _ in AGING_BUCKETS}
+    active = session.query(Case.aging_days, Case.due_date)\
+        .filter(Case.assigned_agency_id == agency.id, Case.status.notin_(INACTIVE_STATUSES))
+    for row in active:
+        mix[aging_bucket(aging_days(row))] += 1
+    performance.aging_mix = json.dumps(mix)
+
+    # created -> the latest status_change to resolved, per resolved case
+    resolutions = session.query(Case.created_at, func.max(TimelineEvent.timestamp))\
+        .join(TimelineEvent, TimelineEvent.case_id == Case.id)\
+        .filter(Case.assigned_agency_id == agency.id, Case.status == 'resolved',
+                TimelineEvent.event_type == 'status_change', TimelineEvent.meta_new_status == 'resolved')\
+        .group_by(Case.id)
+    days = []
+    for created_at, resolved_at in resolutions:
+        start, end = parse_time(created_at), parse_time(resolved_at)
+        if start and end and end >= start:
+            days.append((end - start).total_seconds() / 86400)
+    performance.avg_resolution_days = round(sum(days) / len(days), 1) if days else None
+
+    if performance.closed_cases >= MIN_SCORED_CASES and performance.closed_invoice_amount:
+        agency.performance_score = round(performance.closed_recovered_amount / performance.closed_invoice_amount, 4)
+    performance.computed_at = datetime.utcnow().strftime(TIME_FORMAT)
+
+
+def rollups(session):
+    """every agency's {agency_id: AgencyPerformance} as last computed, writes nothing"""
+    return {p.agency_id: p for p in session.query(AgencyPerformance)}
+
+
+def refresh_performance(session, max_age=ANALYTICS_MAX_AGE):
+    """
+    Recomputes the rollups that are stale, missing or older than max_age
+    seconds and returns every agency's {agency_id: AgencyPerformance}. Commits
+    when anything was recomputed.
+    """
+    cutoff = (datetime.utcnow() - timedelta(seconds=max_age)).strftime(TIME_FORMAT)
+    agencies = session.query(Agency).all()
+    rollups = {p.agency_id: p for p in session.query(AgencyPerformance)}
+    due = [a for a in agencies
+           if a.id not in rollups or rollups[a.id].stale or (rollups[a.id].computed_at or '') < cutoff]
+    if not due:
+        return rollups
+
+    # flags are cleared before computing, a case written meanwhile flags its agency again
+    for agency in due:
+        rollups.setdefault(agency.id, AgencyPerformance(agency_id=agency.id))
+        rollups[agency.id].stale = False
+        session.add(rollups[agency.id])
+    try:
+        session.commit()
+    except IntegrityError:
+        # a concurrent request created the missing rollups first, go again with those
+        session.rollback()
+        return refresh_performance(session, max_age)
+
+    for agency in due:
+        compute(session, agency, rollups[agency.id])
+    session.commit()
+    return rollups
@@ -0,0 +1,228 @@
+import csv
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import and_, insert, or_, update
+
+from models import db, DispatchChunk
+from services.ingest import count_rows, iter_raw_chunks
+
+# all of these can be tuned from .env
+N8N_CHUNK_SIZE = int(os.getenv('N8N_CHUNK_SIZE', 100))
+N8N_WORKERS = int(os.getenv('N8N_WORKERS', 4))
+N8N_MAX_RETRIES = int(os.getenv('N8N_MAX_RETRIES', 3))
+N8N_BACKOFF_SECONDS = float(os.getenv('N8N_BACKOFF_SECONDS', 2))
+N8N_TIMEOUT = int(os.getenv('N8N_TIMEOUT', 120))
+# a pending chunk not renewed for this long lost its sender (the process died), resume() re-sends it.
+# the dispatcher renews the chunks it holds every quarter of it
+N8N_CHUNK_LEASE_SECONDS = int(os.getenv('N8N_CHUNK_LEASE_SECONDS', 2 * N8N_TIMEOUT + 60))
+
+
+def _now():
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _read_spans(filepath, spans):
+    """yields the rows of each (row_start, row_count) span, ascending and not overlapping, in one pass over the csv"""
+    with open(filepath, 'r', encoding='utf-8', newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        position = 0
+        for row_start, row_count in spans:
+            skip = row_start - position
+            yield list(islice(reader, skip, skip + row_count))
+            position = row_start + row_count
+
+
+def _lease_cutoff():
+    return (datetime.utcnow() - timedelta(seconds=N8N_CHUNK_LEASE_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _resumable(cutoff):
+    return or_(DispatchChunk.status == 'failed',
+               and_(DispatchChunk.status == 'pending', or_(DispatchChunk.updated_at.is_(None),
+                                                           DispatchChunk.updated_at < cutoff)))
+
+
+def in_flight(session, batch_id):
+    """how many chunks of the batch a live dispatcher is still sending (pending, lease not run out)"""
+    return session.query(DispatchChunk).filter(
+        DispatchChunk.batch_id == batch_id, DispatchChunk.status == 'pending',
+        DispatchChunk.updated_at >= _lease_cutoff()
+    ).count()
+
+
+class N8nDispatcher:
+    """
+    Posts uploads to the n8n webhook in chunks from a bounded worker pool.
+
+    Every chunk gets a DispatchChunk row, so progress survives the request and
+    failed chunks can be resumed later. All workers share one requests.Session
+    (and its connection pool). At most 2 chunks per worker are read ahead, which
+    keeps memory flat no matter the file size. Failed posts are retried with
+    exponential backoff before the chunk is marked failed. While a chunk is
+    queued or being sent its updated_at is renewed, a pending chunk whose lease
+    ran out was left behind by a dead process and is resumed.
+    """
+
+    def __init__(self, workers=N8N_WORKERS):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='n8n')
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.readers = []
+        self.held = set()  # ids of the chunks queued or being sent here
+        self.renewer = None
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def dispatch_file(self, app, filepath, url, total_cases, chunk_size=N8N_CHUNK_SIZE):
+        """records the chunks of a csv and starts sending them, returns the batch id"""
+        batch_id = uuid.uuid4().hex
+        self._keep_leases(app)
+        self._start_reader(self._run_file, app, batch_id, filepath, url, total_cases, chunk_size)
+        return batch_id
+
+    def resume(self, app, batch_id, url):
+        """
+        Re-sends the chunks of a batch that failed or whose sender went away
+        (lease ran out), never ones still being delivered. When no chunk is in
+        flight any more and the batch stopped before the end of the file, the
+        rest is recorded and sent too. Returns how many recorded chunks were re-sent.
+        """
+        with app.app_context():
+            chunks = DispatchChunk.query.filter_by(batch_id=batch_id).order_by(DispatchChunk.row_start).all()
+            if not chunks:
+                return 0
+            cutoff = _lease_cutoff()
+            live = any(c.status == 'pending' and c.updated_at and c.updated_at >= cutoff for c in chunks)
+            claimed = []
+            for chunk in chunks:
+                # conditional, a concurrent resume of the same batch finds the chunk taken
+                if chunk.status != 'sent' and db.session.execute(
+                    update(DispatchChunk).where(DispatchChunk.id == chunk.id, _resumable(cutoff))
+                    .values(status='pending', updated_at=_now())
+                ).rowcount:
+                    claimed.append((chunk.id, chunk.chunk_index, chunk.row_start, chunk.row_count))
+            db.session.commit()
+            with self.lock:
+                self.held.update(chunk_id for chunk_id, _, _, _ in claimed)
+            last = max(chunks, key=lambda c: c.chunk_index)
+            filepath, next_index, next_row = last.filepath, last.chunk_index + 1, last.row_start + last.row_count
+            total_cases = count_rows(filepath)
+
+        def run():
+            spans = _read_spans(filepath, [(row_start, row_count) for _, _, row_start, row_count in claimed])
+            for (chunk_id, index, _, _), rows in zip(claimed, spans):
+                self._submit(app, chunk_id, url, rows, total_cases, batch_id=batch_id, chunk_index=index)
+            # a live reader may still be recording the batch, it carries on to the end itself
+            if not live:
+                self._run_file(app, batch_id, filepath, url, total_cases, N8N_CHUNK_SIZE, next_index, next_row)
+        self._keep_leases(app)
+        self._start_reader(run)
+        return len(claimed)
+
+    def _keep_leases(self, app):
+        with self.lock:
+            if self.renewer is None:
+                self.renewer = threading.Thread(target=self._renew_leases, args=(app,), name='n8n-leases', daemon=True)
+                self.renewer.start()
+
+    def _start_reader(self, target, *args):
+        # readers stay off the pool, they block whenever every worker is busy
+        self.readers = [t for t in self.readers if t.is_alive()]
+        reader = threading.Thread(target=target, args=args, name='n8n-reader')
+        self.readers.append(reader)
+        reader.start()
+
+    def _run_file(self, app, batch_id, filepath, url, total_cases, chunk_size, start_index=0, row_start=0):
+        try:
+            for index, rows in enumerate(iter_raw_chunks(filepath, chunk_size, row_start), start_index):
+                with app.app_context():
+                    chunk_id = db.session.execute(insert(DispatchChunk).values(
+                        batch_id=batch_id,
+                        filepath=filepath,
+                        chunk_index=index,
+                        row_start=row_start,
+                        row_count=len(rows),
+                        status='pending',
+                        attempts=0,
+                        updated_at=_now()
+                    )).inserted_primary_key[0]
+                    db.session.commit()
+                with self.lock:
+                    self.held.add(chunk_id)
+                row_start += len(rows)
+                self._submit(app, chunk_id, url, rows, total_cases, batch_id=batch_id, chunk_index=index)
+        except Exception as e:
+            print(f"n8n dispatch of batch {batch_id} stopped: {e}")
+
+    def _submit(self, app, chunk_id, url, rows, total_cases, **extra):
+        # blocks the reader once every worker has a chunk queued
+        self.slots.acquire()
+        future = self.executor.submit(self._send, app, chunk_id, url, rows, total_cases, extra)
+        future.add_done_callback(lambda _: self.slots.release())
+
+    def _send(self, app, chunk_id, url, rows, total_cases, extra):
+        payload = {'cases': rows, 'total_cases': total_cases, **extra}
+        error = None
+        attempts = 0
+        for attempt in range(N8N_MAX_RETRIES + 1):
+            attempts += 1
+            try:
+                response = self.session.post(url, json=payload, timeout=N8N_TIMEOUT)
+                response.raise_for_status()
+                error = None
+                break
+            except requests.exceptions.RequestException as e:
+                error = str(e)[:400]
+                print(f"n8n chunk {chunk_id} attempt {attempts} failed: {e}")
+                if attempt < N8N_MAX_RETRIES:
+                    time.sleep(N8N_BACKOFF_SECONDS * 2 ** attempt)
+
+        with app.app_context():
+            chunk = db.session.get(DispatchChunk, chunk_id)
+            chunk.status = 'failed' if error else 'sent'
+            chunk.attempts = (chunk.attempts or 0) + attempts
+            chunk.last_error = error
+            chunk.updated_at = _now()
+            db.session.commit()
+        with self.lock:
+            self.held.discard(chunk_id)
+
+    def _renew_leases(self, app):
+        while True:
+            time.sleep(N8N_CHUNK_LEASE_SECONDS / 4)
+            with self.lock:
+                held = list(self.held)
+            if not held:
+                continue
+            try:
+                with app.app_context():
+                    db.session.execute(update(DispatchChunk).where(
+                        DispatchChunk.id.in_(held), DispatchChunk.status == 'pending'
+                    ).values(updated_at=_now()))
+                    db.session.commit()
+            except Exception as e:
+                print(f"n8n chunk leases not renewed: {e}")
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """process wide dispatcher, created on first use"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = N8nDispatcher()
+        return _dispatcher
@@ -0,0 +1,81 @@
+"""
+Cold storage for the bodies of old email timeline events.
+
+Intercepted emails keep their raw body in timeline_event.meta_email_content,
+which makes up most of the database. Events older than ARCHIVE_AFTER_DAYS
+have the body zlib-compressed into email_archive (models.EmailArchive) and
+the inline column cleared, so the timeline table and its pages stay small.
+TimelineEvent.email_content / to_dict() read either place, the email_fts
+search index keeps the archived text (its update trigger skips archiving).
+
+    cd backend && python -m services.email_archive --days 90
+"""
+import os
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import undefer_group
+from models import EmailArchive, TimelineEvent
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('EMAIL_ARCHIVE_AFTER_DAYS', 90))
+
+# bodies shorter than this stay inline, compressing them saves next to nothing
+MIN_CHARS = 200
+
+# events archived per transaction
+BATCH_SIZE = 500
+
+COMPRESSION_LEVEL = 6
+
+
+def compress(content):
+    return zlib.compress(content.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def archive_emails(session, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, min_chars=MIN_CHARS):
+    """
+    Moves the inline bodies of email events older than older_than_days into
+    email_archive, committing every batch_size events. Returns
+    (events archived, characters moved, compressed bytes written).
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=older_than_days)).isoformat()
+    archived_at = datetime.utcnow().isoformat() + 'Z'
+    archived = moved = written = 0
+    while True:
+        events = session.query(TimelineEvent).options(undefer_group('body'))\
+            .filter(TimelineEvent.timestamp < cutoff,
+                    TimelineEvent.meta_email_content.isnot(None),
+                    func.length(TimelineEvent.meta_email_content) >= min_chars,
+                    ~TimelineEvent.archive.has())\
+            .order_by(TimelineEvent.timestamp).limit(batch_size).all()
+        if not events:
+            return archived, moved, written
+
+        for event in events:
+            body = compress(event.meta_email_content)
+            session.add(EmailArchive(event_id=event.id, codec='zlib', body=body,
+                                     preview=event.meta_email_content[:EmailArchive.preview.type.length],
+                                     original_size=len(event.meta_email_content), archived_at=archived_at))
+            moved += len(event.meta_email_content)
+            written += len(body)
+        # archive rows go in first, the fts update trigger only keeps the text once they exist
+        session.flush()
+        for event in events:
+            event.meta_email_content = None
+        session.commit()
+        archived += len(events)
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import create_app
+    from models import db
+
+    parser = argparse.ArgumentParser(description='Compress the bodies of old email events into email_archive')
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help='archive emails older than this')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        count, chars, size = archive_emails(db.session, args.days)
+    print(f'Archived {count} email(s), {chars} characters into {size} bytes')
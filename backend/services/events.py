@@ -0,0 +1,239 @@
+"""
+Change events pushed to clients instead of having them re-query.
+
+Writers publish() after they commit: case.created, case.assigned,
+timeline.added, job.progress and n8n.done. /api/events (routes/event_routes.py)
+holds one SSE stream per client and fans every event out to the streams whose
+user may see it: FedEx users get everything, an agency user only events
+carrying their agencyId.
+
+The bus delivers to the subscribers of its own process. EVENT_BUS_BACKEND
+picks how events get there:
+  memory    published events go straight to this process' subscribers
+            (python app.py, a single gunicorn worker)
+  database  events are appended to event_log, every process with open
+            streams polls it for new rows, so a stream on one gunicorn worker
+            sees what another worker published
+"""
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+from models import db, Case, EventLog
+
+EVENT_BUS_BACKEND = os.getenv('EVENT_BUS_BACKEND', 'memory')
+
+EVENT_TYPES = ('case.created', 'case.assigned', 'timeline.added', 'job.progress', 'n8n.done')
+
+# events buffered per stream, a client that falls further behind loses the oldest
+SUBSCRIBER_BUFFER = 1000
+
+# database backend: how often a process looks for new rows, how long rows are kept
+EVENT_POLL_SECONDS = float(os.getenv('EVENT_POLL_SECONDS', 0.5))
+EVENT_RETENTION = timedelta(hours=1)
+
+
+def _now():
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+class Subscription:
+    """one client's stream: the events accept() let through, oldest first"""
+
+    def __init__(self, bus, accept):
+        self.bus = bus
+        self.accept = accept
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_BUFFER)
+
+    def put(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """next event, None when nothing arrived within timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class MemoryBackend:
+    """delivers events to the subscribers of this process only"""
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.ids = itertools.count(1)
+
+    def publish(self, event):
+        event['id'] = next(self.ids)
+        self.bus.deliver(event)
+
+    def subscribed(self, first):
+        pass
+
+
+class DatabaseBackend:
+    """
+    Events go through the event_log table. A poller thread per process,
+    started by its first subscriber, delivers the rows other processes added.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_id = None
+        self.last_prune = 0
+
+    def publish(self, event):
+        with self.bus.app.app_context(), db.engine.begin() as connection:
+            connection.execute(insert(EventLog).values(
+                type=event['type'], agency_id=event['agencyId'], case_id=event['caseId'],
+                payload=json.dumps(event), created_at=event['timestamp']
+            ))
+            if time.monotonic() - self.last_prune > EVENT_RETENTION.total_seconds() / 4:
+                self.last_prune = time.monotonic()
+                cutoff = (datetime.utcnow() - EVENT_RETENTION).isoformat() + 'Z'
+                connection.execute(delete(EventLog).where(EventLog.created_at < cutoff))
+
+    def subscribed(self, first):
+        """a stream opened, the first one after an idle spell starts from the newest row, nothing older is replayed"""
+        with self.lock:
+            if first or self.thread is None:
+                with self.bus.app.app_context(), db.engine.connect() as connection:
+                    self.last_id = connection.execute(select(func.max(EventLog.id))).scalar() or 0
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._poll, name='event-poller', daemon=True)
+                self.thread.start()
+
+    def _poll(self):
+        while True:
+            time.sleep(EVENT_POLL_SECONDS)
+            if not self.bus.subscribers:
+                continue
+            # held while delivering, a first subscriber moving last_id waits for this round
+            with self.lock:
+                try:
+                    with self.bus.app.app_context(), db.engine.connect() as connection:
+                        rows = connection.execute(
+                            select(EventLog.id, EventLog.payload).where(EventLog.id > self.last_id)
+                            .order_by(EventLog.id)
+                        ).all()
+                except Exception as e:
+                    print(f'Event poll failed: {e}')
+                    continue
+                for row in rows:
+                    self.last_id = row.id
+                    self.bus.deliver({**json.loads(row.payload), 'id': row.id})
+
+
+BACKENDS = {'memory': MemoryBackend, 'database': DatabaseBackend}
+
+
+class EventBus:
+    def __init__(self, app, backend=EVENT_BUS_BACKEND):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown EVENT_BUS_BACKEND '{backend}', expected one of {', '.join(BACKENDS)}")
+        self.app = app
+        self.backend = BACKENDS[backend](self)
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def publish(self, event_type, data=None, agency_id=None, case_id=None):
+        """announces a committed change, agency_id limits who sees it (None: FedEx users only)"""
+        event = {'type': event_type, 'agencyId': agency_id, 'caseId': case_id, 'data': data or {},
+                 'timestamp': _now()}
+        try:
+            self.backend.publish(event)
+        except Exception as e:
+            # the change itself is committed, a lost notification only delays the client's next refresh
+            print(f'Failed to publish {event_type}: {e}')
+
+    def subscribe(self, accept):
+        """stream of the events accept(event) is true for, close() it when the client goes away"""
+        subscription = Subscription(self, accept)
+        with self.lock:
+            self.subscribers.add(subscription)
+            first = len(self.subscribers) == 1
+        self.backend.subscribed(first)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def deliver(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            if subscription.accept(event):
+                subscription.put(event)
+
+
+def init_app(app):
+    app.extensions['events'] = EventBus(app, app.config.get('EVENT_BUS_BACKEND', EVENT_BUS_BACKEND))
+
+
+def get_bus(app):
+    return app.extensions['events']
+
+
+def publish(event_type, data=None, agency_id=None, case_id=None):
+    """publishes on the current app's bus, call it after the change is committed"""
+    get_bus(current_app._get_current_object()).publish(event_type, data, agency_id, case_id)
+
+
+def publish_created(case_ids):
+    """one case.created for a batch of new cases, FedEx users only until they are assigned"""
+    case_ids = list(case_ids)
+    if case_ids:
+        publish('case.created', {'caseIds': case_ids}, case_id=case_ids[0] if len(case_ids) == 1 else None)
+
+
+def publish_assignments(assignments, skip_close_calls=False):
+    """
+    one case.assigned per agency for assignments, solver decisions or import
+    results ({caseId, agencyId, closeCall}), leaving out close calls when they
+    were skipped and cases no agency took
+    """
+    by_agency = {}
+    for assignment in assignments:
+        if assignment.get('agencyId') and not (skip_close_calls and assignment.get('closeCall')):
+            by_agency.setdefault(assignment['agencyId'], []).append(assignment['caseId'])
+    for agency_id, case_ids in by_agency.items():
+        publish('case.assigned', {'caseIds': case_ids}, agency_id=agency_id,
+                case_id=case_ids[0] if len(case_ids) == 1 else None)
+
+
+def publish_timeline(event):
+    """timeline.added for event, seen by the agency its case is assigned to"""
+    agency_id = event.case.assigned_agency_id if event.case else None
+    publish('timeline.added', {'eventIds': [event.id], 'event': event.to_dict()}, agency_id=agency_id,
+            case_id=event.case_id)
+
+
+def publish_timeline_batch(session, events):
+    """one timeline.added per case for events, (case_id, event_id) pairs committed together"""
+    by_case = {}
+    for case_id, event_id in events:
+        by_case.setdefault(case_id, []).append(event_id)
+    if not by_case:
+        return
+    agencies = dict(session.execute(select(Case.id, Case.assigned_agency_id).where(Case.id.in_(by_case))).all())
+    for case_id, event_ids in by_case.items():
+        publish('timeline.added', {'eventIds': event_ids}, agency_id=agencies.get(case_id), case_id=case_id)
@@ -0,0 +1,543 @@
+import csv
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import insert, select, update
+from models import Agency, Case, Customer, TimelineEvent
+from services.allocation import ALLOCATION_RETRIES, CapacityConflict, adjust_agency_load, solve
+
+# rows held in memory (and written per transaction) while importing an upload
+DEFAULT_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 2000))
+
+# columns of the fedex export (see uploads/fedex_input.csv)
+REQUIRED_COLUMNS = ['account_number', 'customer_name', 'amount_due', 'invoice_number']
+
+# fields every n8n allocation result needs, the case and customer columns they fill are NOT NULL
+ALLOCATION_FIELDS = ['invoice_id', 'account_number', 'customer_name']
+
+
+def insert_ignoring_conflicts(session, model):
+    """
+    INSERT that skips rows whose primary key already exists.
+
+    Two imports running at once can both decide a customer is new, the loser
+    of that race must not fail its whole chunk.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return insert(model)
+    return dialect_insert(model).on_conflict_do_nothing()
+
+
+def count_rows(filepath):
+    """counts the data rows of a csv without keeping them around"""
+    with open(filepath, 'r', encoding='utf-8', newline='') as csvfile:
+        return sum(1 for _ in csv.DictReader(csvfile))
+
+
+def file_sha256(filepath):
+    """content hash identifying an upload, read in 1MB blocks"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def email_hash(case_id, timestamp, sender, subject, body):
+    """
+    content hash identifying an intercepted email, the same email delivered
+    again (n8n retries, Gmail trigger replays) hashes the same
+    """
+    digest = hashlib.sha256()
+    for value in (case_id, timestamp, sender, subject, body):
+        digest.update(('' if value is None else str(value)).encode('utf-8'))
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+
+def iter_raw_chunks(filepath, chunk_size=DEFAULT_CHUNK_SIZE, start=0):
+    """yields lists of at most chunk_size raw csv rows (dicts), skipping the first start rows"""
+    with open(filepath, 'r', encoding='utf-8', newline='') as csvfile:
+        chunk = []
+        for row in islice(csv.DictReader(csvfile), start, None):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def parse_row(row):
+    """
+    Validates one csv row and converts it into customer + case column values.
+
+    The mapping mirrors what n8n posts to /api/n8n/add-case, so a case imported
+    here and one allocated through n8n look the same. Raises ValueError with a
+    readable message when the row can't be imported.
+    """
+    missing = [col for col in REQUIRED_COLUMNS if not (row.get(col) or '').strip()]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    try:
+        amount_due = float(row['amount_due'])
+    except ValueError:
+        raise ValueError(f"invalid amount_due '{row['amount_due']}'")
+
+    account_number = row['account_number'].strip()
+    customer_name = row['customer_name'].strip()
+    agency_id = (row.get('agency_id') or '').strip() or None
+
+    customer = {
+        'account_number': account_number,
+        'account_type': row.get('account_type'),
+        'customer_name': customer_name,
+        'customer_email': row.get('customer_email'),
+        'customer_tier': row.get('customer_tier'),
+        'historical_health': row.get('historical_health'),
+        'due_date': row.get('due_date'),
+        'amount_due': amount_due,
+        'service_type': row.get('service_type'),
+        'region': row.get('region')
+    }
+    case = {
+        'id': row['invoice_number'].strip(),
+        'customer_name': customer_name,
+        'customer_account_number': account_number,
+        'invoice_amount': amount_due,
+        'recovered_amount': 0.0,
+        'aging_days': None,
+        'recovery_probability': None,
+        'assigned_agency_id': agency_id,
+        'assigned_agency_reason': None,
+        'status': 'assigned' if agency_id else 'pending',
+        'account_number': account_number,
+        'due_date': row.get('due_date'),
+        'last_contact': None,
+        'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        'auto_assign_after_hours': None
+    }
+    return customer, case
+
+
+def iter_parsed_chunks(filepath, chunk_size=DEFAULT_CHUNK_SIZE, start=0):
+    """
+    Streams the csv in chunks of parsed rows, from data row offset start.
+
+    Yields (parsed, errors, raw) per chunk where parsed is a list of
+    (customer, case) tuples, errors a list of row error strings and raw the
+    untouched csv rows (forwarded to n8n as-is). Row numbers are 1-based data rows.
+    """
+    row_number = start
+    for raw in iter_raw_chunks(filepath, chunk_size, start):
+        parsed, errors = [], []
+        for row in raw:
+            row_number += 1
+            try:
+                parsed.append(parse_row(row))
+            except ValueError as e:
+                errors.append(f"Row {row_number}: {e}")
+        yield parsed, errors, raw
+
+
+def insert_rows(session, model, statement, rows):
+    """
+    Bulk INSERT of rows (dicts with the same keys) as multi-row VALUES statements.
+
+    RETURNING is what makes SQLAlchemy batch an executemany into a few
+    "insertmanyvalues" statements. The search index triggers cost a fixed
+    amount per statement, so one row per statement is about twice as slow.
+    """
+    session.execute(statement.returning(*model.__table__.primary_key), rows).all()
+
+
+def reserve_assigned(session, cases):
+    """
+    Books the agency load of cases that come with an agency_id, one enforced
+    UPDATE per agency, in the caller's transaction. Rows beyond an agency's
+    free capacity, or naming an unknown agency, are refused rather than
+    overloading it. Returns (accepted_cases, errors).
+    """
+    by_agency = {}
+    for case in cases:
+        if case.get('assigned_agency_id'):
+            by_agency.setdefault(case['assigned_agency_id'], []).append(case)
+    if not by_agency:
+        return cases, []
+
+    free = {agency_id: max((capacity or 0) - (current or 0), 0) for agency_id, capacity, current in session.execute(
+        select(Agency.id, Agency.capacity, Agency.current_capacity).where(Agency.id.in_(by_agency))
+    )}
+    refused, errors = set(), []
+    for agency_id, assigned in by_agency.items():
+        accepted = assigned[:free.get(agency_id, 0)]
+        try:
+            adjust_agency_load(session, agency_id, len(accepted),
+                               sum(case['invoice_amount'] for case in accepted), enforce_capacity=True)
+        except CapacityConflict:
+            accepted = []  # a concurrent writer took the capacity first
+        reason = 'has no capacity left' if agency_id in free else 'does not exist'
+        for case in assigned[len(accepted):]:
+            refused.add(case['id'])
+            errors.append(f"Case #{case['id']}: agency {agency_id} {reason}")
+    return [case for case in cases if case['id'] not in refused], errors
+
+
+def write_chunk(session, parsed, commit=True):
+    """
+    Bulk writes one chunk of parsed rows in a single transaction.
+
+    Customers and existing cases are resolved with one IN query each and the
+    new rows go out as multi-row inserts, instead of a lookup + add per row.
+    Returns (created_case_ids, errors). Existing customers are reused, cases
+    whose invoice already exists are reported instead of overwritten, and rows
+    assigned to an agency book its load or are reported when it's full. With
+    commit=False the caller commits, e.g. together with an import checkpoint.
+    """
+    if not parsed:
+        return [], []
+
+    account_numbers = {customer['account_number'] for customer, _ in parsed}
+    case_ids = {case['id'] for _, case in parsed}
+    known_customers = set(session.scalars(
+        select(Customer.account_number).where(Customer.account_number.in_(account_numbers))
+    ))
+    known_cases = set(session.scalars(select(Case.id).where(Case.id.in_(case_ids))))
+
+    new_customers, new_cases, errors = {}, [], []
+    for customer_fields, case_fields in parsed:
+        account_number = customer_fields['account_number']
+        if account_number not in known_customers and account_number not in new_customers:
+            new_customers[account_number] = customer_fields
+
+        if case_fields['id'] in known_cases:
+            errors.append(f"Case #{case_fields['id']} already exists")
+            continue
+        known_cases.add(case_fields['id'])  # also catches repeats inside the chunk
+        new_cases.append(case_fields)
+
+    try:
+        new_cases, refused = reserve_assigned(session, new_cases)
+        errors.extend(refused)
+        if new_customers:
+            insert_rows(session, Customer, insert_ignoring_conflicts(session, Customer), list(new_customers.values()))
+        if new_cases:
+            insert_rows(session, Case, insert(Case), new_cases)
+        if commit:
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return [case['id'] for case in new_cases], errors
+
+
+def allocation_fields(item):
+    """
+    Converts one n8n allocation result (the /api/n8n/add-case payload) into
+    customer + case column values. Raises ValueError when it can't be imported.
+    """
+    if not isinstance(item, dict):
+        raise ValueError('expected an object')
+    missing = [field for field in ALLOCATION_FIELDS if not item.get(field)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    try:
+        amount_due = float(item.get('amount_due'))
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid amount_due '{item.get('amount_due')}'")
+
+    customer = {
+        'account_number': item['account_number'],
+        'account_type': item.get('account_type'),
+        'customer_name': item.get('customer_name'),
+        'customer_email': item.get('customer_email'),
+        'customer_tier': item.get('customer_tier'),
+        'historical_health': item.get('historical_health'),
+        'due_date': item.get('due_date'),
+        'amount_due': amount_due,
+        'service_type': item.get('service_type'),
+        'region': item.get('region')
+    }
+    case = {
+        'id': item['invoice_id'],
+        'customer_name': item.get('customer_name'),
+        'customer_account_number': item['account_number'],
+        'invoice_amount': amount_due,
+        'recovered_amount': 0.0,
+        'aging_days': None,
+        'recovery_probability': None,
+        'assigned_agency_id': None,
+        'assigned_agency_reason': None,
+        'status': 'pending',
+        'account_number': item['account_number'],
+        'due_date': item.get('due_date'),
+        'last_contact': None,
+        'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        'auto_assign_after_hours': None
+    }
+    return customer, case
+
+
+def import_allocations(session, items):
+    """
+    Imports a batch of n8n allocation results in one transaction, see
+    _import_allocations. The batch is redone when a concurrent writer took
+    agency capacity it was planned against.
+    """
+    for attempt in range(ALLOCATION_RETRIES):
+        try:
+            return _import_allocations(session, items)
+        except CapacityConflict:
+            session.rollback()
+    raise CapacityConflict('agency load kept changing, gave up importing')
+
+
+def _import_allocations(session, items):
+    """
+    Imports a batch of n8n allocation results in one transaction.
+
+    Customers and cases are resolved with one IN query each, known customers
+    are reused as they are. Cases the upload already stored as pending get
+    assigned, any other existing case is a duplicate. Items that aren't
+    objects or lack a required field are reported as errors. When the LLM
+    picked an agency without room the capacity-aware solver picks instead.
+    Returns one {index, caseId, result, message} per item, result being
+    created, assigned, duplicate or error, created and assigned ones also
+    carry the agencyId the case went to (None when none had room).
+    """
+    results, valid = [], []
+    for index, item in enumerate(items):
+        try:
+            customer_fields, case_fields = allocation_fields(item)
+            valid.append((index, item, customer_fields, case_fields))
+        except ValueError as e:
+            case_id = item.get('invoice_id') if isinstance(item, dict) else None
+            results.append({'index': index, 'caseId': case_id, 'result': 'error', 'message': str(e)})
+
+    account_numbers = {customer['account_number'] for _, _, customer, _ in valid}
+    case_ids = {case['id'] for _, _, _, case in valid}
+    known_customers = set(session.scalars(
+        select(Customer.account_number).where(Customer.account_number.in_(account_numbers))
+    )) if account_numbers else set()
+    existing = {case.id: case for case in session.scalars(select(Case).where(Case.id.in_(case_ids)))} if case_ids else {}
+
+    agencies = session.scalars(select(Agency)).all()
+    capacity = {agency.id: agency.capacity or 0 for agency in agencies}
+    load = {agency.id: agency.current_capacity or 0 for agency in agencies}
+
+    new_customers, new_cases, updates, seen = {}, [], [], set()
+    load_delta = {}
+    for index, item, customer_fields, case_fields in valid:
+        case_id = case_fields['id']
+        current = existing.get(case_id)
+        if case_id in seen or (current is not None and (current.assigned_agency_id or current.status != 'pending')):
+            results.append({'index': index, 'caseId': case_id, 'result': 'duplicate', 'message': f'Case #{case_id} already exists'})
+            continue
+        seen.add(case_id)
+
+        account_number = customer_fields['account_number']
+        if account_number not in known_customers and account_number not in new_customers:
+            new_customers[account_number] = customer_fields
+
+        if current is not None:
+            case_fields['invoice_amount'] = current.invoice_amount
+            case_fields['due_date'] = current.due_date
+
+        agency_id, reason = item.get('assigned_dca'), item.get('reasoning')
+        if agency_id not in capacity or load[agency_id] >= capacity[agency_id]:
+            decision = solve([Case(**case_fields)], agencies, load)[0]
+            agency_id, reason = decision['agencyId'], decision['reason']
+        if agency_id:
+            load[agency_id] += 1
+            cases_delta, amount_delta = load_delta.get(agency_id, (0, 0))
+            load_delta[agency_id] = (cases_delta + 1, amount_delta + (case_fields['invoice_amount'] or 0))
+            assignment = {'assigned_agency_id': agency_id, 'assigned_agency_reason': reason, 'status': 'assigned'}
+        else:
+            assignment = {}
+
+        if current is not None:
+            updates.append({'id': case_id, **assignment})
+            results.append({'index': index, 'caseId': case_id, 'agencyId': agency_id,
+                            'result': 'assigned' if agency_id else 'error',
+                            'message': f'Case #{case_id} assigned' if agency_id else 'every agency is at capacity'})
+        else:
+            new_cases.append({**case_fields, **assignment})
+            results.append({'index': index, 'caseId': case_id, 'agencyId': agency_id, 'result': 'created',
+                            'message': f'Case #{case_id} created successfully' if agency_id
+                            else f'Case #{case_id} saved as pending, every agency is at capacity'})
+
+    try:
+        if new_customers:
+            insert_rows(session, Customer, insert_ignoring_conflicts(session, Customer), list(new_customers.values()))
+        if new_cases:
+            insert_rows(session, Case, insert(Case), new_cases)
+        updates = [u for u in updates if len(u) > 1]
+        if updates:
+            session.execute(update(Case), updates)
+        for agency_id, (cases_delta, amount_delta) in load_delta.items():
+            adjust_agency_load(session, agency_id, cases_delta, amount_delta, enforce_capacity=True)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    results.sort(key=lambda result: result['index'])
+    return results
+
+
+def sanitize_json(input_str):
+    """
+    Sanitize and parse JSON input string, removing potentially harmful content.
+
+    This function is designed to clean JSON input received from n8n workflows by:
+    1. Parsing the JSON string into a Python dictionary
+    2. Removing potentially harmful HTML script tags from string values within the 'content' field
+
+    Args:
+        input_str (str): A JSON-formatted string that needs to be sanitized and parsed.
+
+    Returns:
+        dict: A dictionary containing the sanitized JSON data. Returns an empty dictionary 
+            if the input string is not valid JSON.
+
+    Raises:
+        No exceptions are raised. JSON parsing errors are caught and handled by returning 
+        an empty dictionary.
+
+    Example:
+        >>> json_str = '{"content": {"message": "<script>alert(1)</script>Hello"}}'
+        >>> result = sanitize_json(json_str)
+        >>> print(result)
+        {'content': {'message': 'Hello'}}
+
+    Note:
+        - This is a basic sanitization approach that only removes <script> tags
+        - For production use, consider using more comprehensive sanitization libraries
+        - Only sanitizes string values within the 'content' dictionary key
+        - Non-string values in 'content' are left unchanged
+    """
+    try:
+        data = json.loads(input_str)
+        # Basic sanitization: remove any script tags or potentially harmful content
+        if isinstance(data, dict) and isinstance(data.get('content'), dict):
+            for key in data['content']:
+                if isinstance(data['content'][key], str):
+                    data['content'][key] = data['content'][key].replace('<script>', '').replace('</script>', '')
+        return data
+    except json.JSONDecodeError:
+        return {}
+
+
+def email_fields(payload):
+    """
+    Converts one n8n email interception result (the /api/actions/print-json
+    payload, an LLM completion whose message content is the email as JSON)
+    into timeline_event column values. Raises ValueError when it can't be parsed.
+    """
+    try:
+        data = sanitize_json(payload['choices'][0]['message']['content'])
+    except (KeyError, IndexError, TypeError):
+        raise ValueError('missing choices[0].message.content')
+    if not data:
+        raise ValueError('message content is not valid JSON')
+    if not isinstance(data, dict):
+        raise ValueError('message content is not a JSON object')
+    content = data.get('content') if isinstance(data.get('content'), dict) else {}
+    # hashed as delivered, the timestamp default below differs on every replay
+    content_hash = email_hash(data.get('invoiceId', 'unknown'), data.get('timestamp'), data.get('from', 'unknown'),
+                              content.get('subject'), content.get('body'))
+
+    return {
+        'id': str(uuid.uuid4()),
+        'case_id': data.get('invoiceId', 'unknown'),
+        'timestamp': data.get('timestamp', datetime.now().isoformat()),
+        'from_': data.get('from', 'unknown'),
+        'to_': data.get('to', 'unknown'),
+        'event_type': 'email',
+        'title': 'Email Received From Customer',
+        'description': 'No description provided',
+        'meta_amount': data.get('amount', None),
+        'meta_email_subject': content.get('subject'),
+        'meta_email_content': content.get('body'),
+        'meta_previous_status': data.get('previousStatus', None),
+        'meta_new_status': data.get('newStatus', None),
+        'content_hash': content_hash
+    }
+
+
+def recorded_emails(session, hashes):
+    """{content_hash: event id} of the hashes already stored, one probe of the unique index each"""
+    if not hashes:
+        return {}
+    return dict(session.execute(
+        select(TimelineEvent.content_hash, TimelineEvent.id).where(TimelineEvent.content_hash.in_(hashes))
+    ).all())
+
+
+def import_emails(session, items):
+    """
+    Stores a batch of n8n email interception results as timeline events in
+    one transaction.
+
+    The invoiceIds are checked against the case table and the content hashes
+    against the timeline with one IN query each. An email for an unknown case
+    is reported instead of stored, one already recorded (or repeated inside
+    the batch) is a duplicate, so replaying a batch stores nothing twice.
+    Returns one {index, eventId, caseId, result, message} per item, result
+    being created, duplicate or error.
+    """
+    results, valid = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, email_fields(item or {})))
+        except ValueError as e:
+            results.append({'index': index, 'eventId': None, 'caseId': None, 'result': 'error', 'message': str(e)})
+
+    case_ids = {fields['case_id'] for _, fields in valid}
+    known_cases = set(session.scalars(select(Case.id).where(Case.id.in_(case_ids)))) if case_ids else set()
+    recorded = recorded_emails(session, {fields['content_hash'] for _, fields in valid})
+
+    rows, created = [], []
+    for index, fields in valid:
+        case_id = fields['case_id']
+        if case_id not in known_cases:
+            results.append({'index': index, 'eventId': None, 'caseId': case_id, 'result': 'error',
+                            'message': f'Case #{case_id} not found'})
+        elif fields['content_hash'] in recorded:
+            results.append({'index': index, 'eventId': recorded[fields['content_hash']], 'caseId': case_id,
+                            'result': 'duplicate', 'message': 'Email already recorded'})
+        else:
+            recorded[fields['content_hash']] = fields['id']  # also catches repeats inside the batch
+            rows.append(fields)
+            created.append((index, fields))
+
+    try:
+        # a concurrent replay may store the same email meanwhile, the unique index drops it here
+        inserted = set(session.scalars(
+            insert_ignoring_conflicts(session, TimelineEvent).returning(TimelineEvent.id), rows
+        ).all()) if rows else set()
+        lost = {fields['content_hash'] for _, fields in created if fields['id'] not in inserted}
+        winners = recorded_emails(session, lost)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    for index, fields in created:
+        if fields['id'] in inserted:
+            results.append({'index': index, 'eventId': fields['id'], 'caseId': fields['case_id'], 'result': 'created',
+                            'message': 'Timeline event created successfully'})
+        else:
+            results.append({'index': index, 'eventId': winners.get(fields['content_hash']), 'caseId': fields['case_id'],
+                            'result': 'duplicate', 'message': 'Email already recorded'})
+    results.sort(key=lambda result: result['index'])
+    return results
@@ -0,0 +1,307 @@
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update as sa_update
+
+from models import db, DispatchChunk, Job
+from services import analytics, events
+from services.allocation import allocate_pending
+from services.dispatch import get_dispatcher
+from services.ingest import count_rows, iter_parsed_chunks, write_chunk
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+
+# a job whose updated_at is older than this belongs to a worker that went away
+# (crash, timeout, recycle) and is taken over, running jobs renew it every quarter of it
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 120))
+
+# keeps a huge broken file from turning the job row into megabytes of errors
+MAX_STORED_ERRORS = 500
+
+FINISHED_STATUSES = ('done', 'error')
+
+_handlers = {}
+
+
+def _now():
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def register(kind):
+    """decorator registering the function that runs jobs of this kind"""
+    def wrap(func):
+        _handlers[kind] = func
+        return func
+    return wrap
+
+
+class JobRunner:
+    """
+    Runs queued jobs on worker threads, outside of any request.
+
+    Jobs live in the job table, so a client disconnecting doesn't stop an
+    import, and jobs left unfinished by a restart are picked up again by start()
+    once reset_interrupted() put them back to received. A claimed job is
+    leased: the runner renews its updated_at while it runs, and sweep() takes
+    over jobs whose lease ran out because their worker died without a restart.
+    The same sweeper thread keeps the agency analytics rollups current.
+    Several processes (gunicorn workers) may queue the same job, only the one
+    that claims it runs it.
+    """
+
+    def __init__(self, app, workers=JOB_WORKERS, lease=JOB_LEASE_SECONDS):
+        self.app = app
+        self.workers = workers
+        self.lease = lease
+        self.queue = queue.Queue()
+        self.threads = []
+        self.sweeper = None
+        self.running = set()  # ids of the jobs this runner's workers hold
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            with self.app.app_context():
+                waiting = Job.query.filter(Job.status == 'received').order_by(Job.created_at).all()
+                for job in waiting:
+                    self.queue.put(job.id)
+            for i in range(self.workers):
+                # daemon: an interrupted job stays unfinished in the db and is resumed after the next restart
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            self.sweeper = threading.Thread(target=self._sweep, name='job-sweeper', daemon=True)
+            self.sweeper.start()
+
+    def enqueue(self, kind, **fields):
+        """stores a new job and hands it to the workers, returns it"""
+        self.start()
+        job = Job(id=uuid.uuid4().hex, kind=kind, status='received', message='File received, waiting for a worker',
+                  created_at=_now(), updated_at=_now(), **fields)
+        db.session.add(job)
+        db.session.commit()
+        self.queue.put(job.id)
+        return job
+
+    def requeue(self, job):
+        """hands a failed job back to the workers, it resumes from its checkpoint"""
+        self.start()
+        update(job, status='received', message='Resuming from row checkpoint, waiting for a worker', finished_at=None)
+        self.queue.put(job.id)
+        return job
+
+    def stop(self, timeout=None):
+        """
+        Graceful shutdown: workers finish the job they are running (up to
+        timeout seconds) and take no new ones. A job still running after that
+        stays unfinished and is resumed from its checkpoint on the next start.
+        """
+        self.stopping.set()
+        for _ in self.threads:
+            self.queue.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+    def sweep(self):
+        """
+        Renews the lease of the jobs running here and puts jobs whose lease ran
+        out back to received, queued here. Returns the ids taken over.
+        """
+        with self.lock:
+            running = list(self.running)
+        cutoff = (datetime.utcnow() - timedelta(seconds=self.lease)).strftime('%Y-%m-%d %H:%M:%S')
+        unfinished = Job.status.notin_(FINISHED_STATUSES + ('received',))
+        taken = []
+        with self.app.app_context():
+            if running:
+                db.session.execute(sa_update(Job).where(Job.id.in_(running), unfinished).values(updated_at=_now()))
+            for job_id in db.session.scalars(select(Job.id).where(unfinished, Job.updated_at < cutoff)).all():
+                # conditional, of several processes sweeping at once only one takes the job over
+                if db.session.execute(
+                    sa_update(Job).where(Job.id == job_id, unfinished, Job.updated_at < cutoff)
+                    .values(status='received', message='Worker stopped, waiting for another one', updated_at=_now())
+                ).rowcount:
+                    taken.append(job_id)
+            db.session.commit()
+        for job_id in taken:
+            self.queue.put(job_id)
+        return taken
+
+    def refresh_analytics(self):
+        """recomputes agency rollups that are stale or aged out, GET /api/performance/agencies only reads them"""
+        with self.app.app_context():
+            analytics.refresh_performance(db.session)
+
+    def _sweep(self):
+        while True:
+            for task in (self.sweep, self.refresh_analytics):
+                try:
+                    task()
+                except Exception:
+                    traceback.print_exc()
+            if self.stopping.wait(self.lease / 4):
+                return
+
+    def _work(self):
+        while True:
+            job_id = self.queue.get()
+            try:
+                if job_id is None or self.stopping.is_set():
+                    return
+                self._run(job_id)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            # received -> processing in one statement, another process that queued the job too finds it taken
+            claimed = db.session.execute(
+                sa_update(Job).where(Job.id == job_id, Job.status == 'received').values(status='processing', updated_at=_now())
+            ).rowcount
+            db.session.commit()
+            job = db.session.get(Job, job_id)
+            if not claimed or job is None:
+                return
+            with self.lock:
+                self.running.add(job_id)
+            try:
+                _handlers[job.kind](job)
+            except Exception as e:
+                traceback.print_exc()
+                db.session.rollback()
+                job = db.session.get(Job, job_id)
+                update(job, status='error', message=f'Failed to process file: {str(e)}', finished_at=_now())
+            finally:
+                with self.lock:
+                    self.running.discard(job_id)
+
+
+def reset_interrupted(app):
+    """
+    Puts jobs a stopped server left half done back to received, so start()
+    picks them up. Only call it while no runner is working on them: before
+    the dev server starts, or in the gunicorn master before it forks workers.
+    Jobs of a worker that dies while the server keeps running are left to
+    JobRunner.sweep() instead.
+    """
+    with app.app_context():
+        count = Job.query.filter(Job.status.notin_(FINISHED_STATUSES + ('received',)))\
+            .update({'status': 'received', 'message': 'Interrupted by a restart, waiting for a worker',
+                     'updated_at': _now()}, synchronize_session=False)
+        db.session.commit()
+    return count
+
+
+def update(job, **fields):
+    """sets job columns, commits and publishes job.progress, the progress endpoints read straight from the row"""
+    for key, value in fields.items():
+        setattr(job, key, value)
+    job.updated_at = _now()
+    db.session.commit()
+    events.publish('job.progress', job.to_dict())
+
+
+def get_runner(app):
+    return app.extensions['jobs']
+
+
+def init_app(app):
+    app.extensions['jobs'] = JobRunner(app, lease=app.config.get('JOB_LEASE_SECONDS', JOB_LEASE_SECONDS))
+
+
+@register('upload')
+def run_upload(job):
+    """
+    Imports an uploaded csv chunk by chunk, recording progress on the job row.
+
+    processed_rows is a checkpoint committed in the same transaction as the
+    chunk it covers, so a job that is run again (restart, re-upload of the same
+    file) skips straight to the first row that isn't persisted yet. With local
+    allocation allocated_rows trails it until a chunk's cases are allocated, a
+    resumed job first allocates the rows between the two.
+    """
+    resuming = job.processed_rows > 0
+    update(job, status='processing', message='Resuming import...' if resuming else 'Processing CSV data...')
+    total_rows = count_rows(job.filepath)
+    if total_rows == 0:
+        update(job, status='error', message='No valid data found in CSV', finished_at=_now())
+        return
+
+    # ALLOCATION_MODE=local assigns in-process (services/allocation.py) instead of n8n
+    local_allocation = os.getenv('ALLOCATION_MODE', 'n8n') == 'local'
+    n8n_url = os.getenv('N8N_WEBHOOK_URL')
+    app = current_app._get_current_object()
+    batch_id = job.batch_id
+    if not local_allocation and n8n_url:
+        # chunks go out from the dispatcher's worker pool, tracked in dispatch_chunk.
+        # a resumed job only re-sends what n8n never got, the LLM doesn't redo delivered chunks
+        if batch_id and DispatchChunk.query.filter_by(batch_id=batch_id).first():
+            get_dispatcher().resume(app, batch_id, n8n_url)
+        else:
+            batch_id = get_dispatcher().dispatch_file(app, job.filepath, n8n_url, total_rows)
+    update(job, status='assigning', total_rows=total_rows, batch_id=batch_id,
+           message='Starting case assignment...')
+
+    rows_done = job.processed_rows
+    cases_created = job.cases_created or 0
+    cases_assigned = job.cases_assigned or 0
+    errors = json.loads(job.errors) if job.errors else []
+
+    allocated_rows = job.allocated_rows or 0
+    if local_allocation and allocated_rows < rows_done:
+        # chunks written and checkpointed before the job stopped, but not allocated yet
+        for parsed, _, raw in iter_parsed_chunks(job.filepath, start=allocated_rows):
+            decisions = allocate_pending(db.session, [case['id'] for _, case in parsed])
+            events.publish_assignments(decisions, skip_close_calls=True)
+            cases_assigned += sum(1 for d in decisions if d['agencyId'] and not d['closeCall'])
+            allocated_rows += len(raw)
+            if allocated_rows >= rows_done:
+                break
+        update(job, cases_assigned=cases_assigned, allocated_rows=rows_done)
+
+    started = time.perf_counter()
+    rows_this_run = 0
+    for parsed, row_errors, raw in iter_parsed_chunks(job.filepath, start=rows_done):
+        errors.extend(row_errors)
+        try:
+            created_ids, write_errors = write_chunk(db.session, parsed, commit=False)
+            errors.extend(write_errors)
+            cases_created += len(created_ids)
+            if not local_allocation:
+                cases_assigned = cases_created
+        except Exception as e:
+            created_ids = []
+            errors.append(f"Rows {rows_done + 1}-{rows_done + len(raw)}: {str(e).splitlines()[0]}")
+        rows_done += len(raw)
+        rows_this_run += len(raw)
+
+        elapsed = time.perf_counter() - started
+        # commits the chunk and the checkpoint together, cases still to allocate hold allocated_rows back
+        allocating = local_allocation and created_ids
+        update(job, processed_rows=rows_done, allocated_rows=job.allocated_rows if allocating else rows_done,
+               cases_created=cases_created, cases_assigned=cases_assigned,
+               rows_per_second=round(rows_this_run / elapsed, 1) if elapsed > 0 else None,
+               errors=json.dumps(errors[:MAX_STORED_ERRORS]),
+               message=f'Assigned {cases_assigned} of {total_rows} cases')
+        events.publish_created(created_ids)
+
+        if local_allocation and created_ids:
+            # close calls stay pending for the LLM flow / manual review
+            decisions = allocate_pending(db.session, created_ids)
+            events.publish_assignments(decisions, skip_close_calls=True)
+            cases_assigned += sum(1 for d in decisions if d['agencyId'] and not d['closeCall'])
+            update(job, cases_assigned=cases_assigned, allocated_rows=rows_done,
+                   message=f'Assigned {cases_assigned} of {total_rows} cases')
+
+    update(job, status='done', message=f'Successfully imported {cases_created} case(s)', finished_at=_now())
@@ -0,0 +1,84 @@
+import base64
+import json
+from sqlalchemy import and_, func, or_, select
+
+# approximate totals stop counting here and report a lower bound instead
+APPROX_TOTAL_CAP = 10000
+
+# rows per page a list endpoint serves at most, whatever ?limit= asks for
+MAX_PAGE_SIZE = 1000
+
+
+def page_size(limit, default, maximum=MAX_PAGE_SIZE):
+    """?limit= as a usable page size: default when missing, otherwise within 1..maximum"""
+    if limit is None:
+        return default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """list of sort key values, None for the first page. Raises ValueError on garbage"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def after(keys, values, descending):
+    """
+    WHERE clause for rows strictly past the cursor in (k1, k2, ...) order,
+    spelled out as OR/AND so it works on every backend and can use an index on keys.
+    """
+    clauses = []
+    for i, key in enumerate(keys):
+        beyond = key < values[i] if descending else key > values[i]
+        clauses.append(and_(*[keys[j] == values[j] for j in range(i)], beyond))
+    return or_(*clauses)
+
+
+def keyset_page(query, keys, cursor, limit, cursor_values, descending=True):
+    """
+    One page of query ordered by keys, continuing after cursor.
+
+    keys must make the order total (end with a unique column) and
+    cursor_values(item) returns an item's values for them. Returns
+    (items, next_cursor), next_cursor is None on the last page. Costs one
+    index range scan however deep the page is, unlike OFFSET.
+    """
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    values = decode_cursor(cursor)
+    if values is not None:
+        if len(values) != len(keys):
+            raise ValueError('Invalid cursor')
+        query = query.filter(after(keys, values, descending))
+    query = query.order_by(*[key.desc() if descending else key.asc() for key in keys])
+
+    # one extra row tells whether there is a next page without counting
+    rows = query.limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = encode_cursor(cursor_values(items[-1])) if len(rows) > limit else None
+    return items, next_cursor
+
+
+def count_total(query, mode):
+    """
+    Opt-in totals for cursor pages: 'exact' runs a COUNT, 'approx' stops at
+    APPROX_TOTAL_CAP rows. Returns (total, is_lower_bound), (None, False) otherwise.
+    """
+    if mode == 'exact':
+        return query.order_by(None).count(), False
+    if mode == 'approx':
+        capped = query.order_by(None).limit(APPROX_TOTAL_CAP).subquery()
+        total = query.session.execute(select(func.count()).select_from(capped)).scalar()
+        return total, total >= APPROX_TOTAL_CAP
+    return None, False
@@ -0,0 +1,208 @@
+"""
+Recovery time series from payment timeline events (event_type='payment', meta_amount).
+
+Payments are pre-aggregated into day and month rows of recovery_bucket
+(models.RecoveryBucket) by SQLite triggers on timeline_event, as events are
+added, changed or removed. A series for any range is then a range scan over
+at most a few hundred bucket rows, weeks and years are summed from days and
+months. `python -m services.recovery` rebuilds the buckets from history.
+
+Other databases have no triggers here, available() is False there and the
+series is grouped straight from the events.
+"""
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, text
+from models import RecoveryBucket, TimelineEvent
+
+GRANULARITIES = ('day', 'week', 'month', 'year')
+
+# stored granularity each one is summed from, and its bucket key length in the timestamp
+SOURCES = {'day': ('day', 10), 'week': ('day', 10), 'month': ('month', 7), 'year': ('month', 7)}
+
+# longest series returned, in buckets
+MAX_BUCKETS = 1000
+
+# amounts are float sums, maintained by adding and subtracting; rounding hides the drift
+AMOUNT_DIGITS = 2
+
+# bucket keys are cut from the timestamp text, a payment only counts when it starts with an ISO date
+ISO_DATE = '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+
+PAYMENT = "{row}.event_type = 'payment' AND {row}.meta_amount IS NOT NULL AND {row}.timestamp GLOB '" + ISO_DATE + "'"
+
+TRIGGERS = ('recovery_bucket_ai', 'recovery_bucket_ad', 'recovery_bucket_au_old', 'recovery_bucket_au_new')
+
+# engine url -> whether the triggers exist there
+_available = {}
+
+
+def _upsert(row, sign):
+    statements = []
+    for granularity, length in (('day', 10), ('month', 7)):
+        statements.append(
+            f"INSERT INTO recovery_bucket (granularity, bucket, amount, payments) VALUES ("
+            f"'{granularity}', substr({row}.timestamp, 1, {length}), {sign}{row}.meta_amount, {sign}1) "
+            f"ON CONFLICT (granularity, bucket) DO UPDATE SET "
+            f"amount = amount + excluded.amount, payments = payments + excluded.payments;"
+        )
+    return ' '.join(statements)
+
+
+def create_statements():
+    """triggers moving every payment event write into recovery_bucket"""
+    new, old = PAYMENT.format(row='new'), PAYMENT.format(row='old')
+    watched = 'event_type, meta_amount, timestamp'
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS recovery_bucket_ai AFTER INSERT ON timeline_event WHEN {new} '
+        f'BEGIN {_upsert("new", "")} END',
+        f'CREATE TRIGGER IF NOT EXISTS recovery_bucket_ad AFTER DELETE ON timeline_event WHEN {old} '
+        f'BEGIN {_upsert("old", "-")} END',
+        # an update can move a payment out of one bucket and into another, or in / out of the series
+        f'CREATE TRIGGER IF NOT EXISTS recovery_bucket_au_old AFTER UPDATE OF {watched} ON timeline_event '
+        f'WHEN {old} BEGIN {_upsert("old", "-")} END',
+        f'CREATE TRIGGER IF NOT EXISTS recovery_bucket_au_new AFTER UPDATE OF {watched} ON timeline_event '
+        f'WHEN {new} BEGIN {_upsert("new", "")} END',
+    ]
+
+
+def create(connection):
+    """creates the triggers and fills recovery_bucket from the payment history"""
+    for statement in create_statements():
+        connection.execute(text(statement))
+    rebuild(connection)
+
+
+def recreate(connection):
+    """replaces the triggers with the current create_statements() and rebuilds the buckets"""
+    for name in TRIGGERS:
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+    create(connection)
+
+
+def rebuild(connection):
+    """recomputes recovery_bucket from every payment event"""
+    connection.execute(text('DELETE FROM recovery_bucket'))
+    for granularity, length in (('day', 10), ('month', 7)):
+        connection.execute(text(
+            f"INSERT INTO recovery_bucket (granularity, bucket, amount, payments) "
+            f"SELECT '{granularity}', substr(timestamp, 1, {length}), sum(meta_amount), count(*) "
+            f"FROM timeline_event WHERE {PAYMENT.format(row='timeline_event')} GROUP BY 2"
+        ))
+    _available.clear()
+
+
+def available(session):
+    """whether recovery_bucket is maintained on the session's database"""
+    engine = session.get_bind()
+    key = str(engine.url)
+    if key not in _available:
+        _available[key] = engine.dialect.name == 'sqlite' and session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'recovery_bucket_ai'"
+        )).first() is not None
+    return _available[key]
+
+
+def bucket_start(day, granularity):
+    """first day of the bucket day falls in"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(day, granularity):
+    if granularity == 'day':
+        return day + timedelta(days=1)
+    if granularity == 'week':
+        return day + timedelta(days=7)
+    if granularity == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day.replace(year=day.year + 1)
+
+
+def label(day, granularity):
+    if granularity == 'day':
+        return day.isoformat()
+    if granularity == 'week':
+        return f'{day.isocalendar()[0]}-W{day.isocalendar()[1]:02d}'
+    if granularity == 'month':
+        return day.strftime('%Y-%m')
+    return str(day.year)
+
+
+def series(session, start, end, granularity='month'):
+    """
+    [{'bucket', 'month', 'recovered', 'payments'}] from start to end (dates,
+    inclusive), one entry per bucket including empty ones. 'month' is the short
+    month name of the bucket, what the dashboard chart labels its axis with.
+    Raises ValueError for an unknown granularity or a range over MAX_BUCKETS.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'granularity must be one of {", ".join(GRANULARITIES)}')
+    if end < start:
+        raise ValueError('from must not be after to')
+
+    buckets = []
+    day = bucket_start(start, granularity)
+    while day <= end:
+        buckets.append(day)
+        if len(buckets) > MAX_BUCKETS:
+            raise ValueError(f'range covers more than {MAX_BUCKETS} {granularity} buckets')
+        day = next_bucket(day, granularity)
+
+    stored, length = SOURCES[granularity]
+    first, last = buckets[0].isoformat()[:length], end.isoformat()[:length]
+    if available(session):
+        rows = session.query(RecoveryBucket.bucket, RecoveryBucket.amount, RecoveryBucket.payments)\
+            .filter(RecoveryBucket.granularity == stored, RecoveryBucket.bucket.between(first, last))
+    else:
+        key = func.substr(TimelineEvent.timestamp, 1, length)
+        rows = session.query(key, func.sum(TimelineEvent.meta_amount), func.count(TimelineEvent.id))\
+            .filter(TimelineEvent.event_type == 'payment', TimelineEvent.meta_amount.isnot(None),
+                    func.length(TimelineEvent.timestamp) >= 10, key.between(first, last))\
+            .group_by(key)
+
+    totals = {}
+    for bucket, amount, payments in rows:
+        try:
+            day = datetime.strptime(bucket, '%Y-%m-%d' if length == 10 else '%Y-%m').date()
+        except ValueError:
+            continue  # a timestamp stored before they were validated, it has no place on the axis
+        day = bucket_start(day, granularity)
+        recovered, count = totals.get(day, (0, 0))
+        totals[day] = (recovered + (amount or 0), count + (payments or 0))
+
+    return [{
+        'bucket': label(day, granularity),
+        'month': day.strftime('%b'),
+        'recovered': round(totals.get(day, (0, 0))[0], AMOUNT_DIGITS),
+        'payments': totals.get(day, (0, 0))[1]
+    } for day in buckets]
+
+
+def default_range(granularity, today=None):
+    """range shown when none is asked for: the last 6 months (30 days for days, 5 years for years)"""
+    end = today or date.today()
+    if granularity == 'day':
+        return end - timedelta(days=29), end
+    if granularity == 'week':
+        return end - timedelta(weeks=11), end
+    if granularity == 'year':
+        return end.replace(year=end.year - 4, month=1, day=1), end
+    start = end.replace(day=1)
+    for _ in range(5):
+        start = (start - timedelta(days=1)).replace(day=1)
+    return start, end
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context(), db.engine.begin() as connection:
+        rebuild(connection)
+    print('Recovery buckets rebuilt')
@@ -0,0 +1,188 @@
+"""
+Full-text search over cases, customers and email timeline events (SQLite FTS5).
+
+Each source table has an FTS5 table whose rowid is the source row's rowid,
+kept current by triggers, so every insert / update / delete (ORM, bulk or raw
+SQL) reaches the index in the same transaction. VACUUM may renumber the rowids
+of tables without an integer primary key, run `python -m services.search`
+afterwards to rebuild the index.
+
+Other databases have no FTS5, available() is False there and callers fall
+back to LIKE filters.
+"""
+import re
+import zlib
+from sqlalchemy import Column, MetaData, Table, Float, String, Text, inspect, literal_column, select, text
+
+# (fts table, source table, {fts column: source column}), the first column is the row key
+INDEXES = [
+    ('case_fts', 'case', {
+        'case_id': 'id',
+        'customer_name': 'customer_name',
+        'account_number': 'customer_account_number',
+    }),
+    ('customer_fts', 'customer', {
+        'account_number': 'account_number',
+        'customer_name': 'customer_name',
+        'customer_email': 'customer_email',
+    }),
+    ('email_fts', 'timeline_event', {
+        'event_id': 'id',
+        'case_id': 'case_id',
+        'subject': 'meta_email_subject',
+        'content': 'meta_email_content',
+    }),
+]
+
+# keys are stored, not searched
+UNINDEXED = {'email_fts': ('event_id', 'case_id')}
+
+# timeline events only get indexed when they carry an email, {row} is the trigger's new. / nothing
+CONDITIONS = {'email_fts': '{row}meta_email_subject IS NOT NULL OR {row}meta_email_content IS NOT NULL'}
+
+# updates that leave the index alone: archiving moves an email body into email_archive
+# (services/email_archive.py) but it stays searchable
+UNCHANGED = {'email_fts': 'new.meta_email_content IS NULL AND old.meta_email_content IS NOT NULL '
+                          'AND EXISTS (SELECT 1 FROM email_archive WHERE event_id = new.id)'}
+
+_metadata = MetaData()
+case_fts = Table('case_fts', _metadata, Column('case_id', String), Column('customer_name', String),
+                 Column('account_number', String), Column('rank', Float))
+customer_fts = Table('customer_fts', _metadata, Column('account_number', String), Column('customer_name', String),
+                     Column('customer_email', String), Column('rank', Float))
+email_fts = Table('email_fts', _metadata, Column('event_id', String), Column('case_id', String),
+                  Column('subject', String), Column('content', Text), Column('rank', Float))
+
+# engine url -> whether the fts tables exist there
+_available = {}
+
+
+def _condition(fts, keyword, row=''):
+    condition = CONDITIONS.get(fts)
+    return f" {keyword} {condition.format(row=row)}" if condition else ''
+
+
+def create_statements():
+    """DDL of the fts tables and the triggers that keep them current"""
+    statements = []
+    for fts, source, columns in INDEXES:
+        unindexed = UNINDEXED.get(fts, ())
+        definitions = ', '.join(f'{c} UNINDEXED' if c in unindexed else c for c in columns)
+        statements.append(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({definitions}, tokenize='unicode61')")
+
+        fts_columns = ', '.join(columns)
+        new_values = ', '.join(f'new.{c}' for c in columns.values())
+        watched = ', '.join(columns.values())
+        insert = f"INSERT INTO {fts} (rowid, {fts_columns}) VALUES (new.rowid, {new_values});"
+        delete = f"DELETE FROM {fts} WHERE rowid = old.rowid;"
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "{source}"{_condition(fts, "WHEN", "new.")} '
+            f'BEGIN {insert} END',
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "{source}" BEGIN {delete} END',
+            # status / agency updates don't touch the indexed columns and skip this entirely
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {watched} ON "{source}"'
+            f"{f' WHEN NOT ({UNCHANGED[fts]})' if fts in UNCHANGED else ''} "
+            f'BEGIN {delete} INSERT INTO {fts} (rowid, {fts_columns}) SELECT new.rowid, {new_values}'
+            f"{_condition(fts, 'WHERE', 'new.')}; END",
+        ]
+    return statements
+
+
+def create(connection):
+    """creates the fts tables + triggers and fills them from the source tables"""
+    for statement in create_statements():
+        connection.execute(text(statement))
+    rebuild(connection)
+
+
+def rebuild(connection):
+    """refills every fts table from its source table"""
+    for fts, source, columns in INDEXES:
+        connection.execute(text(f"DELETE FROM {fts}"))
+        connection.execute(text(
+            f"INSERT INTO {fts} (rowid, {', '.join(columns)}) "
+            f"SELECT rowid, {', '.join(columns.values())} FROM \"{source}\"{_condition(fts, 'WHERE')}"
+        ))
+    # archived bodies are only in email_archive, compressed (absent before migration 0007)
+    if not inspect(connection).has_table('email_archive'):
+        _available.clear()
+        return
+    archived = connection.execute(text(
+        "SELECT e.rowid, e.id, e.case_id, e.meta_email_subject, a.body FROM timeline_event e "
+        "JOIN email_archive a ON a.event_id = e.id WHERE e.meta_email_content IS NULL"
+    ))
+    for row in archived:
+        connection.execute(text("DELETE FROM email_fts WHERE rowid = :rowid"), {'rowid': row.rowid})
+        connection.execute(text(
+            "INSERT INTO email_fts (rowid, event_id, case_id, subject, content) "
+            "VALUES (:rowid, :event_id, :case_id, :subject, :content)"
+        ), {'rowid': row.rowid, 'event_id': row.id, 'case_id': row.case_id, 'subject': row.meta_email_subject,
+            'content': zlib.decompress(row.body).decode('utf-8')})
+    _available.clear()
+
+
+def available(session):
+    """whether the fts tables exist on the session's database"""
+    engine = session.get_bind()
+    key = str(engine.url)
+    if key not in _available:
+        _available[key] = engine.dialect.name == 'sqlite' and session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'case_fts'"
+        )).first() is not None
+    return _available[key]
+
+
+def match_query(term):
+    """
+    FTS5 query for free text typed by a user, None when it has nothing to search.
+
+    Every word has to match, as a prefix. Punctuation inside a word splits it
+    into a phrase, so ACC-102 finds account ACC-10234 and j.doe@ finds j.doe@mail.com.
+    """
+    phrases = []
+    for word in term.split():
+        tokens = re.findall(r'\w+', word)
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"*')
+    return ' '.join(phrases) or None
+
+
+def _matches(fts, term, *columns):
+    query = match_query(term)
+    if query is None:
+        return None
+    return (select(*[fts.c[c] for c in columns], fts.c.rank)
+            .where(literal_column(fts.name).op('MATCH')(query))
+            .subquery())
+
+
+def match_cases(term):
+    """subquery of (case_id, rank) for the cases matching term, lower rank is better"""
+    return _matches(case_fts, term, 'case_id')
+
+
+def match_customers(term):
+    """subquery of (account_number, rank) for the customers matching term"""
+    return _matches(customer_fts, term, 'account_number')
+
+
+def search_emails(session, term, limit):
+    """best matching email timeline events, with a highlighted snippet of the body"""
+    query = match_query(term)
+    if query is None:
+        return []
+    rows = session.execute(text(
+        "SELECT event_id, case_id, subject, snippet(email_fts, 3, '[', ']', '...', 16) AS snippet "
+        "FROM email_fts WHERE email_fts MATCH :query ORDER BY rank LIMIT :limit"
+    ), {'query': query, 'limit': limit})
+    return [{'eventId': r.event_id, 'caseId': r.case_id, 'subject': r.subject, 'snippet': r.snippet} for r in rows]
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context(), db.engine.begin() as connection:
+        rebuild(connection)
+    print('Search index rebuilt')
@@ -0,0 +1,229 @@
+"""
+Login sessions: the token handed out by /api/auth/login and the user it stands for.
+
+Every session expires SESSION_TTL seconds after login (/api/auth/refresh
+trades a live token for a fresh one). SESSION_BACKEND picks where sessions live:
+  memory    an LRU dict in this process, the SESSION_MAX_ENTRIES least
+            recently used are kept (python app.py, a single gunicorn worker)
+  database  the user_session table, shared by every process on the database
+  redis     any server speaking the Redis protocol at SESSION_REDIS_URL
+            (Redis, Valkey, KeyDB...), needs `pip install redis`
+  signed    no storage: the token carries the user and its expiry, signed
+            with SECRET_KEY, so checking one is a local HMAC. Such a token
+            stays valid until it expires, logout only drops it client side.
+
+Tickets are short-lived tokens good for one purpose only, e.g. opening an
+event stream, where the token has to go in the URL and so into access logs.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import delete, insert, select
+from models import db, UserSession
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+SESSION_TTL = int(os.getenv('SESSION_TTL', 8 * 60 * 60))  # seconds
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', 10000))
+SESSION_REDIS_URL = os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+
+# single-purpose tickets (e.g. opening an event stream) expire this quickly, seconds
+TICKET_TTL = 60
+
+# SECRET_KEY app.py falls back to, public, so never good enough to sign sessions with
+DEV_SECRET_KEY = 'dev-secret-key-change-in-production'
+
+# database backend: expired rows are deleted at most this often
+PRUNE_SECONDS = 60
+
+
+def new_token():
+    return f'session-{secrets.token_urlsafe(32)}'
+
+
+class MemoryBackend:
+    def __init__(self, app):
+        self.max_entries = app.config.get('SESSION_MAX_ENTRIES', SESSION_MAX_ENTRIES)
+        self.sessions = OrderedDict()  # token -> (expires_at, user), least recently used first
+        self.lock = threading.Lock()
+
+    def create(self, user, ttl):
+        token = new_token()
+        with self.lock:
+            self.sessions[token] = (time.time() + ttl, user)
+            while len(self.sessions) > self.max_entries:
+                self.sessions.popitem(last=False)
+        return token
+
+    def get(self, token):
+        with self.lock:
+            entry = self.sessions.get(token)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.sessions[token]
+                return None
+            self.sessions.move_to_end(token)
+            return entry[1]
+
+    def revoke(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+
+
+class DatabaseBackend:
+    """sessions in user_session, on their own connection so a request's transaction never holds them"""
+
+    def __init__(self, app):
+        self.app = app
+        self.last_prune = 0
+
+    def create(self, user, ttl):
+        token = new_token()
+        now = time.time()
+        with self.app.app_context(), db.engine.begin() as connection:
+            connection.execute(insert(UserSession).values(token=token, user=json.dumps(user),
+                                                          expires_at=now + ttl))
+            if now - self.last_prune > PRUNE_SECONDS:
+                self.last_prune = now
+                connection.execute(delete(UserSession).where(UserSession.expires_at <= now))
+        return token
+
+    def get(self, token):
+        with self.app.app_context(), db.engine.connect() as connection:
+            user = connection.execute(
+                select(UserSession.user).where(UserSession.token == token, UserSession.expires_at > time.time())
+            ).scalar()
+        return json.loads(user) if user is not None else None
+
+    def revoke(self, token):
+        with self.app.app_context(), db.engine.begin() as connection:
+            connection.execute(delete(UserSession).where(UserSession.token == token))
+
+
+class RedisBackend:
+    """one key per session, the server expires it"""
+
+    def __init__(self, app):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SESSION_BACKEND=redis needs the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(app.config.get('SESSION_REDIS_URL', SESSION_REDIS_URL))
+
+    def create(self, user, ttl):
+        token = new_token()
+        self.client.set(token, json.dumps(user), ex=ttl)
+        return token
+
+    def get(self, token):
+        user = self.client.get(token)
+        return json.loads(user) if user is not None else None
+
+    def revoke(self, token):
+        self.client.delete(token)
+
+
+class SignedBackend:
+    """
+    Stateless tokens: v1.<base64 json {user, exp}>.<base64 hmac-sha256>.
+    Rotating SECRET_KEY logs everyone out. Anyone knowing the key can mint a
+    FedEx admin token, so an unset or default key is refused.
+    """
+
+    def __init__(self, app):
+        key = app.config.get('SECRET_KEY')
+        if not key or key == DEV_SECRET_KEY:
+            raise RuntimeError('SESSION_BACKEND=signed needs SECRET_KEY set to a private random value')
+        self.key = key.encode() if isinstance(key, str) else key
+
+    def _sign(self, payload):
+        return base64.urlsafe_b64encode(hmac.new(self.key, payload, hashlib.sha256).digest()).rstrip(b'=')
+
+    def create(self, user, ttl):
+        payload = base64.urlsafe_b64encode(json.dumps(
+            {'user': user, 'exp': int(time.time() + ttl)}, separators=(',', ':')
+        ).encode()).rstrip(b'=')
+        return f'v1.{payload.decode()}.{self._sign(payload).decode()}'
+
+    def get(self, token):
+        version, _, rest = token.partition('.')
+        payload, _, signature = rest.partition('.')
+        if version != 'v1' or not hmac.compare_digest(self._sign(payload.encode()), signature.encode()):
+            return None
+        data = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return data['user'] if data['exp'] > time.time() else None
+
+    def revoke(self, token):
+        pass
+
+
+BACKENDS = {'memory': MemoryBackend, 'database': DatabaseBackend, 'redis': RedisBackend, 'signed': SignedBackend}
+
+
+class SessionStore:
+    def __init__(self, app, backend=SESSION_BACKEND, ttl=SESSION_TTL):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown SESSION_BACKEND '{backend}', expected one of {', '.join(BACKENDS)}")
+        self.ttl = ttl
+        self.backend = BACKENDS[backend](app)
+
+    def create(self, user, ttl=None, purpose=None):
+        """
+        token of a new session for user (a json-able dict). A purpose makes it
+        a ticket only redeem() with the same purpose accepts, never a login.
+        """
+        return self.backend.create({'user': user, 'purpose': purpose}, ttl or self.ttl)
+
+    def get(self, token, purpose=None):
+        """user of a live session, None for an unknown, expired, revoked or other purpose token"""
+        session = self.backend.get(token) if token else None
+        if not session or session.get('purpose') != purpose:
+            return None
+        return session['user']
+
+    def revoke(self, token):
+        if token:
+            self.backend.revoke(token)
+
+    def redeem(self, token, purpose):
+        """user of a ticket for purpose, which is used up (signed tickets can't be, they just expire quickly)"""
+        user = self.get(token, purpose)
+        if user is not None:
+            self.revoke(token)
+        return user
+
+
+def init_app(app):
+    app.extensions['sessions'] = SessionStore(app, app.config.get('SESSION_BACKEND', SESSION_BACKEND),
+                                              app.config.get('SESSION_TTL', SESSION_TTL))
+
+
+def get_store(app):
+    return app.extensions['sessions']
+
+
+def create_session(user):
+    return get_store(current_app).create(user)
+
+
+def session_user(token):
+    return get_store(current_app).get(token)
+
+
+def end_session(token):
+    get_store(current_app).revoke(token)
+
+
+def create_ticket(user, purpose, ttl=TICKET_TTL):
+    return get_store(current_app).create(user, ttl, purpose)
+
+
+def redeem_ticket(token, purpose):
+    return get_store(current_app).redeem(token, purpose)
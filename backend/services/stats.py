@@ -0,0 +1,98 @@
+"""
+Dashboard totals kept in the case_stat table (models.CaseStat).
+
+SQLite triggers on the case table move a case's count and amounts between
+(status, agency) rows whenever it is created, deleted, reassigned, changes
+status or records a recovery. They fire for every write path (ORM, bulk
+updates, raw SQL) inside the same transaction, so the table always equals
+what a GROUP BY over case would return, and the dashboard reads a handful of
+rows instead of scanning every case.
+
+Other databases have no triggers here, available() is False there and the
+dashboard falls back to live aggregates.
+"""
+from sqlalchemy import func, text
+from models import Case, CaseStat
+
+# cases in these states aren't active on the dashboard
+CLOSED_STATUSES = ('resolved', 'dismissed')
+
+# amounts are float sums, maintained by adding and subtracting; rounding hides the drift
+AMOUNT_DIGITS = 2
+
+# engine url -> whether the triggers exist there
+_available = {}
+
+
+def _upsert(row, sign):
+    return (
+        f"INSERT INTO case_stat (status, agency_id, cases, invoice_amount, recovered_amount) VALUES ("
+        f"coalesce({row}.status, ''), coalesce({row}.assigned_agency_id, ''), {sign}1, "
+        f"{sign}coalesce({row}.invoice_amount, 0), {sign}coalesce({row}.recovered_amount, 0)) "
+        f"ON CONFLICT (status, agency_id) DO UPDATE SET "
+        f"cases = cases + excluded.cases, "
+        f"invoice_amount = invoice_amount + excluded.invoice_amount, "
+        f"recovered_amount = recovered_amount + excluded.recovered_amount;"
+    )
+
+
+def create_statements():
+    """triggers moving every case write into case_stat"""
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS case_stat_ai AFTER INSERT ON "case" BEGIN {_upsert("new", "")} END',
+        f'CREATE TRIGGER IF NOT EXISTS case_stat_ad AFTER DELETE ON "case" BEGIN {_upsert("old", "-")} END',
+        'CREATE TRIGGER IF NOT EXISTS case_stat_au AFTER UPDATE OF status, assigned_agency_id, invoice_amount, '
+        f'recovered_amount ON "case" BEGIN {_upsert("old", "-")} {_upsert("new", "")} END',
+    ]
+
+
+def create(connection):
+    """creates the triggers and fills case_stat from the case table"""
+    for statement in create_statements():
+        connection.execute(text(statement))
+    rebuild(connection)
+
+
+def rebuild(connection):
+    """recomputes case_stat from scratch"""
+    connection.execute(text('DELETE FROM case_stat'))
+    connection.execute(text(
+        "INSERT INTO case_stat (status, agency_id, cases, invoice_amount, recovered_amount) "
+        "SELECT coalesce(status, ''), coalesce(assigned_agency_id, ''), count(*), "
+        "coalesce(sum(invoice_amount), 0), coalesce(sum(recovered_amount), 0) "
+        "FROM \"case\" GROUP BY 1, 2"
+    ))
+    _available.clear()
+
+
+def available(session):
+    """whether case_stat is maintained on the session's database"""
+    engine = session.get_bind()
+    key = str(engine.url)
+    if key not in _available:
+        _available[key] = engine.dialect.name == 'sqlite' and session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'case_stat_ai'"
+        )).first() is not None
+    return _available[key]
+
+
+def totals_by_status(session, agency_id=None):
+    """
+    {status: (cases, invoice_amount, recovered_amount)}, from case_stat when it is
+    maintained, otherwise with a GROUP BY over case. Cases without a status are under None.
+    """
+    if available(session):
+        status = func.nullif(CaseStat.status, '')
+        query = session.query(status, func.sum(CaseStat.cases), func.sum(CaseStat.invoice_amount),
+                              func.sum(CaseStat.recovered_amount))
+        if agency_id:
+            query = query.filter(CaseStat.agency_id == agency_id)
+        # zero rows are left behind when the last case of a status moves on
+        query = query.filter(CaseStat.cases != 0).group_by(status)
+    else:
+        query = session.query(Case.status, func.count(Case.id), func.coalesce(func.sum(Case.invoice_amount), 0),
+                              func.coalesce(func.sum(Case.recovered_amount), 0))
+        if agency_id:
+            query = query.filter(Case.assigned_agency_id == agency_id)
+        query = query.group_by(Case.status)
+    return {row[0]: (row[1], round(row[2], AMOUNT_DIGITS), round(row[3], AMOUNT_DIGITS)) for row in query}
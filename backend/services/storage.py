@@ -0,0 +1,148 @@
+"""
+Database engines: where they point, how they are pooled and which one a
+query goes to.
+
+DATABASE_URL selects the primary database (the SQLite file next to app.py
+by default, any SQLAlchemy URL works, e.g. postgresql:// with a driver such
+as psycopg2 installed). DATABASE_REPLICA_URL adds a read replica: SELECTs run
+by views marked @read_only go there, writes and everything else stay on the
+primary. A replica lags, so views that read what the same request wrote
+must not be marked.
+
+SQLite connections get the SQLITE_PROFILE pragmas. The default 'wal' profile
+puts the database in WAL mode, so the dashboard keeps reading while n8n
+callbacks and imports commit, with synchronous=NORMAL (safe in WAL, only a
+power loss can lose the latest commits, never corrupt), a bigger page cache,
+memory-mapped reads and a busy timeout so a writer waits for the lock
+instead of failing. SQLITE_PROFILE=default keeps SQLite's own settings
+(rollback journal, synchronous=FULL), testing/bench_storage.py compares the two.
+"""
+import functools
+import os
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select, event
+from sqlalchemy.engine import make_url
+
+# pragma -> value, applied in this order on every new connection
+PROFILES = {
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,  # negative is KiB, 64MB per connection
+        'mmap_size': 256 * 1024 * 1024,
+        'busy_timeout': 5000,  # ms
+        'temp_store': 'MEMORY',
+    },
+}
+
+SQLITE_PROFILE = os.getenv('SQLITE_PROFILE', 'wal')
+
+# SQLALCHEMY_BINDS key of the read replica
+REPLICA_BIND = 'replica'
+
+# connections per process, sized for a threaded server plus the job workers
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))  # seconds a request waits for a free connection
+
+
+def database_url(url, base_dir=None):
+    """
+    url as SQLAlchemy wants it, hosting providers still hand out postgres://.
+    A relative sqlite file (sqlite:///dca.db) is taken relative to base_dir,
+    Flask-SQLAlchemy would otherwise create an empty one in instance/.
+    """
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    if base_dir and is_file_database(url):
+        parsed = make_url(url)
+        if not parsed.query.get('uri') and not os.path.isabs(parsed.database):
+            parsed = parsed.set(database=os.path.join(base_dir, parsed.database))
+            return parsed.render_as_string(hide_password=False)
+    return url
+
+
+def is_file_database(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:') \
+        and url.query.get('mode') != 'memory'
+
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for uri, in-memory sqlite keeps its single shared connection"""
+    if make_url(uri).get_backend_name() == 'sqlite' and not is_file_database(uri):
+        return {}
+    return {'pool_size': DB_POOL_SIZE, 'max_overflow': DB_MAX_OVERFLOW, 'pool_timeout': DB_POOL_TIMEOUT}
+
+
+def configure(app):
+    """
+    Engine options and the replica bind, before db.init_app(app). Explicit
+    SQLALCHEMY_ENGINE_OPTIONS / SQLALCHEMY_BINDS in the app config win.
+    """
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url(app.config['SQLALCHEMY_DATABASE_URI'], app.root_path)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    replica = app.config.get('DATABASE_REPLICA_URL', os.getenv('DATABASE_REPLICA_URL'))
+    if replica:
+        replica = database_url(replica, app.root_path)
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault(REPLICA_BIND, {'url': replica, **engine_options(replica)})
+
+
+def read_only(view):
+    """marks a view that only reads, its SELECTs may be served by the replica"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # scoped to the view, an app context shared by several requests (tests, jobs) keeps writing to the primary
+        previous = g.get('read_only', False)
+        g.read_only = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.read_only = previous
+    return wrapper
+
+
+def reading_from_replica():
+    return has_app_context() and g.get('read_only', False)
+
+
+class RoutingSession(Session):
+    """
+    db.session class sending the SELECTs of @read_only views to the replica
+    bind when there is one. Flushes, DML and raw SQL always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and isinstance(clause, Select) and reading_from_replica():
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+def init_app(app):
+    """applies the SQLITE_PROFILE pragmas to every connection of the app's sqlite engines"""
+    profile = app.config.get('SQLITE_PROFILE', SQLITE_PROFILE)
+    if profile not in PROFILES:
+        raise ValueError(f"unknown SQLITE_PROFILE '{profile}', expected one of {', '.join(PROFILES)}")
+    pragmas = PROFILES[profile]
+    if not pragmas:
+        return
+
+    db = app.extensions['sqlalchemy']
+    with app.app_context():
+        engines = [engine for engine in db.engines.values() if engine.dialect.name == 'sqlite']
+    for engine in engines:
+        event.listen(engine, 'connect', lambda dbapi_connection, _: apply_pragmas(dbapi_connection, pragmas))
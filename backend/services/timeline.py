@@ -0,0 +1,125 @@
+"""
+Timeline reads and the case.last_contact column that follows them.
+
+last_contact is the newest timeline event timestamp of a case, kept current
+by SQLite triggers on timeline_event so reading a case never has to look at
+its events. Other databases have no triggers here, available() is False there
+and last_contact is looked up through the (case_id, timestamp) index instead.
+"""
+from datetime import datetime, timezone
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import selectinload, undefer_group, with_expression
+from models import EmailArchive, TimelineEvent
+from services.pagination import encode_cursor, keyset_page
+
+# events per timeline page when a page is asked for without a limit
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# order of a case's events, id breaks ties between equal timestamps
+SORT_KEYS = (TimelineEvent.timestamp, TimelineEvent.id)
+
+# characters of the body a timeline summary carries
+PREVIEW_CHARS = 160
+
+# engine url -> whether the triggers exist there
+_available = {}
+
+
+def normalise_timestamp(value):
+    """
+    value, an ISO 8601 date / datetime, as timeline events store it: UTC,
+    'YYYY-MM-DDTHH:MM:SS[.ffffff]Z', a naive value is taken as UTC. Events are
+    ordered and bucketed by that text, so anything else raises ValueError.
+    """
+    if not isinstance(value, str):
+        raise ValueError('timestamp must be an ISO 8601 string')
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat() + 'Z'
+
+
+def create_statements():
+    """triggers keeping case.last_contact at the newest event timestamp"""
+    return [
+        'CREATE TRIGGER IF NOT EXISTS last_contact_ai AFTER INSERT ON timeline_event '
+        'WHEN new.timestamp IS NOT NULL BEGIN '
+        'UPDATE "case" SET last_contact = new.timestamp WHERE id = new.case_id '
+        'AND (last_contact IS NULL OR last_contact < new.timestamp); END',
+        # only the newest event moving or going away changes last_contact
+        'CREATE TRIGGER IF NOT EXISTS last_contact_ad AFTER DELETE ON timeline_event BEGIN '
+        'UPDATE "case" SET last_contact = (SELECT max(timestamp) FROM timeline_event WHERE case_id = old.case_id) '
+        'WHERE id = old.case_id AND last_contact = old.timestamp; END',
+        'CREATE TRIGGER IF NOT EXISTS last_contact_au AFTER UPDATE OF timestamp, case_id ON timeline_event BEGIN '
+        'UPDATE "case" SET last_contact = (SELECT max(timestamp) FROM timeline_event WHERE case_id = "case".id) '
+        'WHERE id IN (old.case_id, new.case_id); END',
+    ]
+
+
+def create(connection):
+    """creates the triggers and sets last_contact of every case from its events"""
+    for statement in create_statements():
+        connection.execute(text(statement))
+    connection.execute(text(
+        'UPDATE "case" SET last_contact = (SELECT max(timestamp) FROM timeline_event WHERE case_id = "case".id) '
+        'WHERE EXISTS (SELECT 1 FROM timeline_event WHERE case_id = "case".id)'
+    ))
+    _available.clear()
+
+
+def available(session):
+    """whether last_contact is maintained on the session's database"""
+    engine = session.get_bind()
+    key = str(engine.url)
+    if key not in _available:
+        _available[key] = engine.dialect.name == 'sqlite' and session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'last_contact_ai'"
+        )).first() is not None
+    return _available[key]
+
+
+def last_contact(session, case):
+    """newest event timestamp of case"""
+    if available(session):
+        return case.last_contact
+    latest = session.query(TimelineEvent.timestamp).filter(TimelineEvent.case_id == case.id)\
+        .order_by(TimelineEvent.timestamp.desc()).first()
+    return latest[0] if latest else None
+
+
+def full(query):
+    """loads the event bodies along with the rows (archived ones in one more query), for to_dict()"""
+    return query.options(undefer_group('body'), selectinload(TimelineEvent.archive))
+
+
+def summary(query):
+    """leaves the bodies unread and computes a preview in SQL, for to_summary()"""
+    # archived emails carry their uncompressed preview, no blob is read
+    archived = select(EmailArchive.preview).where(EmailArchive.event_id == TimelineEvent.id).scalar_subquery()
+    body = func.coalesce(TimelineEvent.meta_email_content, archived, TimelineEvent.description)
+    return query.options(with_expression(TimelineEvent.preview, func.substr(body, 1, PREVIEW_CHARS)))
+
+
+def cursor_of(event):
+    return encode_cursor([event.timestamp, event.id])
+
+
+def page(query, limit, before=None, since=None):
+    """
+    One bounded slice of a case's timeline, always returned oldest first.
+
+    Without cursors it is the newest limit events. before pages back into
+    older history, since returns what was added after a cursor (polling).
+    Returns (events, before_cursor, since_cursor): before_cursor is None once
+    the oldest event was returned, since_cursor continues from the newest one.
+    Raises ValueError on a garbage cursor.
+    """
+    if since is not None:
+        events, _ = keyset_page(query, SORT_KEYS, since, limit, lambda e: [e.timestamp, e.id], descending=False)
+        # with nothing new the client keeps polling from where it was
+        return events, None, (cursor_of(events[-1]) if events else since or None)
+
+    events, older = keyset_page(query, SORT_KEYS, before, limit, lambda e: [e.timestamp, e.id])
+    events.reverse()
+    return events, older, (cursor_of(events[-1]) if events else None)
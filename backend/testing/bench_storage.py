@@ -0,0 +1,127 @@
+"""
+Concurrent read / write benchmark of the SQLite storage profiles.
+
+For every profile in services/storage.py PROFILES it builds a fresh file
+database, seeds it, then for --seconds runs reader threads hitting
+the dashboard endpoints while writer threads post cases to
+/api/n8n/add-case, and prints throughput plus read latency per profile.
+Exits 1 when a request failed (e.g. "database is locked").
+
+    cd backend && python -m testing.bench_storage [--seconds 10] [--readers 8] [--writers 2]
+"""
+import argparse
+import itertools
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from app import create_app
+from migrations import run_migrations
+from models import db, Agency
+from services.ingest import write_chunk
+from services.storage import PROFILES
+
+CASES = 5000
+
+READ_URLS = ['/api/dashboard/stats', '/api/cases?limit=50', '/api/performance/agencies']
+
+
+def seed():
+    db.create_all()
+    run_migrations()
+    db.session.add_all([
+        Agency(id=f'agn{i:03d}', name=f'Agency {i}', capacity=CASES, current_capacity=0, performance_score=0.7)
+        for i in range(1, 6)
+    ])
+    db.session.commit()
+    write_chunk(db.session, [(
+        {'account_number': f'ACCT-{i % 500}', 'customer_name': f'Customer {i % 500}'},
+        {'id': f'CS-{i:06d}', 'customer_name': f'Customer {i % 500}', 'customer_account_number': f'ACCT-{i % 500}',
+         'invoice_amount': 100 + i, 'recovered_amount': 0.0, 'status': 'pending'}
+    ) for i in range(CASES)])
+
+
+def run(profile, seconds, readers, writers):
+    """{reads, writes, errors, latencies} of one profile"""
+    directory = tempfile.mkdtemp()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'bench.db')}",
+                      'SQLITE_PROFILE': profile})
+    with app.app_context():
+        seed()
+
+    latencies, writes, errors = [], [0], []
+    lock = threading.Lock()
+    stop = threading.Event()
+    case_ids = itertools.count()
+
+    def reader():
+        client = app.test_client()
+        for url in itertools.cycle(READ_URLS):
+            if stop.is_set():
+                return
+            start = time.perf_counter()
+            response = client.get(url)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(f'GET {url}: {response.status_code}')
+
+    def writer():
+        client = app.test_client()
+        while not stop.is_set():
+            i = next(case_ids)
+            response = client.post('/api/n8n/add-case', json={
+                'invoice_id': f'INV-{i:06d}', 'account_number': f'ACCT-{i % 500}', 'customer_name': f'Customer {i % 500}',
+                'amount_due': '450.25', 'assigned_dca': f'agn{i % 5 + 1:03d}', 'reasoning': 'benchmark'
+            })
+            with lock:
+                if response.status_code == 200:
+                    writes[0] += 1
+                else:
+                    errors.append(f'POST /api/n8n/add-case: {response.status_code}')
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)] + \
+              [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        db.engine.dispose()
+    shutil.rmtree(directory, ignore_errors=True)
+    return {'reads': len(latencies), 'writes': writes[0], 'errors': errors, 'latencies': sorted(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f'{args.readers} readers, {args.writers} writers, {args.seconds:g}s per profile, {CASES} cases\n')
+    print(f"{'profile':<10}{'reads/s':>10}{'writes/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'errors':>8}")
+    failed = False
+    for profile in PROFILES:
+        result = run(profile, args.seconds, args.readers, args.writers)
+        latencies = result['latencies'] or [0]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{profile:<10}{result['reads'] / args.seconds:>10.1f}{result['writes'] / args.seconds:>10.1f}"
+              f"{statistics.median(latencies) * 1000:>9.1f}{p95 * 1000:>9.1f}{latencies[-1] * 1000:>9.1f}"
+              f"{len(result['errors']):>8}")
+        for error in sorted(set(result['errors']))[:5]:
+            print(f'    {error}')
+        failed = failed or bool(result['errors'])
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Checks the allocation engine (services/allocation.py) on data shaped like
+testing/seed.py: 10 agencies with performance 0.65-0.98, a few active cases
+each, and pending cases of 5k-100k. Such a dataset has to be mostly assigned,
+close calls are judged per case and only defer cases whose own runner-up is
+within CLOSE_CALL_MARGIN, and no batch overfills an agency. The last check goes
+through POST /api/cases/allocate on an in-memory db. Exits 1 on failure.
+
+    cd backend && python -m testing.check_allocation
+"""
+import random
+import sys
+from app import create_app
+from migrations import run_migrations
+from models import db, Agency, Case
+from services.allocation import CLOSE_CALL_MARGIN, merit, solve
+
+# seeds of the generated datasets, and the batch sizes allocated from each
+SEEDS = range(50)
+BATCHES = (5, 40, 1000)
+
+# share of a seeded batch that has to be assigned rather than deferred, over all seeds
+MIN_ASSIGNED = 0.6
+
+
+def report(ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    return not ok
+
+
+def agencies(rng):
+    return [Agency(id=f'agn{i:03d}', name=f'Agency {i}', performance_score=round(rng.uniform(0.65, 0.98), 2),
+                   capacity=rng.choice([50, 100, 150, 200, 250, 300]), current_capacity=rng.randint(0, 5),
+                   summary='') for i in range(1, 11)]
+
+
+def pending_cases(rng, count):
+    return [Case(id=f'CS-{i:05d}', customer_name=f'Customer {i}', recovered_amount=0.0, status='pending',
+                 invoice_amount=rng.choice([rng.randint(5000, 25000), rng.randint(25000, 50000),
+                                            rng.randint(50000, 100000), rng.randint(10000, 30000)]),
+                 aging_days=rng.randint(15, 180), recovery_probability=round(rng.uniform(0.85, 0.98), 2))
+            for i in range(count)]
+
+
+def check_seeded():
+    failed = False
+    for size in BATCHES:
+        assigned = total = 0
+        for seed in SEEDS:
+            rng = random.Random(seed)
+            decisions = solve(pending_cases(rng, size), agencies(rng))
+            assigned += sum(1 for d in decisions if d['agencyId'] and not d['closeCall'])
+            total += len(decisions)
+        failed |= report(assigned / total >= MIN_ASSIGNED,
+                         f'batches of {size}: {assigned / total:.0%} assigned, the rest deferred as close calls')
+    return failed
+
+
+def check_per_case():
+    rng = random.Random(0)
+    pool = agencies(rng)
+    cases = pending_cases(rng, 1000)
+    by_id = {agency.id: agency for agency in pool}
+    decisions = solve(cases, pool)
+
+    # in a big batch some cases of a profile are close calls and others aren't
+    flags = {}
+    for d in decisions:
+        flags.setdefault(d['profile'], set()).add(d['closeCall'])
+    failed = report(any(len(seen) > 1 for seen in flags.values()),
+                    'close calls are flagged per case, not for a whole profile at once')
+
+    def has_rival(d):
+        chosen = merit(by_id[d['agencyId']], d['profile'])
+        return any(other.id != d['agencyId'] and
+                   round(abs(merit(other, d['profile']) - chosen), 6) < CLOSE_CALL_MARGIN for other in pool)
+    ambiguous = [d for d in decisions if d['closeCall']]
+    failed |= report(all(has_rival(d) for d in ambiguous),
+                     f'{len(ambiguous)} close calls all have a rival within {CLOSE_CALL_MARGIN}')
+
+    placed = {}
+    for d in decisions:
+        if d['agencyId']:
+            placed[d['agencyId']] = placed.get(d['agencyId'], 0) + 1
+    failed |= report(all((by_id[a].current_capacity or 0) + n <= by_id[a].capacity for a, n in placed.items()),
+                     'no agency is filled past its capacity')
+
+    tied = [Agency(id='a', capacity=100, current_capacity=0, performance_score=0.9, summary=''),
+            Agency(id='b', capacity=100, current_capacity=0, performance_score=0.9, summary='')]
+    failed |= report(all(d['closeCall'] for d in solve(pending_cases(random.Random(1), 10), tied)),
+                     'agencies with the same record are a close call')
+    return failed
+
+
+def check_route():
+    assigned = deferred = 0
+    for seed in range(5):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+        rng = random.Random(seed)
+        with app.app_context():
+            db.create_all()
+            run_migrations()
+            db.session.add_all(agencies(rng) + pending_cases(rng, 40))
+            db.session.commit()
+            result = app.test_client().post('/api/cases/allocate', json={}).get_json()
+            db.session.remove()
+        assigned += result['assigned']
+        deferred += len(result['deferred'])
+    return report(assigned > deferred, f'POST /api/cases/allocate on 5 seeded dbs: {assigned} assigned, {deferred} deferred')
+
+
+def main():
+    failed = check_seeded()
+    failed |= check_per_case()
+    failed |= check_route()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Runs case writes through the endpoints and services (bulk import, allocation,
+reassignment, status and amount changes, deletes) and checks the case_stat
+totals the dashboard reads still equal a live GROUP BY over the case table.
+Runs against an in-memory db, or CHECK_DATABASE_URL (e.g. a local Postgres,
+emptied first), exits 1 on failure.
+
+    cd backend && python -m testing.check_case_stats
+"""
+import os
+import sys
+from sqlalchemy import func
+from app import create_app
+from migrations import run_migrations
+from models import db, Agency, Case
+from services import stats
+from services.allocation import allocate_pending
+from services.ingest import write_chunk
+
+DATABASE_URL = os.getenv('CHECK_DATABASE_URL', 'sqlite://')
+
+CASES = 200
+
+
+def live_totals(agency_id=None):
+    query = db.session.query(Case.status, func.count(Case.id), func.sum(Case.invoice_amount),
+                             func.sum(Case.recovered_amount))
+    if agency_id:
+        query = query.filter(Case.assigned_agency_id == agency_id)
+    return {row[0]: (row[1], round(row[2] or 0, stats.AMOUNT_DIGITS), round(row[3] or 0, stats.AMOUNT_DIGITS))
+            for row in query.group_by(Case.status)}
+
+
+def workload(client):
+    db.session.add_all([
+        Agency(id=f'agn{i:03d}', name=f'Agency {i}', capacity=80, current_capacity=0, performance_score=0.7 + i / 20)
+        for i in range(1, 4)
+    ])
+    db.session.commit()
+
+    write_chunk(db.session, [(
+        {'account_number': f'ACCT-{i % 20}', 'customer_name': f'Customer {i % 20}'},
+        {'id': f'CS-{i:04d}', 'customer_name': f'Customer {i % 20}', 'customer_account_number': f'ACCT-{i % 20}',
+         'invoice_amount': 1000 + i * 10.25, 'recovered_amount': 0.0, 'status': 'pending'}
+    ) for i in range(CASES)])
+
+    allocate_pending(db.session, defer_close_calls=False)  # bulk UPDATE of status + agency
+    client.put('/api/cases/CS-0001/assign', json={'agencyId': 'agn002'})
+    client.put('/api/cases/CS-0002/assign', json={'agencyId': 'agn003'})
+    client.put('/api/cases/CS-0003', json={'status': 'resolved'})
+    client.put('/api/cases/CS-0004', json={'status': 'dismissed', 'amount': 5.5})
+    client.put('/api/cases/CS-0005', json={'amount': 123.45})
+
+    case = db.session.get(Case, 'CS-0006')
+    case.recovered_amount = 250.75
+    db.session.delete(db.session.get(Case, 'CS-0007'))
+    db.session.commit()
+
+
+def main():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': DATABASE_URL})
+    client = app.test_client()
+    failed = False
+
+    with app.app_context():
+        db.drop_all()  # a CHECK_DATABASE_URL database is reused between runs
+        db.create_all()
+        run_migrations()
+        workload(client)
+        db.session.remove()
+
+        for agency_id in (None, 'agn001', 'agn002', 'agn003'):
+            expected, actual = live_totals(agency_id), stats.totals_by_status(db.session, agency_id)
+            ok = expected == actual
+            failed = failed or not ok
+            print(f"{'ok  ' if ok else 'FAIL'} totals for {agency_id or 'all agencies'}")
+            if not ok:
+                print(f"       live     {expected}\n       case_stat {actual}")
+
+        response = client.get('/api/dashboard/stats').get_json()
+        ok = response['totalCases'] == CASES - 1 and response['resolvedCases'] == 1
+        failed = failed or not ok
+        print(f"{'ok  ' if ok else 'FAIL'} /api/dashboard/stats: {response}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+Checks the change events of services/events.py end to end: writes through the
+API reach /api/events streams, the endpoints creating cases and timeline
+events answer with their status and publish them, an agency user only sees
+its own agency's events, closed streams unsubscribe, and with
+EVENT_BUS_BACKEND=database an
+event published by one app (gunicorn worker) reaches a stream held by another
+while events published before a stream opened aren't replayed to it.
+Exits 1 on failure.
+
+    cd backend && python -m testing.check_events
+"""
+import json
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from app import create_app
+from models import db, Agency
+from routes import event_routes
+from services.events import get_bus
+from testing.check_query_counts import seed
+
+# an idle stream yields a heartbeat this often, so readers notice they were told to stop
+event_routes.HEARTBEAT_SECONDS = 0.2
+
+WAIT_SECONDS = 5
+
+
+class Stream:
+    """an /api/events response read on a thread, events land in .events"""
+
+    def __init__(self, client, query):
+        self.response = client.get(f'/api/events?{query}', buffered=False)
+        self.events = queue.Queue()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        if self.response.status_code == 200:
+            self.thread.start()
+
+    def _read(self):
+        body = self.response.response
+        for chunk in body:
+            frame = chunk.decode() if isinstance(chunk, bytes) else chunk
+            fields = dict(line.split(': ', 1) for line in frame.strip().splitlines() if not line.startswith(':'))
+            if 'data' in fields:
+                self.events.put(json.loads(fields['data']))
+            if self.stop.is_set():
+                break
+        body.close()  # runs the generator's finally, like a client going away
+
+    def collect(self, seconds=0.5):
+        """events received so far, after giving late ones a moment"""
+        time.sleep(seconds)
+        events = []
+        while not self.events.empty():
+            events.append(self.events.get())
+        return events
+
+    def wait_for(self, event_type):
+        deadline = time.monotonic() + WAIT_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                event = self.events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if event['type'] == event_type:
+                return event
+        return None
+
+    def close(self):
+        self.stop.set()
+        self.thread.join(WAIT_SECONDS)
+
+
+def login(client, email, password):
+    return client.post('/api/auth/login', json={'email': email, 'password': password}).get_json()['token']
+
+
+def ticket(client, token):
+    """?ticket= opening one stream, like the frontend gets before every (re)connect"""
+    response = client.post('/api/events/ticket', headers={'Authorization': f'Bearer {token}'})
+    return f"ticket={response.get_json()['ticket']}"
+
+
+def report(ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    return not ok
+
+
+def check_memory(path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'EVENT_BUS_BACKEND': 'memory'})
+    client = app.test_client()
+    failed = False
+    with app.app_context():
+        seed()
+        db.session.get(Agency, 'agn001').email = 'ops@agency1.example'
+        db.session.commit()
+
+    admin = login(client, 'admin@fedex.com', 'fedex123')
+    failed |= report(client.get('/api/events?ticket=session-bogus').status_code == 401, 'unknown ticket is refused')
+    failed |= report(client.get(f'/api/events?token={admin}').status_code == 401,
+                     'a session token in the query string is refused, it would be logged')
+    used = ticket(client, admin)
+    Stream(client, used).close()
+    failed |= report(client.get(f'/api/events?{used}').status_code == 401, 'a ticket opens one stream only')
+    failed |= report(client.get('/api/auth/me', headers={'Authorization': f"Bearer {ticket(client, admin)[7:]}"})
+                     .status_code == 401, 'a ticket is no login token')
+
+    fedex = Stream(client, ticket(client, admin))
+    agency = Stream(client, ticket(client, login(client, 'ops@agency1.example', 'dca@agn001')))
+    timeline_only = Stream(client, f"{ticket(client, admin)}&types=timeline.added")
+
+    # CS-0000 is agn001's, the n8n batch assigns its new case elsewhere
+    client.post('/api/cases/CS-0000/timeline', json={'eventType': 'call', 'title': 'Called', 'actor': 'dca'})
+    client.post('/api/n8n/add-cases', json=[{'invoice_id': 'INV-EVT-1', 'account_number': 'ACCT-1',
+                                             'customer_name': 'Global Logistics Inc', 'amount_due': '50',
+                                             'assigned_dca': 'agn002', 'reasoning': 'check'}])
+    client.get('/api/n8n/process-done?batch=check')
+
+    seen = fedex.collect()
+    types = [event['type'] for event in seen]
+    expected = ['timeline.added', 'case.created', 'case.assigned', 'n8n.done']
+    failed |= report(types == expected, f'fedex stream got {types}')
+    assigned = next((event for event in seen if event['type'] == 'case.assigned'), {})
+    failed |= report(assigned.get('agencyId') == 'agn002' and assigned['data']['caseIds'] == ['INV-EVT-1'],
+                     'case.assigned names the agency and case')
+
+    types = [event['type'] for event in agency.collect(0)]
+    failed |= report(types == ['timeline.added'], f"agn001's stream only got its own case's event: {types}")
+    types = [event['type'] for event in timeline_only.collect(0)]
+    failed |= report(types == ['timeline.added'], f'?types= filters the stream: {types}')
+
+    for stream in (fedex, agency, timeline_only):
+        stream.close()
+    subscribers = len(get_bus(app).subscribers)
+    failed |= report(subscribers == 0, f'closed streams unsubscribed ({subscribers} left)')
+    with app.app_context():
+        db.engine.dispose()
+    return failed
+
+
+def check_writes(path):
+    # each endpoint creating a case or timeline event answers 201 / 200 and publishes it
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'EVENT_BUS_BACKEND': 'memory'})
+    client = app.test_client()
+    with app.app_context():
+        seed()
+    stream = Stream(client, ticket(client, login(client, 'admin@fedex.com', 'fedex123')))
+
+    failed = False
+    writes = [
+        ('/api/cases', {'customerName': 'Acme Freight', 'amount': 1200}, 201, 'case.created'),
+        ('/api/cases/CS-0001/email', {'subject': 'Reminder', 'body': 'Please pay'}, 200, 'timeline.added'),
+        ('/api/cases/CS-0001/call', {'notes': 'Left a voicemail'}, 200, 'timeline.added'),
+        ('/api/actions/timeline', {'caseId': 'CS-0001', 'title': 'Note', 'description': 'Promised to pay'},
+         201, 'timeline.added'),
+    ]
+    for url, body, status, event_type in writes:
+        response = client.post(url, json=body)
+        event = stream.wait_for(event_type)
+        failed |= report(response.status_code == status and event is not None,
+                         f'POST {url} answered {response.status_code} and published {event_type}')
+    stream.close()
+    with app.app_context():
+        db.engine.dispose()
+    return failed
+
+
+def check_database(path):
+    # two apps on one database, like two gunicorn workers
+    config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'EVENT_BUS_BACKEND': 'database'}
+    publisher, listener = create_app(config), create_app(config)
+    with publisher.app_context():
+        seed()
+    client = listener.test_client()
+    token = login(client, 'admin@fedex.com', 'fedex123')
+    stream = Stream(client, f"{ticket(client, token)}&case_id=CS-0001")
+
+    publisher.test_client().post('/api/cases/CS-0001/timeline',
+                                 json={'eventType': 'call', 'title': 'Called', 'actor': 'fedex'})
+    event = stream.wait_for('timeline.added')
+    failed = report(event is not None and event['caseId'] == 'CS-0001',
+                    'database backend: an event published by one app reached the other')
+    stream.close()
+
+    # published while nobody listens: the next stream must not get them replayed
+    with publisher.app_context():
+        for i in range(5):
+            get_bus(publisher).publish('n8n.done', {'batch': f'idle-{i}'})
+    time.sleep(event_routes.HEARTBEAT_SECONDS + 0.5)  # the poller has had its chance to run
+    stream = Stream(client, f'{ticket(client, token)}&types=n8n.done')
+    with publisher.app_context():
+        get_bus(publisher).publish('n8n.done', {'batch': 'live'})
+    seen = [event['data']['batch'] for event in [stream.wait_for('n8n.done')] + stream.collect() if event]
+    failed |= report(seen == ['live'], f'database backend: a new stream gets no events from before it opened: {seen}')
+    stream.close()
+    for app in (publisher, listener):
+        with app.app_context():
+            db.engine.dispose()
+    return failed
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        failed = check_memory(os.path.join(directory, 'memory.db'))
+        failed |= check_writes(os.path.join(directory, 'writes.db'))
+        failed |= check_database(os.path.join(directory, 'database.db'))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
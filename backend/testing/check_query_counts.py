@@ -0,0 +1,67 @@
+"""
+Asserts the number of SQL queries the case list endpoints run, so an N+1 lazy
+load can't sneak back in. Runs against an in-memory db, or CHECK_DATABASE_URL
+(e.g. a local Postgres, emptied first), exits 1 on failure.
+
+    cd backend && python -m testing.check_query_counts
+"""
+import os
+import sys
+from sqlalchemy import event
+from app import create_app
+from models import db, Agency, Customer, Case
+
+DATABASE_URL = os.getenv('CHECK_DATABASE_URL', 'sqlite://')
+
+# case rows seeded per agency / customer, big enough that N+1 would show
+CASES = 30
+
+# endpoint -> max queries, independent of how many cases are listed
+EXPECTED = {
+    '/api/cases?limit=50': 2,  # page + count
+    '/api/agencies/agn001/cases': 2,  # agency lookup + cases joined with agency
+    '/api/customers/ACCT-1/cases': 2,  # customer lookup + cases joined with agency
+}
+
+
+def seed():
+    db.drop_all()  # a CHECK_DATABASE_URL database is reused between runs
+    db.create_all()
+    db.session.add_all([
+        Agency(id=f'agn{i:03d}', name=f'Agency {i}', capacity=100, current_capacity=0)
+        for i in range(1, 4)
+    ])
+    db.session.add(Customer(account_number='ACCT-1', customer_name='Global Logistics Inc'))
+    db.session.add_all([
+        Case(id=f'CS-{i:04d}', customer_name='Global Logistics Inc', customer_account_number='ACCT-1',
+             invoice_amount=1000, recovered_amount=0, status='assigned',
+             assigned_agency_id=f'agn{i % 3 + 1:03d}' if i % 2 else 'agn001')
+        for i in range(CASES)
+    ])
+    db.session.commit()
+
+
+def main():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': DATABASE_URL})
+    client = app.test_client()
+    failed = False
+
+    with app.app_context():
+        seed()
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+        for url, expected in EXPECTED.items():
+            statements.clear()
+            db.session.remove()  # start from an empty identity map, like a real request
+            response = client.get(url)
+            count = len(statements)
+            ok = response.status_code == 200 and count <= expected
+            failed = failed or not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {url}: {count} queries (max {expected}), status {response.status_code}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
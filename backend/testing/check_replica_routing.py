@@ -0,0 +1,82 @@
+"""
+Checks the read replica routing of services/storage.py: the SELECTs of
+@read_only endpoints go to the replica bind, writes stay on the primary.
+The primary and the replica are two SQLite files standing in for a Postgres
+primary / streaming replica pair, the replica being a copy taken before the
+last write so replica reads are recognisable. Exits 1 on failure.
+
+    cd backend && python -m testing.check_replica_routing
+"""
+import os
+import shutil
+import sys
+import tempfile
+from sqlalchemy import event
+from app import create_app
+from models import db, Case
+from services.storage import REPLICA_BIND
+from testing.check_query_counts import seed
+
+# endpoint -> whether it may read from the replica
+EXPECTED = {
+    ('GET', '/api/cases?limit=50'): True,
+    ('GET', '/api/cases/CS-0001'): True,
+    ('GET', '/api/cases/CS-0001/timeline'): True,
+    ('GET', '/api/agencies/agn001/cases'): True,
+    ('GET', '/api/customers/ACCT-1/cases'): True,
+    ('GET', '/api/dashboard/stats'): True,
+    ('POST', '/api/cases/CS-0001/timeline'): False,
+    ('PUT', '/api/cases/CS-0002'): False,
+}
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    primary, replica = os.path.join(directory, 'primary.db'), os.path.join(directory, 'replica.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{primary}', 'DATABASE_REPLICA_URL': f'sqlite:///{replica}'})
+    client = app.test_client()
+    failed = False
+
+    with app.app_context():
+        seed()
+        db.engine.dispose()
+        shutil.copy(primary, replica)
+        # only on the primary, like a write the replica hasn't replayed yet
+        db.session.add(Case(id='CS-LAG', customer_name='Lagging Ltd', customer_account_number='ACCT-1',
+                            invoice_amount=10, recovered_amount=0, status='pending'))
+        db.session.commit()
+        db.session.remove()
+
+        counts = {}
+        for bind, engine in db.engines.items():
+            event.listen(engine, 'before_cursor_execute',
+                         lambda *args, bind=bind: counts.__setitem__(bind, counts.get(bind, 0) + 1))
+
+        for (method, url), replica_allowed in EXPECTED.items():
+            counts.clear()
+            db.session.remove()  # start from an empty identity map, like a real request
+            body = {'eventType': 'call', 'title': 'Check', 'actor': 'fedex', 'description': 'replica check'} \
+                if method == 'POST' else {'status': 'in_progress'} if method == 'PUT' else None
+            response = client.open(url, method=method, json=body)
+            on_replica, on_primary = counts.get(REPLICA_BIND, 0), counts.get(None, 0)
+            ok = response.status_code < 400 and (on_replica > 0 if replica_allowed else on_replica == 0)
+            failed = failed or not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {method} {url}: {on_replica} replica / {on_primary} primary queries, "
+                  f"status {response.status_code}")
+
+        # the replica doesn't have the lagging case yet, a write endpoint sees it on the primary
+        db.session.remove()
+        read = client.get('/api/cases/CS-LAG').status_code
+        write = client.put('/api/cases/CS-LAG', json={'status': 'in_progress'}).status_code
+        ok = read == 404 and write == 200
+        failed = failed or not ok
+        print(f"{'ok  ' if ok else 'FAIL'} lagging write: GET {read} from the replica, PUT {write} on the primary")
+
+        for engine in db.engines.values():
+            engine.dispose()
+    shutil.rmtree(directory, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
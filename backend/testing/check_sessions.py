@@ -0,0 +1,144 @@
+"""
+Checks services/sessions.py through the auth endpoints, for every
+SESSION_BACKEND: login / me / refresh / logout, expiry after SESSION_TTL,
+LRU eviction of the memory backend, tampered signed tokens, the signed
+backend refusing the default SECRET_KEY, and sessions of
+the database backend being shared by two apps (gunicorn workers). Prints the
+cost of a token lookup per backend. The redis backend is checked when the
+redis package is installed and SESSION_REDIS_URL answers. Exits 1 on failure.
+
+    cd backend && python -m testing.check_sessions
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from app import create_app
+from models import db
+from services.sessions import DEV_SECRET_KEY, get_store
+
+ADMIN = {'email': 'admin@fedex.com', 'password': 'fedex123'}
+
+LOOKUPS = 2000
+
+
+def report(ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    return not ok
+
+
+def make_app(path, backend, **config):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'SESSION_BACKEND': backend, **config})
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def me(client, token):
+    return client.get('/api/auth/me', headers={'Authorization': f'Bearer {token}'}).status_code
+
+
+def check_backend(path, backend):
+    app = make_app(path, backend, SECRET_KEY='check-sessions-secret')
+    client = app.test_client()
+    stateless = backend == 'signed'
+    failed = False
+
+    token = client.post('/api/auth/login', json=ADMIN).get_json()['token']
+    failed |= report(me(client, token) == 200, f'{backend}: a fresh token is accepted')
+    failed |= report(me(client, token + 'x') == 401, f'{backend}: an altered token is refused')
+
+    refreshed = client.post('/api/auth/refresh', headers={'Authorization': f'Bearer {token}'}).get_json()['token']
+    old, new = me(client, token), me(client, refreshed)
+    # a signed token can't be revoked, it stays valid until it expires
+    failed |= report(new == 200 and old == (200 if stateless else 401),
+                     f'{backend}: refresh issues a new token, the old one answers {old}')
+
+    client.post('/api/auth/logout', headers={'Authorization': f'Bearer {refreshed}'})
+    status = me(client, refreshed)
+    failed |= report(status == (200 if stateless else 401), f'{backend}: after logout the token answers {status}')
+
+    store = get_store(app)
+    token = store.create({'id': 'bench', 'role': 'fedex'})
+    started = time.perf_counter()
+    with app.app_context():
+        for _ in range(LOOKUPS):
+            store.get(token)
+    print(f'     {backend}: {(time.perf_counter() - started) / LOOKUPS * 1e6:.1f} us per token lookup')
+
+    short = make_app(path, backend, SECRET_KEY='check-sessions-secret', SESSION_TTL=1)
+    client = short.test_client()
+    token = client.post('/api/auth/login', json=ADMIN).get_json()['token']
+    time.sleep(1.2)
+    failed |= report(me(client, token) == 401, f'{backend}: a token is refused after SESSION_TTL')
+
+    for each in (app, short):
+        with each.app_context():
+            db.engine.dispose()
+    return failed
+
+
+def check_signed_key(path):
+    try:
+        make_app(path, 'signed', SECRET_KEY=DEV_SECRET_KEY)
+        refused = False
+    except RuntimeError:
+        refused = True
+    return report(refused, 'signed: refuses to start with the default SECRET_KEY')
+
+
+def check_lru(path):
+    app = make_app(path, 'memory', SESSION_MAX_ENTRIES=2)
+    client = app.test_client()
+    first, second = (client.post('/api/auth/login', json=ADMIN).get_json()['token'] for _ in range(2))
+    me(client, first)  # used, so second is now the least recently used
+    client.post('/api/auth/login', json=ADMIN)
+    failed = report(me(client, first) == 200 and me(client, second) == 401,
+                    'memory: past SESSION_MAX_ENTRIES the least recently used session is evicted')
+    with app.app_context():
+        db.engine.dispose()
+    return failed
+
+
+def check_shared(path):
+    # two apps on one database, like two gunicorn workers
+    login_app, other = make_app(path, 'database'), make_app(path, 'database')
+    token = login_app.test_client().post('/api/auth/login', json=ADMIN).get_json()['token']
+    failed = report(me(other.test_client(), token) == 200, 'database: a login on one app is known to the other')
+    other.test_client().post('/api/auth/logout', headers={'Authorization': f'Bearer {token}'})
+    failed |= report(me(login_app.test_client(), token) == 401, 'database: a logout on one app ends it on the other')
+    for app in (login_app, other):
+        with app.app_context():
+            db.engine.dispose()
+    return failed
+
+
+def redis_available():
+    try:
+        import redis
+        redis.Redis.from_url(os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0')).ping()
+        return True
+    except Exception:
+        return False
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    failed = False
+    try:
+        backends = ['memory', 'database', 'signed'] + (['redis'] if redis_available() else [])
+        for backend in backends:
+            failed |= check_backend(os.path.join(directory, f'{backend}.db'), backend)
+        if 'redis' not in backends:
+            print('skip redis: the redis package isn\'t installed or SESSION_REDIS_URL doesn\'t answer')
+        failed |= check_signed_key(os.path.join(directory, 'key.db'))
+        failed |= check_lru(os.path.join(directory, 'lru.db'))
+        failed |= check_shared(os.path.join(directory, 'shared.db'))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
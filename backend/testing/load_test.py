@@ -0,0 +1,125 @@
+"""
+Load test of a running server: concurrent clients hit the main read
+endpoints (plus an n8n write mix) for a while, then requests per second and
+p50 / p99 latency are reported per endpoint. Exits 1 when a request failed.
+
+    cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+    python -m testing.load_test --url http://127.0.0.1:5000 --clients 32 --seconds 30
+
+Point it at a seeded database (testing/seed.py), never at production: the
+write mix creates cases (LOADTEST-*) and timeline events.
+"""
+import argparse
+import itertools
+import random
+import sys
+import threading
+import time
+import requests
+
+# (name, method, path, weight), case and agency ids are filled from the server's own data
+ENDPOINTS = [
+    ('dashboard stats', 'GET', '/api/dashboard/stats', 4),
+    ('recovery series', 'GET', '/api/stats/recovery', 2),
+    ('agency performance', 'GET', '/api/performance/agencies', 1),
+    ('case list', 'GET', '/api/cases?limit=50', 4),
+    ('case list search', 'GET', '/api/cases?limit=50&search=a', 1),
+    ('case detail', 'GET', '/api/cases/{case_id}', 3),
+    ('case timeline', 'GET', '/api/cases/{case_id}/timeline?view=summary&limit=50', 3),
+    ('agency cases', 'GET', '/api/agencies/{agency_id}/cases', 1),
+    ('search', 'GET', '/api/search?q=a', 1),
+    ('n8n add case', 'POST', '/api/n8n/add-case', 1),
+]
+
+
+def percentile(latencies, share):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * share))]
+
+
+def sample_ids(base_url):
+    """ids of existing cases / agencies to request"""
+    cases = requests.get(f'{base_url}/api/cases?limit=200', timeout=30).json()
+    cases = cases.get('cases', cases) if isinstance(cases, dict) else cases
+    agencies = requests.get(f'{base_url}/api/agencies', timeout=30).json()
+    if not cases or not agencies:
+        raise SystemExit('the server has no cases / agencies to request, seed it first (python -m testing.seed)')
+    return [c['id'] for c in cases], [a['id'] for a in agencies]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the main endpoints of a running server')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent connections')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--no-writes', action='store_true', help='leave out the n8n write mix')
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/')
+    case_ids, agency_ids = sample_ids(base_url)
+    endpoints = [e for e in ENDPOINTS if not (args.no_writes and e[1] != 'GET')]
+    weighted = [e for e in endpoints for _ in range(e[3])]
+    new_ids = itertools.count()
+
+    latencies = {name: [] for name, *_ in endpoints}
+    errors = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def client():
+        session = requests.Session()  # keep-alive, like a browser
+        while not stop.is_set():
+            name, method, path, _ = random.choice(weighted)
+            url = base_url + path.format(case_id=random.choice(case_ids), agency_id=random.choice(agency_ids))
+            body = None
+            if method == 'POST':
+                i = next(new_ids)
+                body = {'invoice_id': f'LOADTEST-{time.time_ns()}-{i}', 'account_number': f'LOADTEST-{i % 50}',
+                        'customer_name': f'Load Test {i % 50}', 'amount_due': '120.50',
+                        'assigned_dca': random.choice(agency_ids), 'reasoning': 'load test'}
+            start = time.perf_counter()
+            try:
+                response = session.request(method, url, json=body, timeout=60)
+                failure = None if response.status_code < 400 else f'status {response.status_code}'
+            except requests.RequestException as e:
+                failure = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                if failure:
+                    errors[(name, failure)] = errors.get((name, failure), 0) + 1
+                else:
+                    latencies[name].append(elapsed)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(args.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    print(f'{base_url}, {args.clients} clients, {duration:.1f}s\n')
+    print(f"{'endpoint':<22}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    everything = []
+    for name, *_ in endpoints:
+        done = sorted(latencies[name])
+        everything += done
+        failed = sum(count for (endpoint, _), count in errors.items() if endpoint == name)
+        if not done:
+            print(f'{name:<22}{0:>10}{0:>9.1f}{"-":>9}{"-":>9}{failed:>8}')
+            continue
+        print(f'{name:<22}{len(done):>10}{len(done) / duration:>9.1f}{percentile(done, 0.5) * 1000:>9.1f}'
+              f'{percentile(done, 0.99) * 1000:>9.1f}{failed:>8}')
+    everything.sort()
+    if everything:
+        print(f"{'total':<22}{len(everything):>10}{len(everything) / duration:>9.1f}"
+              f"{percentile(everything, 0.5) * 1000:>9.1f}{percentile(everything, 0.99) * 1000:>9.1f}"
+              f"{sum(errors.values()):>8}")
+    for (name, failure), count in sorted(errors.items()):
+        print(f'    {name}: {failure} x{count}')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
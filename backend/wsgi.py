@@ -0,0 +1,11 @@
+"""
+Production entry point, served by gunicorn with the settings in gunicorn.conf.py:
+
+    cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+
+Every worker process imports this module and builds its own app (engines,
+pools, job runner), nothing is shared across the fork.
+"""
+from app import create_app
+
+app = create_app()
@@ -9,6 +9,7 @@ import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContaine
 import { dashboardService, type DashboardStats } from '@/services/dashboardService'
 import { caseService, type Case } from '@/services/caseService'
 import { agencyService, type Agency } from '@/services/agencyService'
+import { eventService } from '@/services/eventService'
 import { useUIStore } from '@/stores'
 import api from '@/services/api'
 
@@ -67,14 +68,30 @@ export function Dashboard() {
     }
   }
   
-  // Simulate live updates every 30 seconds
+  // Live updates pushed by the backend, a burst of events (an import) refreshes once
   useEffect(() => {
-    const interval = setInterval(() => {
-      setLastUpdate(new Date())
-      fetchDashboardData() // Refresh data
-    }, 30000)
-    
-    return () => clearInterval(interval)
+    let refresh: ReturnType<typeof setTimeout> | undefined
+    const scheduleRefresh = () => {
+      clearTimeout(refresh)
+      refresh = setTimeout(() => {
+        setLastUpdate(new Date())
+        fetchDashboardData() // Refresh data
+      }, 1000)
+    }
+    // the first open follows the initial fetch, a reconnect may have missed events
+    let connected = false
+    const unsubscribe = eventService.subscribe(scheduleRefresh, {
+      types: ['case.created', 'case.assigned', 'timeline.added', 'n8n.done'],
+      onOpen: () => {
+        if (connected) scheduleRefresh()
+        connected = true
+      }
+    })
+
+    return () => {
+      clearTimeout(refresh)
+      unsubscribe()
+    }
   }, [])
 
   // Get new unassigned cases
@@ -158,10 +175,7 @@ export function Dashboard() {
       const formData = new FormData()
       formData.append('file', file)
       
-      // OPTION 1: Multi-stage async workflow (Upload → AI Processing → Assignment)
-      // Uncomment this block for multi-request workflow
-      /*
-      // Step 1: Upload file (returns immediately with task_id)
+      // Step 1: Upload file (returns immediately with task_id, the import runs as a background job)
       const uploadResponse = await api.post('/actions/upload', formData, {
         headers: { 'Content-Type': 'multipart/form-data' },
       })
@@ -170,13 +184,12 @@ export function Dashboard() {
       setProgressStatus('received')
       
       // Step 2: Connect to SSE for progress updates
-      const token = localStorage.getItem('token')
       const apiBaseUrl = import.meta.env.VITE_API_BASE_URL || 'http://localhost:5000/api'
-      const eventSource = new EventSource(`${apiBaseUrl}/actions/progress/${task_id}?token=${token}`)
+      const eventSource = new EventSource(`${apiBaseUrl}/actions/progress/${task_id}`)
       
       eventSource.onmessage = (event) => {
         const data = JSON.parse(event.data)
-        setProgressStatus(data.status)
+        if (data.status !== 'error') setProgressStatus(data.status)
         
         if (data.currentAssigned !== undefined && data.totalRows !== undefined) {
           setProgressData(data.currentAssigned, data.totalRows)
@@ -185,6 +198,9 @@ export function Dashboard() {
         if (data.status === 'done') {
           eventSource.close()
           showToast(data.message || `Successfully imported ${data.cases_created} case(s)`, 'success')
+          if (data.errors && data.errors.length > 0) {
+            console.warn('Import warnings:', data.errors)
+          }
           fetchDashboardData()
           if (fileInputRef.current) fileInputRef.current.value = ''
           setIsUploading(false)
@@ -198,79 +214,18 @@ export function Dashboard() {
         }
       }
       
+      // the job keeps running server side, only the progress stream is lost
       eventSource.onerror = () => {
         eventSource.close()
-        showToast('Connection error', 'error')
-        useUIStore.getState().resetProgress()
+        showToast('Lost connection to upload progress, the import continues in the background', 'error')
         setIsUploading(false)
       }
-      
-      // Step 3: Trigger AI processing (this could be automatic or manual)
-      // For automatic processing:
-      await api.post(`/actions/process/${task_id}`)
-      
-      // OR for manual trigger, you could have a button that calls:
-      // api.post(`/actions/process/${task_id}`)
-      */
-      
-      // OPTION 2: Simulated Progress (for testing UI without backend)
-      // Comment out this block when using multi-stage workflow above
-      
-      // Progress stage timeouts - comment out for real-time updates
-      // Stage 1: Simulate file received
-      await new Promise(resolve => setTimeout(resolve, 800))
-      setProgressStatus('received')
-      
-      // Stage 2: Simulate processing
-      await new Promise(resolve => setTimeout(resolve, 1000))
-      setProgressStatus('processing')
-      
-      const response = await api.post('/actions/upload', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        },
-      }) 
-
-      const { message, cases_created, errors } = response.data
-      
-      // Stage 3: Simulate assignment progress
-      setProgressStatus('assigning')
-      setProgressData(0, cases_created || 0)
-      
-      // Simulate incremental assignment - comment out for real-time backend updates
-      let assignedCount = 0
-      const totalCases = cases_created || 0
-      const assignmentInterval = setInterval(() => {
-        assignedCount += Math.ceil(totalCases / 10)
-        if (assignedCount >= totalCases) {
-          assignedCount = totalCases
-          clearInterval(assignmentInterval)
-          // Stage 4: Mark as done
-          setProgressStatus('done')
-        }
-        setProgressData(assignedCount, totalCases)
-      }, 300)
-      
-      showToast(message || `Successfully imported ${cases_created} case(s)`, 'success')
-      
-      if (errors && errors.length > 0) {
-        console.warn('Import warnings:', errors)
-      }
-      
-      // Refresh dashboard data
-      fetchDashboardData()
-      
-      // Reset file input
-      if (fileInputRef.current) {
-        fileInputRef.current.value = ''
-      }
     } catch (error: any) {
       console.error('Error uploading file:', error)
       const errorMessage = error.response?.data?.error || 'Failed to upload file'
       showToast(errorMessage, 'error')
       // Reset progress on error
       useUIStore.getState().resetProgress()
-    } finally {
       setIsUploading(false)
     }
   }
@@ -34,16 +34,33 @@ export interface TimelineEvent {
   user?: string;
 }
 
+export interface TimelinePage {
+  events: TimelineEvent[]; // oldest first
+  before: string | null; // older history, null once the oldest event was returned
+  since: string | null; // poll for events added after this page
+}
+
+export interface TimelineQueryParams {
+  limit?: number;
+  before?: string;
+  since?: string;
+}
+
 export interface CasesResponse {
   cases: Case[];
   total: number;
   pages: number;
   current_page: number;
+  // cursor mode (pass `cursor`, '' for the first page)
+  next_cursor?: string | null;
+  total_is_lower_bound?: boolean;
 }
 
 export interface CaseQueryParams {
   page?: number;
   limit?: number;
+  cursor?: string;
+  total?: 'exact' | 'approx';
   search?: string;
   status?: string;
 }
@@ -103,6 +120,14 @@ export const caseService = {
     return response.data;
   },
 
+  /**
+   * Get one page of a case's timeline, newest events unless a cursor is given
+   */
+  async getCaseTimelinePage(caseId: string, params: TimelineQueryParams = {}): Promise<TimelinePage> {
+    const response = await api.get(`/cases/${caseId}/timeline`, { params: { limit: 100, ...params } });
+    return response.data;
+  },
+
   /**
    * Log an email sent for a case
    */
@@ -22,11 +22,16 @@ export interface CustomersResponse {
   total: number;
   pages: number;
   current_page: number;
+  // cursor mode (pass `cursor`, '' for the first page)
+  next_cursor?: string | null;
+  total_is_lower_bound?: boolean;
 }
 
 export interface CustomerQueryParams {
   page?: number;
   limit?: number;
+  cursor?: string;
+  total?: 'exact' | 'approx';
   search?: string;
 }
 
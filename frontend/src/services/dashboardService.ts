@@ -12,8 +12,10 @@ export interface DashboardStats {
 }
 
 export interface RecoveryStats {
+  bucket: string; // YYYY-MM-DD, YYYY-Www, YYYY-MM or YYYY depending on granularity
   month: string;
   recovered: number;
+  payments: number;
 }
 
 // Dashboard Services
@@ -0,0 +1,72 @@
+import api from './api';
+
+// Types
+export type ChangeEventType = 'case.created' | 'case.assigned' | 'timeline.added' | 'job.progress' | 'n8n.done';
+
+export interface ChangeEvent {
+  id: number;
+  type: ChangeEventType;
+  agencyId: string | null;
+  caseId: string | null;
+  data: Record<string, any>;
+  timestamp: string;
+}
+
+export interface SubscribeOptions {
+  types?: ChangeEventType[];
+  caseId?: string;
+  agencyId?: string; // FedEx users only, agency users always get their own agency's events
+  onOpen?: () => void; // (re)connected, events missed meanwhile aren't replayed so refresh here
+}
+
+// a dropped stream is reopened after this long, with a fresh ticket
+const RECONNECT_MS = 3000;
+
+// Event Services
+export const eventService = {
+  /**
+   * Listen to change events pushed by the backend (/api/events) instead of polling
+   * @returns a function closing the stream
+   */
+  subscribe(onEvent: (event: ChangeEvent) => void, options: SubscribeOptions = {}): () => void {
+    const apiBaseUrl = import.meta.env.VITE_API_BASE_URL || 'http://localhost:5000/api';
+    const types: ChangeEventType[] = options.types?.length
+      ? options.types
+      : ['case.created', 'case.assigned', 'timeline.added', 'job.progress', 'n8n.done'];
+    const listener = (message: MessageEvent) => onEvent(JSON.parse(message.data));
+    let eventSource: EventSource | null = null;
+    let retry: ReturnType<typeof setTimeout> | undefined;
+    let closed = false;
+
+    const connect = async () => {
+      try {
+        // EventSource can't send the Authorization header and a token in the url ends up in
+        // access logs, a single-use ticket opens the stream instead
+        const { data } = await api.post<{ ticket: string }>('/events/ticket');
+        if (closed) return;
+        const params = new URLSearchParams({ ticket: data.ticket });
+        if (options.types?.length) params.set('types', options.types.join(','));
+        if (options.caseId) params.set('case_id', options.caseId);
+        if (options.agencyId) params.set('agency_id', options.agencyId);
+
+        eventSource = new EventSource(`${apiBaseUrl}/events?${params}`);
+        types.forEach((type) => eventSource!.addEventListener(type, listener));
+        if (options.onOpen) eventSource.onopen = options.onOpen;
+        // the browser would reconnect with the used-up ticket, reconnect with a new one instead
+        eventSource.onerror = () => {
+          eventSource?.close();
+          if (!closed) retry = setTimeout(connect, RECONNECT_MS);
+        };
+      } catch {
+        if (!closed) retry = setTimeout(connect, RECONNECT_MS);
+      }
+    };
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      eventSource?.close();
+    };
+  },
+};